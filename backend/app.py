@@ -1,5 +1,4 @@
 import os
-import requests
 import json
 import logging
 from flask import Flask, request, jsonify, Response
@@ -9,9 +8,28 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 
 import time
+import math
+import hashlib
+import asyncio
+import queue
 import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from openai import OpenAI
+from llm_client import LLMClientRegistry, AsyncLLMClientRegistry, ARK_BASE_URL
+from llm_cache import LLMResponseCache, LLMResponseRecorder, response_cache_key
+from delta_coalescer import DeltaCoalescer
+from wiki_crawler import WikiCrawler, AsyncWikiCrawler, CrawlCancelled
+from metrics import MetricsRegistry
+from log_pipeline import start_queue_logging, stop_queue_logging, set_field_limit, log_payload, log_headers
+from feishu_client import FeishuClient, AsyncFeishuClient, FeishuRequestError, raise_for_status, response_code, endpoint_name, FEISHU_BASE_URL
+from rate_limit import FeishuRateLimiter, AIMDController
+from tree_cache import WikiTreeCache, CachedTree, node_signature, scoped_key
+from wiki_tree import iter_tree_batches, iter_markdown_outline, find_node
+from prompt_budget import fit_placeholders
+from prompt_template import compile_template
+from doc_cache import DocumentCache
+from node_resolver import NodeResolver
+from crawl_hub import CrawlHub
+from crawl_jobs import CrawlJobStore, JobReplay, job_summary
 
 load_dotenv() # Load environment variables from .env file
 
@@ -21,6 +39,83 @@ BACKEND_PORT = os.getenv('BACKEND_PORT', 5001)
 FEISHU_APP_ID = os.getenv('FEISHU_APP_ID')
 FEISHU_APP_SECRET = os.getenv('FEISHU_APP_SECRET')
 
+# --- Metrics ---
+# 进程内的指标，由 /api/admin/metrics 以 Prometheus 文本格式输出
+metrics = MetricsRegistry()
+feishu_request_seconds = metrics.histogram(
+    'feishu_request_duration_seconds', 'Feishu API call latency (excluding rate limiter wait)', ['endpoint'])
+feishu_requests_total = metrics.counter(
+    'feishu_requests_total', 'Feishu API calls by HTTP status and Feishu error code', ['endpoint', 'status', 'code'])
+feishu_rate_limit_wait_seconds = metrics.histogram(
+    'feishu_rate_limit_wait_seconds', 'Time spent waiting for rate limiter quota before a Feishu call', ['endpoint'],
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+feishu_retries_total = metrics.counter(
+    'feishu_retries_total', 'Retries scheduled by request_with_backoff', ['endpoint', 'reason'])
+crawl_pages_total = metrics.counter('wiki_crawl_pages_total', 'Node list pages fetched by crawls', ['engine'])
+crawl_nodes_total = metrics.counter('wiki_crawl_nodes_total', 'Nodes fetched by crawls', ['engine'])
+crawl_failed_pages_total = metrics.counter('wiki_crawl_failed_pages_total', 'Node list pages that failed after retries', ['engine'])
+crawl_duration_seconds = metrics.histogram(
+    'wiki_crawl_duration_seconds', 'Crawl duration', ['engine', 'outcome'],
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0))
+crawl_pages_per_second = metrics.gauge('wiki_crawl_pages_per_second', 'Page throughput of the last finished crawl', ['engine'])
+crawl_nodes_per_second = metrics.gauge('wiki_crawl_nodes_per_second', 'Node throughput of the last finished crawl', ['engine'])
+llm_first_token_seconds = metrics.histogram(
+    'llm_time_to_first_token_seconds', 'Time from LLM call to the first streamed delta', ['stream'])
+llm_stream_seconds = metrics.histogram(
+    'llm_stream_duration_seconds', 'LLM streaming call duration', ['stream', 'outcome'],
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+llm_tokens_per_second = metrics.histogram(
+    'llm_tokens_per_second', 'LLM output speed after the first token (streamed deltas per second)', ['stream'],
+    buckets=(1.0, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0, 320.0))
+llm_tokens_total = metrics.counter('llm_stream_tokens_total', 'Streamed LLM deltas (reasoning and content)', ['stream'])
+llm_events_total = metrics.counter('llm_sse_events_total', 'SSE events sent for LLM deltas after coalescing', ['stream'])
+feishu_rate_limit_rate = metrics.gauge(
+    'feishu_rate_limit_rate', 'Current token bucket refill rate (calls per second)', ['tenant', 'endpoint'])
+feishu_rate_limit_factor = metrics.gauge(
+    'feishu_rate_limit_factor', 'Current token bucket rate relative to the published Feishu limit', ['tenant', 'endpoint'])
+crawl_window_limit = metrics.gauge('wiki_crawl_window_limit', 'Current AIMD crawl concurrency window (in-flight node list requests)')
+
+def observe_feishu_request(endpoint, response, elapsed, rate_limit_wait):
+    """FeishuClient 的 observer：记录每次飞书调用的延迟、限流等待时间、HTTP 状态和飞书错误码"""
+    feishu_request_seconds.observe(endpoint, value=elapsed)
+    feishu_rate_limit_wait_seconds.observe(endpoint, value=rate_limit_wait)
+    if response is None:
+        feishu_requests_total.inc(endpoint, 'network_error', '')
+        return
+    code = response_code(response)
+    feishu_requests_total.inc(endpoint, response.status_code, '' if code is None else code)
+
+def observe_rate_change(tenant, endpoint, rate, factor):
+    """FeishuRateLimiter 的 observer：记录令牌桶当前的速率，便于观察和调整自适应限流"""
+    feishu_rate_limit_rate.set(tenant, endpoint, value=rate)
+    feishu_rate_limit_factor.set(tenant, endpoint, value=factor)
+
+# 所有飞书接口调用共享的频率限制，按 (租户, 接口) 划分令牌桶，额度参考飞书开放平台公布的频率限制
+feishu_rate_limiter = FeishuRateLimiter(
+    safety_factor=float(os.getenv('RATE_LIMIT_SAFETY_FACTOR', '0.8')),  # 初始只使用80%的理论限制
+    burst_seconds=float(os.getenv('RATE_LIMIT_BURST_SECONDS', '1')),
+    # 自适应模式下没有被限流时速率会逐步提高到 RATE_LIMIT_MAX_FACTOR，被限流时减半
+    adaptive=os.getenv('RATE_LIMIT_ADAPTIVE', 'true').lower() == 'true',
+    max_factor=float(os.getenv('RATE_LIMIT_MAX_FACTOR', '1.0')),
+    observer=observe_rate_change
+)
+
+# 飞书客户端的连接池、超时和限流配置，异步爬取引擎创建的 AsyncFeishuClient 使用相同的配置
+FEISHU_CLIENT_OPTIONS = dict(
+    base_url=os.getenv('FEISHU_BASE_URL', FEISHU_BASE_URL),
+    max_connections=int(os.getenv('FEISHU_MAX_CONNECTIONS', '20')),
+    max_keepalive_connections=int(os.getenv('FEISHU_MAX_KEEPALIVE_CONNECTIONS', '10')),
+    connect_timeout=float(os.getenv('FEISHU_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.getenv('FEISHU_READ_TIMEOUT', '30')),
+    http2=os.getenv('FEISHU_HTTP2', 'true').lower() == 'true',
+    rate_limiter=feishu_rate_limiter,
+    tenant=os.getenv('FEISHU_TENANT_KEY') or FEISHU_APP_ID or 'default',
+    observer=observe_feishu_request
+)
+
+# 所有飞书接口调用共用一个带连接池的客户端
+feishu_client = FeishuClient(**FEISHU_CLIENT_OPTIONS)
+
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": f"http://localhost:{FRONTEND_PORT}", "supports_credentials": True}})
 
@@ -29,6 +124,12 @@ import os
 from logging.handlers import RotatingFileHandler
 import glob
 
+# 日志经由队列在后台线程中写入；记录请求体、响应内容等数据时每个字符串字段最多保留 LOG_FIELD_LIMIT 个字符（0 表示不截断）
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_FIELD_LIMIT = int(os.getenv('LOG_FIELD_LIMIT', '2000'))
+log_queue_handler = None
+log_queue_listener = None
+
 # 确保日志目录存在
 log_dir = 'logs'
 if not os.path.exists(log_dir):
@@ -74,6 +175,14 @@ def setup_logging():
         except Exception as e:
             print(f"Failed to cleanup old logs: {e}")
     
+    # 重新配置时先停止上一次的日志管道：写完队列中的记录，关闭后台线程和日志文件
+    global log_queue_handler, log_queue_listener
+    dropped = 0
+    if log_queue_listener is not None:
+        dropped = log_queue_handler.dropped
+        stop_queue_logging(log_queue_handler, log_queue_listener)
+        log_queue_handler = log_queue_listener = None
+
     # 执行清理
     cleanup_old_logs()
     
@@ -89,7 +198,6 @@ def setup_logging():
     console_handler = logging.StreamHandler()
     console_handler.setLevel(log_levels.get(log_level, logging.INFO))
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
     
     # 文件处理器（带轮转）
     file_handler = RotatingFileHandler(
@@ -100,13 +208,17 @@ def setup_logging():
     )
     file_handler.setLevel(log_levels.get(log_level, logging.INFO))
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
+
+    # 控制台和文件的写入交给后台线程，请求线程只把日志记录放入队列
+    log_queue_handler, log_queue_listener = start_queue_logging([console_handler, file_handler], LOG_QUEUE_SIZE)
+    log_queue_handler.dropped = dropped
+    set_field_limit(LOG_FIELD_LIMIT)
     
     # 配置应用日志记录器
     app.logger.setLevel(log_levels.get(log_level, logging.INFO))
     
     # 记录日志配置信息
-    app.logger.info(f"Logging configured - Level: {log_level}, Max size: {max_log_size//1024//1024}MB, Backups: {backup_count}, Max files: {max_log_files}")
+    app.logger.info(f"Logging configured - Level: {log_level}, Max size: {max_log_size//1024//1024}MB, Backups: {backup_count}, Max files: {max_log_files}, Queue size: {LOG_QUEUE_SIZE}, Field limit: {LOG_FIELD_LIMIT}")
 
 # 初始化日志配置
 setup_logging()
@@ -267,8 +379,12 @@ def get_log_status():
                 "log_level": os.getenv('LOG_LEVEL', 'INFO'),
                 "max_log_size_mb": int(os.getenv('MAX_LOG_SIZE', '10')),
                 "backup_count": int(os.getenv('BACKUP_COUNT', '5')),
-                "max_log_files": int(os.getenv('MAX_LOG_FILES', '10'))
-            }
+                "max_log_files": int(os.getenv('MAX_LOG_FILES', '10')),
+                "queue_size": LOG_QUEUE_SIZE,
+                "field_limit": LOG_FIELD_LIMIT
+            },
+            # 队列已满而被丢弃的日志记录数
+            "dropped_records": log_queue_handler.dropped if log_queue_handler else 0
         }
         
         return jsonify(status)
@@ -277,19 +393,60 @@ def get_log_status():
         app.logger.error(f"Error getting log status: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/admin/crawl/status', methods=['GET'])
+def get_crawl_status():
+    """获取爬取并发窗口和飞书接口当前速率"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    token = auth_header.split(' ')[1]
+    if token != os.getenv('ADMIN_TOKEN', 'admin-secret'):
+        return jsonify({"error": "Invalid admin token"}), 401
+
+    return jsonify({
+        "crawl_window": crawl_window.limit,
+        "crawl_window_value": round(crawl_window.value, 2),
+        "crawl_max_workers": CRAWL_MAX_WORKERS,
+        "crawl_engine": CRAWL_ENGINE,
+        "adaptive": CRAWL_ADAPTIVE,
+        "rate_limits": [
+            {"tenant": tenant, "endpoint": endpoint, "calls_per_second": round(rate, 3)}
+            for (tenant, endpoint), rate in feishu_rate_limiter.current_rates().items()
+        ],
+        "node_resolver": node_resolver.stats(),
+        "shared_crawls": [
+            {"space_id": space_id, "scope": "user" if scope else "space", "subscribers": subscribers}
+            for (space_id, scope), subscribers in crawl_hub.active().items()
+        ],
+        "recent_jobs": [job_summary(job) for job in crawl_jobs.list(limit=10)]
+    })
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的运行指标：飞书调用延迟和错误码、限流等待、重试、爬取吞吐量、大模型流式输出"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    token = auth_header.split(' ')[1]
+    if token != os.getenv('ADMIN_TOKEN', 'admin-secret'):
+        return jsonify({"error": "Invalid admin token"}), 401
+
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # --- Global Request Logger ---
 
 @app.before_request
 def log_request_info():
-    app.logger.info('--- Incoming Request ---')
-    app.logger.info(f'Method: {request.method}')
-    app.logger.info(f'Path: {request.path}')
-    app.logger.info(f'Headers: {request.headers}')
+    app.logger.info('Incoming request: %s %s', request.method, request.path)
+    # 请求头只在 DEBUG 级别记录（包括 SSE 轮询），未启用时不做任何格式化
+    app.logger.debug('Headers: %s', log_headers(request.headers))
 
 # --- Helper Functions ---
 
 def get_user_access_token(code, redirect_uri):
-    url = "https://open.feishu.cn/open-apis/authen/v2/oauth/token"
+    url = "/authen/v2/oauth/token"
     payload = {
         "grant_type": "authorization_code",
         "code": code,
@@ -303,24 +460,39 @@ def get_user_access_token(code, redirect_uri):
 
     app.logger.info("="*20 + " Feishu user_access_token Request " + "="*20)
     app.logger.info(f"POST {url}")
-    app.logger.info("HEADERS: " + json.dumps(headers, indent=2))
-    app.logger.info("BODY: " + json.dumps(payload, indent=2))
+    app.logger.info("HEADERS: %s", log_payload(headers))
+    app.logger.info("BODY: %s", log_payload(payload))
     app.logger.info("="*60)
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = feishu_client.post(url, json=payload, headers=headers)
 
     app.logger.info("--- Received response from Feishu ---")
     app.logger.info(f"Status Code: {response.status_code}")
-    app.logger.info(f"Response Content: {response.text}")
+    app.logger.info("Response Content: %s", log_payload(response.text))
         
-    response.raise_for_status()
+    raise_for_status(response)
     data = response.json()
     if data.get("code", -1) != 0:
-        app.logger.error(f"Failed to get user_access_token from feishu, response: {data}")
+        app.logger.error("Failed to get user_access_token from feishu, response: %s", log_payload(data))
         return None
     return data.get("access_token")
 
 
+# ASGI 模式（asgi.py）在 environ 中放入该键，流式接口据此改为返回异步生成器，由事件循环驱动而不占用线程
+ASYNC_STREAM_ENVIRON_KEY = 'wikinode.async_stream'
+
+def sse_response(generate, agenerate=None):
+    """
+    构造 SSE 响应
+    :param generate: 无参函数，返回产出 SSE 帧的同步生成器（WSGI 模式）
+    :param agenerate: 可选，无参函数，返回产出相同帧的异步生成器；ASGI 模式下优先使用，在请求上下文之外调用
+    """
+    if agenerate is not None and ASYNC_STREAM_ENVIRON_KEY in request.environ:
+        request.environ[ASYNC_STREAM_ENVIRON_KEY] = agenerate
+        return Response(content_type='text/event-stream')
+    return Response(generate(), content_type='text/event-stream')
+
+
 # --- API Routes ---
 
 @app.route('/api/auth/callback')
@@ -333,7 +505,7 @@ def auth_callback():
 def get_token():
     app.logger.info("--- Received /api/auth/token request ---")
     data = request.get_json()
-    app.logger.info(f"Request data: {data}")
+    app.logger.info("Request data: %s", log_payload(data))
     code = data.get('code')
     redirect_uri = data.get('redirect_uri')
     app.logger.info(f"Extracted code: {code}")
@@ -352,11 +524,11 @@ def get_token():
                 response.status_code = 500
             else:
                 response = jsonify({"user_access_token": user_access_token})
-        except requests.exceptions.RequestException as e:
+        except FeishuRequestError as e:
             app.logger.error(f"Request error: {str(e)}")
             if e.response:
                 app.logger.error(f"Response status: {e.response.status_code}")
-                app.logger.error(f"Response content: {e.response.text}")
+                app.logger.error("Response content: %s", log_payload(e.response.text))
             try:
                 error_data = e.response.json()
                 response = jsonify({"error": error_data})
@@ -378,7 +550,7 @@ def get_wiki_spaces():
     # 限制 page_size 最大为 50，符合飞书 API 限制
     page_size = min(int(request.args.get('page_size', 20)), 50)
 
-    url = "https://open.feishu.cn/open-apis/wiki/v2/spaces"
+    url = "/wiki/v2/spaces"
     headers = {"Authorization": f"Bearer {user_access_token}"}
     params = {
         "page_size": page_size
@@ -387,14 +559,14 @@ def get_wiki_spaces():
         params['page_token'] = page_token
 
     try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
+        response = feishu_client.get(url, headers=headers, params=params)
+        raise_for_status(response)
         return jsonify(response.json().get("data", {}))
-    except requests.exceptions.RequestException as e:
+    except FeishuRequestError as e:
         app.logger.error(f"Request error: {str(e)}")
         if e.response is not None:
             app.logger.error(f"Response status: {e.response.status_code}")
-            app.logger.error(f"Response content: {e.response.text}")
+            app.logger.error("Response content: %s", log_payload(e.response.text))
             try:
                 error_data = e.response.json()
                 return jsonify({"error": error_data}), e.response.status_code
@@ -405,197 +577,626 @@ def get_wiki_spaces():
 
 # --- Node Fetching Logic ---
 
-# 速率限制器
-class RateLimiter:
-    def __init__(self, max_calls, per_seconds):
-        self.max_calls = max_calls
-        self.per_seconds = per_seconds
-        self.calls = []
-        # 添加安全系数，实际限制比理论值更严格
-        self.safety_factor = 0.8  # 只使用80%的理论限制
-        self.effective_max_calls = int(max_calls * self.safety_factor)
-
-    def __call__(self, f):
-        def wrapped(*args, **kwargs):
-            now = time.time()
-            # 移除指定时间前的调用记录
-            self.calls = [c for c in self.calls if c > now - self.per_seconds]
-            
-            # 使用更严格的有效限制
-            if len(self.calls) >= self.effective_max_calls:
-                # 计算需要等待的时间
-                sleep_time = (self.calls[0] + self.per_seconds) - now
-                if sleep_time > 0:
-                    # 添加额外缓冲时间
-                    buffer_time = 0.5
-                    total_sleep = sleep_time + buffer_time
-                    app.logger.warning(f"Rate limit reached (effective: {self.effective_max_calls}/{self.max_calls}). Sleeping for {total_sleep:.2f} seconds.")
-                    time.sleep(total_sleep)
-            
-            # 记录请求时间
-            self.calls.append(time.time())
-            
-            # 添加小延迟确保请求间隔
-            if len(self.calls) > 1:
-                time_since_last = now - self.calls[-2]
-                min_interval = self.per_seconds / self.effective_max_calls
-                if time_since_last < min_interval:
-                    additional_delay = min_interval - time_since_last
-                    app.logger.debug(f"Adding delay {additional_delay:.3f}s to maintain rate limit")
-                    time.sleep(additional_delay)
-            
-            return f(*args, **kwargs)
-        return wrapped
+def response_backoff(url, response, retry_count, max_retries):
+    """
+    检查飞书接口的响应：成功时返回 None，遇到频率限制且还可以重试时返回退避时间（秒），
+    其他 HTTP 错误或重试次数用尽时抛出 FeishuRequestError
+    """
+    backoff_factor = 1  # 初始退避时间（秒）
+    # 检查是否是飞书API频率限制错误（错误码99991400）
+    try:
+        response_data = response.json()
+        if response_data.get('code') == 99991400:
+            if retry_count < max_retries:
+                # 飞书频率限制，使用更长的退避时间
+                backoff_time = backoff_factor * (3 ** retry_count) + random.uniform(1, 3)  # 更长的退避
+                app.logger.warning(f"Feishu rate limit hit (code 99991400). Retrying in {backoff_time:.2f} seconds. Retry count: {retry_count + 1}")
+                report_feishu_feedback(url, rate_limited=True)
+                feishu_retries_total.inc(endpoint_name(url), 'feishu_rate_limit')
+                return backoff_time
+            else:
+                # 达到最大重试次数
+                app.logger.error("Max retries reached for Feishu rate limit. Raising exception.")
+                raise_for_status(response)
+    except ValueError:
+        # 响应不是JSON格式，继续正常处理
+        pass
+
+    # 处理HTTP 429速率限制错误
+    if response.status_code == 429:  # 速率限制错误
+        if retry_count < max_retries:
+            # 计算退避时间
+            backoff_time = backoff_factor * (2 ** retry_count) + random.uniform(0, 1)
+            app.logger.warning(f"HTTP rate limit hit. Retrying in {backoff_time:.2f} seconds. Retry count: {retry_count + 1}")
+            report_feishu_feedback(url, rate_limited=True)
+            feishu_retries_total.inc(endpoint_name(url), 'http_429')
+            return backoff_time
+        else:
+            # 达到最大重试次数
+            app.logger.error("Max retries reached for HTTP rate limit. Raising exception.")
+    raise_for_status(response)
+    report_feishu_feedback(url, rate_limited=False)
+    return None
+
+def error_backoff(url, e, retry_count, max_retries):
+    """请求失败（网络错误、5xx、重试次数用尽的 429）时返回重试前的退避时间，不应重试时返回 None"""
+    # 除频率限制外的 4xx 错误重试也不会成功，直接抛出
+    if e.response is not None and e.response.status_code < 500 and e.response.status_code != 429:
+        return None
+    if retry_count < max_retries:
+        backoff_time = 2 ** retry_count + random.uniform(0, 1)
+        app.logger.warning(f"Request failed. Retrying in {backoff_time:.2f} seconds. Error: {str(e)}")
+        feishu_retries_total.inc(endpoint_name(url), 'request_error')
+        return backoff_time
+    app.logger.error(f"Max retries reached. Raising exception. Error: {str(e)}")
+    return None
 
 # 带有指数退避的请求函数
 def request_with_backoff(url, headers, params=None, max_retries=5):
     retry_count = 0
-    backoff_factor = 1  # 初始退避时间（秒）
-    
     while retry_count <= max_retries:
         try:
-            response = requests.get(url, headers=headers, params=params)
-            
-            # 检查是否是飞书API频率限制错误（错误码99991400）
-            try:
-                response_data = response.json()
-                if response_data.get('code') == 99991400:
-                    if retry_count < max_retries:
-                        # 飞书频率限制，使用更长的退避时间
-                        backoff_time = backoff_factor * (3 ** retry_count) + random.uniform(1, 3)  # 更长的退避
-                        app.logger.warning(f"Feishu rate limit hit (code 99991400). Retrying in {backoff_time:.2f} seconds. Retry count: {retry_count + 1}")
-                        time.sleep(backoff_time)
-                        retry_count += 1
-                        continue
-                    else:
-                        # 达到最大重试次数
-                        app.logger.error("Max retries reached for Feishu rate limit. Raising exception.")
-                        response.raise_for_status()
-            except ValueError:
-                # 响应不是JSON格式，继续正常处理
-                pass
-            
-            # 处理HTTP 429速率限制错误
-            if response.status_code == 429:  # 速率限制错误
-                if retry_count < max_retries:
-                    # 计算退避时间
-                    backoff_time = backoff_factor * (2 ** retry_count) + random.uniform(0, 1)
-                    app.logger.warning(f"HTTP rate limit hit. Retrying in {backoff_time:.2f} seconds. Retry count: {retry_count + 1}")
-                    time.sleep(backoff_time)
-                    retry_count += 1
-                    continue
-                else:
-                    # 达到最大重试次数
-                    app.logger.error("Max retries reached for HTTP rate limit. Raising exception.")
-                    response.raise_for_status()
-            else:
-                response.raise_for_status()
+            response = feishu_client.get(url, headers=headers, params=params)
+            backoff_time = response_backoff(url, response, retry_count, max_retries)
+            if backoff_time is None:
                 return response
-        except requests.exceptions.RequestException as e:
-            if retry_count < max_retries:
-                backoff_time = backoff_factor * (2 ** retry_count) + random.uniform(0, 1)
-                app.logger.warning(f"Request failed. Retrying in {backoff_time:.2f} seconds. Error: {str(e)}")
-                time.sleep(backoff_time)
-                retry_count += 1
-            else:
-                app.logger.error(f"Max retries reached. Raising exception. Error: {str(e)}")
+        except FeishuRequestError as e:
+            backoff_time = error_backoff(url, e, retry_count, max_retries)
+            if backoff_time is None:
                 raise
-    
+        time.sleep(backoff_time)
+        retry_count += 1
+
     # 如果循环结束仍未成功，抛出异常
-    raise requests.exceptions.RequestException("Max retries reached without successful response")
+    raise FeishuRequestError("Max retries reached without successful response")
 
-# 限制请求频率为 100 次/分钟，防止超频报错
-rate_limiter = RateLimiter(max_calls=100, per_seconds=60)
+async def arequest_with_backoff(client, url, headers, params=None, max_retries=5):
+    """request_with_backoff 的异步版本，使用传入的 AsyncFeishuClient，退避等待时不阻塞事件循环"""
+    retry_count = 0
+    while retry_count <= max_retries:
+        try:
+            response = await client.get(url, headers=headers, params=params)
+            backoff_time = response_backoff(url, response, retry_count, max_retries)
+            if backoff_time is None:
+                return response
+        except FeishuRequestError as e:
+            backoff_time = error_backoff(url, e, retry_count, max_retries)
+            if backoff_time is None:
+                raise
+        await asyncio.sleep(backoff_time)
+        retry_count += 1
 
-def fetch_node_children(space_id, node_token, user_access_token, page_token=None):
-    url = f"https://open.feishu.cn/open-apis/wiki/v2/spaces/{space_id}/nodes"
-    headers = {"Authorization": f"Bearer {user_access_token}"}
+    raise FeishuRequestError("Max retries reached without successful response")
+
+def nodes_page_params(parent_node_token=None, page_token=None):
     params = {"page_size": 50}
-    if node_token:
-        params['parent_node_token'] = node_token
+    if parent_node_token:
+        params['parent_node_token'] = parent_node_token
     if page_token:
         params['page_token'] = page_token
+    return params
+
+def fetch_nodes_page(space_id, user_access_token, parent_node_token=None, page_token=None):
+    """拉取一页子节点，返回飞书接口的 data 字段"""
+    url = f"/wiki/v2/spaces/{space_id}/nodes"
+    headers = {"Authorization": f"Bearer {user_access_token}"}
 
-    @rate_limiter
-    def fetch_with_rate_limit():
-        # 使用带有指数退避的请求函数，更好地处理频率限制
-        return request_with_backoff(url, headers, params)
+    # 使用带有指数退避的请求函数，更好地处理频率限制
+    response = request_with_backoff(url, headers, nodes_page_params(parent_node_token, page_token))
+    data = response.json().get("data", {})
+    # 顺带记录节点对应的文档，之后解析这些节点时无需再调用 get_node
+    node_resolver.remember(data.get('items') or [])
+    return data
 
-    response = fetch_with_rate_limit()
-    return response.json().get("data", {})
+async def afetch_nodes_page(client, space_id, user_access_token, parent_node_token=None, page_token=None):
+    """fetch_nodes_page 的异步版本，通过 AsyncFeishuClient 拉取一页子节点"""
+    url = f"/wiki/v2/spaces/{space_id}/nodes"
+    headers = {"Authorization": f"Bearer {user_access_token}"}
+    response = await arequest_with_backoff(client, url, headers, nodes_page_params(parent_node_token, page_token))
+    data = response.json().get("data", {})
+    node_resolver.remember(data.get('items') or [])
+    return data
+
+# 知识库节点 token -> (obj_type, obj_token) 的映射，由爬取填充，未命中时回退到合并后的 get_node 请求
+node_resolver = NodeResolver(max_entries=int(os.getenv('NODE_RESOLVER_MAX_ENTRIES', '100000')))
+
+def fetch_wiki_node(node_token, user_access_token):
+    """调用 get_node 获取知识库节点信息，返回 data.node"""
+    headers = {"Authorization": f"Bearer {user_access_token}"}
+    app.logger.info(f"Fetching wiki node info for token: {node_token}")
+    response = request_with_backoff("/wiki/v2/spaces/get_node", headers, params={"token": node_token})
+    node_data = response.json()
+    if node_data.get("code") != 0:
+        error_msg = node_data.get("msg", "Failed to fetch wiki node info")
+        app.logger.error(error_msg)
+        raise FeishuRequestError(error_msg)
+    return node_data.get("data", {}).get("node", {})
+
+# 爬取并发度由速率预算决定（Little 定律：并发数 = 请求速率 × 单次请求耗时），与树的深度无关
+CRAWL_MAX_WORKERS = int(os.getenv('CRAWL_MAX_WORKERS', '8'))
+CRAWL_EXPECTED_LATENCY = float(os.getenv('CRAWL_EXPECTED_LATENCY', '1.0'))  # 单次分页请求的预期耗时（秒）
+# 开启后爬取并发窗口按 AIMD 调整：请求成功时逐步增大，遇到 429/99991400 时减半
+CRAWL_ADAPTIVE = os.getenv('CRAWL_ADAPTIVE', 'true').lower() == 'true'
+CRAWL_WINDOW_INCREASE = float(os.getenv('CRAWL_WINDOW_INCREASE', '0.1'))  # 每次成功增加的窗口大小
+# 爬取引擎：thread 使用有界线程池（WikiCrawler）；async 在一个事件循环中通过 httpx.AsyncClient（HTTP/2）
+# 并发拉取（AsyncWikiCrawler），等待响应和限流配额时不占用线程，每次爬取只需要一个线程
+CRAWL_ENGINE = os.getenv('CRAWL_ENGINE', 'thread')
+CRAWL_ASYNC_CONCURRENCY = int(os.getenv('CRAWL_ASYNC_CONCURRENCY', str(CRAWL_MAX_WORKERS)))  # async 引擎同时在途的请求数
+
+def crawl_concurrency():
+    calls_per_second = feishu_rate_limiter.rate_for('nodes')
+    return max(1, min(CRAWL_MAX_WORKERS, math.ceil(calls_per_second * CRAWL_EXPECTED_LATENCY)))
+
+# 所有爬取共享的并发窗口
+crawl_window = AIMDController(
+    initial=crawl_concurrency(),
+    minimum=1,
+    maximum=CRAWL_MAX_WORKERS,
+    increase=CRAWL_WINDOW_INCREASE,
+    decrease=0.5
+)
+crawl_window_limit.set(value=crawl_window.limit)
+
+def report_feishu_feedback(url, rate_limited):
+    """把飞书接口是否被限流反馈给令牌桶和爬取并发窗口"""
+    endpoint = endpoint_name(url)
+    if rate_limited:
+        feishu_rate_limiter.on_rate_limited(endpoint, feishu_client.tenant)
+        if endpoint == 'nodes':
+            crawl_window.on_congestion()
+            crawl_window_limit.set(value=crawl_window.limit)
+            app.logger.warning(f"Crawl window cut to {crawl_window.limit}")
+    else:
+        feishu_rate_limiter.on_success(endpoint, feishu_client.tenant)
+        if endpoint == 'nodes':
+            crawl_window.on_success()
+            crawl_window_limit.set(value=crawl_window.limit)
+
+def new_wiki_crawler(space_id, user_access_token, progress_callback=None, reuse_subtree=None, page_callback=None, retain_tree=True, checkpoint_callback=None, cancel_event=None):
+    """按 CRAWL_ENGINE 创建爬取引擎，由 run_crawler 执行"""
+    if CRAWL_ENGINE == 'async':
+        client = AsyncFeishuClient(**FEISHU_CLIENT_OPTIONS)
+        crawler = new_async_wiki_crawler(
+            client, space_id, user_access_token, progress_callback, reuse_subtree, page_callback,
+            retain_tree, checkpoint_callback, cancel_event
+        )
+        # 每次爬取使用自己的客户端（连接池绑定爬取所在的事件循环），run_crawler 结束时关闭
+        crawler.feishu_client = client
+        return crawler
+    return WikiCrawler(
+        lambda parent, page: fetch_nodes_page(space_id, user_access_token, parent, page),
+        max_workers=CRAWL_MAX_WORKERS if CRAWL_ADAPTIVE else crawl_concurrency(),
+        progress_callback=progress_callback,
+        reuse_subtree=reuse_subtree,
+        concurrency=crawl_window if CRAWL_ADAPTIVE else None,
+        page_callback=page_callback,
+        retain_tree=retain_tree,
+        checkpoint_callback=checkpoint_callback,
+        checkpoint_interval=CRAWL_CHECKPOINT_INTERVAL,
+        cancel_event=cancel_event
+    )
 
+def new_async_wiki_crawler(client, space_id, user_access_token, progress_callback=None, reuse_subtree=None, page_callback=None, retain_tree=True, checkpoint_callback=None, cancel_event=None):
+    return AsyncWikiCrawler(
+        lambda parent, page: afetch_nodes_page(client, space_id, user_access_token, parent, page),
+        max_concurrency=CRAWL_ASYNC_CONCURRENCY,
+        progress_callback=progress_callback,
+        reuse_subtree=reuse_subtree,
+        page_callback=page_callback,
+        retain_tree=retain_tree,
+        checkpoint_callback=checkpoint_callback,
+        checkpoint_interval=CRAWL_CHECKPOINT_INTERVAL,
+        cancel_event=cancel_event
+    )
 
+def record_crawl_metrics(crawler, started, outcome):
+    """记录一次爬取的页面数、节点数和吞吐量"""
+    engine = 'async' if isinstance(crawler, AsyncWikiCrawler) else 'thread'
+    elapsed = time.monotonic() - started
+    crawl_pages_total.inc(engine, amount=crawler.pages_fetched)
+    crawl_nodes_total.inc(engine, amount=crawler.nodes_fetched)
+    crawl_failed_pages_total.inc(engine, amount=crawler.failed_pages)
+    crawl_duration_seconds.observe(engine, outcome, value=elapsed)
+    if outcome == 'done' and elapsed > 0:
+        crawl_pages_per_second.set(engine, value=round(crawler.pages_fetched / elapsed, 3))
+        crawl_nodes_per_second.set(engine, value=round(crawler.nodes_fetched / elapsed, 3))
+
+def run_crawler(crawler, *args, **kwargs):
+    """执行 new_wiki_crawler 创建的爬取；async 引擎在当前线程中运行一个事件循环，结束后关闭它的飞书客户端"""
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        if not isinstance(crawler, AsyncWikiCrawler):
+            result = crawler.crawl(*args, **kwargs)
+        else:
+            async def crawl():
+                async with crawler.feishu_client:
+                    return await crawler.crawl(*args, **kwargs)
+            result = asyncio.run(crawl())
+        outcome = 'done'
+        return result
+    except CrawlCancelled:
+        outcome = 'cancelled'
+        raise
+    finally:
+        record_crawl_metrics(crawler, started, outcome)
 
 def fetch_all_nodes_recursively(space_id, user_access_token, parent_node_token=None, page_token=None, progress_callback=None):
-    nodes = []
-    total_count = 0  # 用于累计节点总数
-    while True:
-        url = f"https://open.feishu.cn/open-apis/wiki/v2/spaces/{space_id}/nodes?page_size=50"
-        headers = {
-            "Authorization": f"Bearer {user_access_token}"
-        }
-        params = {}
-        if parent_node_token:
-            params['parent_node_token'] = parent_node_token
-        if page_token:
-            params['page_token'] = page_token
+    """
+    获取 parent_node_token 下的完整节点树
+    由 WikiCrawler 以广度优先方式爬取，整个导出只使用一个有界线程池（CRAWL_ENGINE=async 时只使用当前线程）
+    """
+    crawler = new_wiki_crawler(space_id, user_access_token, progress_callback)
+    nodes = run_crawler(crawler, parent_node_token, page_token)
+    app.logger.info(f"Crawled space {space_id}: {crawler.total_count} nodes in {crawler.pages_fetched} pages, crawl window {crawler.window()}")
+    return nodes
 
+async def afetch_all_nodes_recursively(space_id, user_access_token, parent_node_token=None, page_token=None, progress_callback=None):
+    """
+    fetch_all_nodes_recursively 的异步版本，在当前事件循环中由 AsyncWikiCrawler 爬取
+    :param progress_callback: 普通函数或协程函数，参数为已获取的节点总数
+    """
+    started = time.monotonic()
+    async with AsyncFeishuClient(**FEISHU_CLIENT_OPTIONS) as client:
+        crawler = new_async_wiki_crawler(client, space_id, user_access_token, progress_callback)
+        outcome = 'error'
         try:
-            # 使用带有指数退避的请求函数
-            response = request_with_backoff(url, headers, params)
-            data = response.json().get("data", {})
-            items = data.get("items", [])
-            # 过滤掉缺少node_token的节点
-            valid_items = [item for item in items if item.get('node_token')]
-            nodes.extend(valid_items)
-            
-            # 更新总节点数并调用进度回调
-            total_count += len(items)
-            if progress_callback:
-                try:
-                    # 调用进度回调函数
-                    progress_callback(total_count)
-                except Exception as e:
-                    # 记录错误但不中断主流程
-                    app.logger.error(f"Progress callback error: {str(e)}")
-
-            # 限制并发数为2，避免触发飞书API频率限制
-            with ThreadPoolExecutor(max_workers=2) as executor:
-                # 为每个子节点请求添加小延迟，避免同时发送大量请求
-                futures = []
-                for item in items:
-                    if item.get('has_child'):
-                        # 添加小延迟避免频率限制
-                        time.sleep(0.1)
-                        future = executor.submit(fetch_all_nodes_recursively, space_id, user_access_token, item['node_token'], None, progress_callback)
-                        futures.append((future, item))
-                
-                for future, item in futures:
-                    try:
-                        children = future.result()
-                        # Find the node in the list and add its children
-                        for n in nodes:
-                            if n['node_token'] == item['node_token']:
-                                n['children'] = children
-                                break
-                    except Exception as exc:
-                        app.logger.error(f'{item["node_token"]} generated an exception: {exc}')
-                        # 继续处理其他节点，不中断整个过程
-                        continue
-
-            if not data.get('has_more'):
-                break
-            page_token = data.get('page_token')
-        except requests.exceptions.RequestException as e:
-            app.logger.error(f"Failed to fetch nodes: {str(e)}")
-            # 如果是速率限制错误，重新抛出异常以便上层处理
-            if e.response is not None and e.response.status_code == 429:
-                raise
-            # 对于其他错误，可以选择继续或者抛出异常
-            # 这里我们选择继续，以确保尽可能多地获取数据
-            break
+            nodes = await crawler.crawl(parent_node_token, page_token)
+            outcome = 'done'
+        finally:
+            record_crawl_metrics(crawler, started, outcome)
+    app.logger.info(f"Crawled space {space_id}: {crawler.total_count} nodes in {crawler.pages_fetched} pages, {crawler.max_concurrency} concurrent requests")
     return nodes
 
+# --- Space Tree Cache ---
+
+# 知识空间节点树缓存：TTL 内直接返回缓存，过期后先返回缓存再在后台增量刷新
+TREE_CACHE_PATH = os.getenv('TREE_CACHE_PATH', 'cache/wiki_tree.db')
+TREE_CACHE_TTL = int(os.getenv('TREE_CACHE_TTL', '600'))  # 秒
+# 增量刷新只会深入 obj_edit_time/node_create_time 有变化的节点，超过该时间强制全量爬取一次
+TREE_CACHE_FULL_REFRESH = int(os.getenv('TREE_CACHE_FULL_REFRESH', '86400'))  # 秒
+tree_cache = WikiTreeCache(TREE_CACHE_PATH, memory_spaces=int(os.getenv('TREE_CACHE_MEMORY_SPACES', '8')))
+
+# 增量推送模式下每个 nodes 事件携带的最大节点数，以及每个订阅者等待消费的事件队列长度（队列满时爬取暂停）
+NODES_BATCH_SIZE = int(os.getenv('NODES_BATCH_SIZE', '100'))
+NODES_STREAM_QUEUE_SIZE = int(os.getenv('NODES_STREAM_QUEUE_SIZE', '16'))
+
+# 同一用户对同一知识空间的并发爬取合并为一次，之后到达的请求订阅正在进行的爬取
+crawl_hub = CrawlHub(queue_size=NODES_STREAM_QUEUE_SIZE)
+
+# 爬取以后台任务运行，定期把已拉取的节点和未完成的页面写入检查点，中断后从检查点恢复
+CRAWL_CHECKPOINT_INTERVAL = float(os.getenv('CRAWL_CHECKPOINT_INTERVAL', '5'))  # 秒
+CRAWL_JOB_RETENTION = int(os.getenv('CRAWL_JOB_RETENTION', '86400'))  # 秒，中断的任务保留多久
+crawl_jobs = CrawlJobStore(
+    tree_cache, stale_after=max(60, CRAWL_CHECKPOINT_INTERVAL * 6), retention=CRAWL_JOB_RETENTION
+)
+
+def tree_scope(user_access_token):
+    """
+    节点树缓存、爬取合并和爬取任务的权限范围（用户访问令牌的哈希）
+    飞书按节点控制权限，同一知识空间不同用户可见的节点不同，用一个用户的令牌爬取的节点树不能返回给其他用户
+    """
+    return hashlib.sha256(user_access_token.encode('utf-8')).hexdigest()
+
+def space_tree_key(space_id, user_access_token):
+    return scoped_key(space_id, tree_scope(user_access_token))
+
+def check_space_access(space_id, user_access_token):
+    """确认用户有权访问该知识空间"""
+    url = f"/wiki/v2/spaces/{space_id}"
+    headers = {"Authorization": f"Bearer {user_access_token}"}
+    try:
+        response = request_with_backoff(url, headers)
+        return response.json().get("code") == 0
+    except FeishuRequestError as e:
+        app.logger.warning(f"Space access check failed for space_id: {space_id}, error: {str(e)}")
+        return False
+
+def subtree_reuser(previous, page_callback=None):
+    """
+    由上一次缓存的节点树构造 reuse_subtree：签名未变化的节点直接复用缓存中的子树
+    缓存超过 TREE_CACHE_FULL_REFRESH 时返回 None，强制全量爬取
+    """
+    if previous is None or time.time() - previous.crawled_at >= TREE_CACHE_FULL_REFRESH:
+        return None
+
+    def reuse_subtree(item):
+        cached_node = previous.tree.get(item['node_token'])
+        if cached_node is None or 'children' not in cached_node:
+            return None
+        if node_signature(cached_node) != node_signature(item):
+            return None
+        if page_callback:
+            for parent_node_token, items in iter_tree_batches(cached_node['children'], NODES_BATCH_SIZE, item['node_token']):
+                page_callback(parent_node_token, items)
+        return cached_node['children']
+
+    return reuse_subtree
+
+def run_crawl_job(crawl, space_id, user_access_token, previous=None, retain_tree=True):
+    """
+    执行 crawl.job 对应的爬取任务，完成后写入缓存
+    爬取发布 ('progress', 节点数) 和 ('nodes', 父节点, 子节点列表) 事件；每隔 CRAWL_CHECKPOINT_INTERVAL 秒
+    把新拉取的节点和未完成的页面写入检查点。恢复的任务从未完成的页面继续，检查点中的节点由 crawl.replay 回放给订阅者。
+    有页面拉取失败时不写入缓存，任务标记为中断，恢复时只重新拉取失败的页面。
+    所有订阅者断开后（detached 任务除外）爬取被取消，同样标记为中断，之后从检查点恢复。
+    :param previous: 上一次缓存的节点树，提供时只重新遍历有变化的子树
+    :param retain_tree: 为 False 时不在内存中保留节点树（增量推送），结果的 roots 为 None，见 crawl_result_roots
+    :return: CachedTree
+    """
+    job = crawl.job
+    replay = crawl.replay
+    writer = replay.writer
+
+    def on_page(parent_node_token, items):
+        # 发布时批次记入 replay.recent，下一个检查点写入
+        crawl.publish(('nodes', parent_node_token, items))
+
+    def on_progress(count):
+        job['node_count'] = count
+        crawl.publish(('progress', count))
+
+    resume_from = None
+    if job['frontier'] is not None:
+        fetched = writer.load_tree() if retain_tree else writer.node_count
+        resume_from = (fetched, [tuple(page) for page in job['frontier']])
+        app.logger.info(f"Resuming crawl job {job['job_id']} of space {space_id}: {writer.node_count} nodes fetched, {len(job['frontier'])} pages pending")
+
+    pages_before = job['pages_fetched']
+
+    def checkpoint(frontier):
+        job['pages_fetched'] = pages_before + crawler.pages_fetched
+        job['failed_pages'] = crawler.failed_pages
+        # 写入检查点和更新回放状态之间不能有新的订阅者加入
+        with crawl.locked():
+            crawl_jobs.checkpoint(job, writer, replay.recent, frontier)
+            replay.checkpointed()
+
+    crawled_at = job['created_at']
+    crawler = new_wiki_crawler(
+        space_id, user_access_token, on_progress, subtree_reuser(previous, on_page), on_page,
+        retain_tree=retain_tree,
+        checkpoint_callback=checkpoint,
+        cancel_event=crawl.cancel_event
+    )
+    try:
+        run_crawler(crawler, resume_from=resume_from)
+    except Exception as e:
+        # 保留最近一次检查点，之后的请求会从这里恢复
+        crawl_jobs.finish(job, 'interrupted', str(e))
+        raise
+    checkpoint(crawler.failed_jobs)
+    app.logger.info(f"Crawl job {job['job_id']} of space {space_id}: {crawler.total_count} nodes, {crawler.pages_fetched} pages fetched, {crawler.subtrees_reused} subtrees reused from cache")
+    if crawler.failed_pages:
+        # 部分子树获取失败，不写入缓存，避免缓存残缺的节点树
+        app.logger.warning(f"Skip caching space {space_id}: {crawler.failed_pages} pages failed, resume crawl job {job['job_id']} to retry them")
+        crawl_jobs.finish(job, 'interrupted', f"{crawler.failed_pages} pages failed")
+    else:
+        # 先结束任务再替换缓存：两步之间进程退出时只会留下待清理的部分结果，不会把空的检查点当作可恢复的任务
+        crawl_jobs.finish(job, 'done')
+        writer.commit(crawled_at, crawler.tree)
+    if crawler.tree is None:
+        return CachedTree(space_id, None, None, crawled_at, crawler.total_count)
+    return CachedTree(space_id, crawler.tree.roots, crawler.tree, crawled_at, len(crawler.tree))
+
+def crawl_result_roots(crawl):
+    """
+    爬取结果的完整节点树
+    不保留节点树的爬取（增量推送发起的）完成后从缓存读取，有页面失败未写入缓存时从任务已拉取的节点重建
+    """
+    result = crawl.result
+    if result.roots is not None:
+        return result.roots
+    if crawl.job['status'] == 'done':
+        cached = tree_cache.load(scoped_key(crawl.job['space_id'], crawl.job['scope']))
+        if cached is not None:
+            return cached.roots
+    return crawl.replay.writer.load_tree().roots
+
+def crawl_key(space_id, user_access_token):
+    return (space_id, tree_scope(user_access_token))
+
+def join_space_crawl(space_id, user_access_token, previous=None, detached=False, retain_tree=True):
+    """
+    加入当前用户对知识空间正在进行的爬取，没有时启动一个爬取任务（有该用户中断的任务时从其检查点恢复）
+    :param detached: 为 True 时爬取在没有订阅者时也继续进行（后台任务、后台刷新）；
+                     否则最后一个订阅者断开时取消爬取
+    :param retain_tree: 新启动的爬取是否在内存中保留节点树，只需要按批次推送节点时传 False；
+                        加入已有的爬取时不起作用，需要完整节点树时使用 crawl_result_roots
+    :return: (SharedCrawl, 是否新启动)，任务信息在 crawl.job 中
+    """
+    key = crawl_key(space_id, user_access_token)
+    resumable = crawl_jobs.find_resumable(space_id, key[1])
+
+    def run(crawl):
+        return run_crawl_job(crawl, space_id, user_access_token, previous, retain_tree)
+
+    def prepare(crawl):
+        crawl.job = (resumable and crawl_jobs.claim(resumable)) or crawl_jobs.create(space_id, key[1])
+        crawl.replay = JobReplay(crawl_jobs.writer(crawl.job), NODES_BATCH_SIZE)
+
+    crawl, started = crawl_hub.join(key, run, prepare)
+    if detached:
+        crawl.detached = True
+    if not started:
+        app.logger.info(f"Attached to in-progress crawl job {crawl.job['job_id']} of space {space_id}, {crawl.job['node_count']} nodes so far")
+    return crawl, started
+
+def schedule_space_tree_refresh(space_id, user_access_token, previous):
+    """在后台增量刷新缓存，同一用户的同一个知识空间同时只有一个刷新任务"""
+    join_space_crawl(space_id, user_access_token, previous, detached=True)
+
+def lookup_space_tree(space_id, user_access_token, refresh=None, retain_tree=True):
+    """
+    get_space_tree 的第一步：当前用户的缓存可用时直接返回缓存，否则加入（或启动）该用户对知识空间的爬取
+    缓存按用户区分，命中的节点树就是用同一令牌爬取的，不需要再校验访问权限
+    :param retain_tree: 见 join_space_crawl
+    :return: (CachedTree, 缓存状态) 或 (SharedCrawl, 是否新启动)，由第一个元素的类型区分
+    """
+    cached = tree_cache.load(space_tree_key(space_id, user_access_token)) if refresh != 'full' else None
+    if cached is not None and refresh is None:
+        age = time.time() - cached.crawled_at
+        stale = age > TREE_CACHE_TTL
+        if stale:
+            schedule_space_tree_refresh(space_id, user_access_token, cached)
+        return cached, {"hit": True, "cached_at": cached.crawled_at, "age_seconds": round(age, 1), "stale": stale}
+    return join_space_crawl(space_id, user_access_token, cached, retain_tree=retain_tree)
+
+def crawl_cache_status(crawl, started):
+    fresh = crawl.result
+    return {"hit": False, "cached_at": fresh.crawled_at, "age_seconds": 0, "stale": False, "shared": not started, "job": crawl.job['job_id']}
+
+def get_space_tree(space_id, user_access_token, progress_callback=None, refresh=None, stop=None):
+    """
+    获取知识空间的完整节点树，优先使用本地缓存
+    :param refresh: None 表示有缓存时直接返回（过期则在后台增量刷新）；'incremental' 同步增量刷新；'full' 同步全量爬取
+    :param stop: 可选的 threading.Event，调用方（如已断开的 SSE 客户端）置位后停止等待爬取并抛出 CrawlCancelled
+    :return: (节点列表, 缓存状态)
+    """
+    source, status = lookup_space_tree(space_id, user_access_token, refresh)
+    if isinstance(source, CachedTree):
+        if progress_callback:
+            progress_callback(source.node_count)
+        return source.roots, status
+
+    for event in source.subscribe(stop, nodes=False):
+        if progress_callback:
+            progress_callback(event[1])
+    return crawl_result_roots(source), crawl_cache_status(source, status)
+
+def format_nodes_event(parent_node_token, items):
+    nodes = [{key: value for key, value in item.items() if key != 'children'} for item in items]
+    return f"data: {json.dumps({'type': 'nodes', 'parent': parent_node_token, 'items': nodes})}\n\n"
+
+def iter_cached_tree_events(cached, cache_status):
+    """按批次推送缓存中的节点树"""
+    yield f"data: {json.dumps({'type': 'progress', 'count': cached.node_count})}\n\n"
+    for parent_node_token, items in iter_tree_batches(cached.roots, NODES_BATCH_SIZE):
+        yield format_nodes_event(parent_node_token, items)
+    yield f"data: {json.dumps({'type': 'done', 'count': cached.node_count, 'cache': cache_status})}\n\n"
+
+def format_crawl_event(event):
+    """把爬取事件转换为增量模式的 SSE 帧"""
+    if event[0] == 'progress':
+        return [f"data: {json.dumps({'type': 'progress', 'count': event[1]})}\n\n"]
+    return [
+        format_nodes_event(event[1], event[2][start:start + NODES_BATCH_SIZE])
+        for start in range(0, len(event[2]), NODES_BATCH_SIZE)
+    ]
+
+def format_crawl_done(crawl, started):
+    return f"data: {json.dumps({'type': 'done', 'count': crawl.result.node_count, 'cache': crawl_cache_status(crawl, started)})}\n\n"
+
+def iter_crawl_events(crawl, started):
+    """
+    订阅一次爬取：先补发已经拉取到的节点，再推送后续的进度，最后推送 done
+    客户端断开时生成器被关闭（GeneratorExit），订阅随之结束，最后一个订阅者离开时爬取被取消
+    """
+    events = crawl.subscribe()
+    try:
+        for event in events:
+            yield from format_crawl_event(event)
+    finally:
+        events.close()
+    yield format_crawl_done(crawl, started)
+
+def format_node_stream_error(e, label):
+    """节点流中的异常转换为 SSE 错误帧"""
+    if isinstance(e, FeishuRequestError):
+        app.logger.error(f"Request error in {label}: {str(e)}")
+        if e.response is not None and e.response.status_code == 429:
+            return [f"data: {json.dumps({'type': 'error', 'message': 'Rate limit exceeded. Please try again later.', 'retry_after': 60})}\n\n"]
+    else:
+        app.logger.error(f"Unexpected error in {label}: {str(e)}")
+    return [f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n", "data: \n\n"]
+
+def generate_incremental_nodes(space_id, user_access_token, refresh=None, crawl=None):
+    """
+    以增量方式推送知识空间节点树的 SSE 生成器
+    每拉取到一页子节点就发送 {"type": "nodes", "parent": ..., "items": [...]}，最后发送 {"type": "done"}；
+    缓存命中时直接按批次推送缓存中的节点树。
+    同一知识空间正在爬取时订阅这次爬取：先补发已经拉取到的节点，再推送后续的进度。
+    :param crawl: 可选，直接订阅指定的爬取任务（SharedCrawl）
+    """
+    try:
+        started = False
+        if crawl is None:
+            source, status = lookup_space_tree(space_id, user_access_token, refresh, retain_tree=False)
+            if isinstance(source, CachedTree):
+                yield from iter_cached_tree_events(source, status)
+                yield "data: \n\n"
+                return
+            crawl, started = source, status
+        yield from iter_crawl_events(crawl, started)
+        yield "data: \n\n"
+    except Exception as e:
+        yield from format_node_stream_error(e, "incremental node stream")
+
+async def agenerate_incremental_nodes(space_id, user_access_token, refresh=None, crawl=None):
+    """generate_incremental_nodes 的异步版本（ASGI 模式），等待爬取事件时不占用线程"""
+    try:
+        started = False
+        if crawl is None:
+            source, status = await asyncio.to_thread(lookup_space_tree, space_id, user_access_token, refresh, False)
+            if isinstance(source, CachedTree):
+                for frame in iter_cached_tree_events(source, status):
+                    yield frame
+                    # 推送大的缓存树时让出事件循环
+                    await asyncio.sleep(0)
+                yield "data: \n\n"
+                return
+            crawl, started = source, status
+        events = crawl.subscribe_async()
+        try:
+            async for event in events:
+                for frame in format_crawl_event(event):
+                    yield frame
+        finally:
+            await events.aclose()
+        yield format_crawl_done(crawl, started)
+        yield "data: \n\n"
+    except Exception as e:
+        for frame in format_node_stream_error(e, "incremental node stream"):
+            yield frame
+
+async def agenerate_space_tree_events(space_id, user_access_token, refresh=None, label="node stream"):
+    """
+    非增量模式节点流（/nodes/all/stream 与 /nodes/export）的异步版本：
+    推送 {"type": "progress"}，最后一次性推送 {"type": "result", "data": 整棵树, "cache": ...}
+    """
+    try:
+        source, status = await asyncio.to_thread(lookup_space_tree, space_id, user_access_token, refresh)
+        if isinstance(source, CachedTree):
+            yield f"data: {json.dumps({'type': 'progress', 'count': source.node_count})}\n\n"
+            roots = source.roots
+        else:
+            events = source.subscribe_async(nodes=False)
+            try:
+                async for event in events:
+                    yield f"data: {json.dumps({'type': 'progress', 'count': event[1]})}\n\n"
+            finally:
+                await events.aclose()
+            roots = await asyncio.to_thread(crawl_result_roots, source)
+            status = crawl_cache_status(source, status)
+        # 序列化整棵树较耗时，放到线程中进行
+        result = await asyncio.to_thread(json.dumps, roots)
+        app.logger.info(f"Sending final result for {label}, space_id: {space_id}")
+        yield f"data: {{\"type\": \"result\", \"data\": {result}, \"cache\": {json.dumps(status)}}}\n\n"
+        yield "data: \n\n"
+    except Exception as e:
+        for frame in format_node_stream_error(e, label):
+            yield frame
+
+def parse_refresh_param(value):
+    """解析 refresh 查询参数：full 表示全量爬取，1/true/incremental 表示增量刷新"""
+    if not value:
+        return None
+    if value == 'full':
+        return 'full'
+    if value.lower() in ('1', 'true', 'incremental'):
+        return 'incremental'
+    return None
+
 @app.route('/api/wiki/<space_id>/nodes/all', methods=['GET'])
 def get_all_wiki_nodes(space_id):
     auth_header = request.headers.get('Authorization')
@@ -604,13 +1205,17 @@ def get_all_wiki_nodes(space_id):
     user_access_token = auth_header.split(' ')[1]
 
     try:
-        all_nodes = fetch_all_nodes_recursively(space_id, user_access_token)
-        return jsonify(all_nodes)
-    except requests.exceptions.RequestException as e:
+        all_nodes, cache_status = get_space_tree(space_id, user_access_token, refresh=parse_refresh_param(request.args.get('refresh')))
+        response = jsonify(all_nodes)
+        response.headers['X-Cache'] = 'HIT' if cache_status['hit'] else 'MISS'
+        response.headers['X-Cache-Age'] = str(cache_status['age_seconds'])
+        response.headers['X-Cache-Stale'] = 'true' if cache_status['stale'] else 'false'
+        return response
+    except FeishuRequestError as e:
         app.logger.error(f"Request error: {str(e)}")
         if e.response is not None:
             app.logger.error(f"Response status: {e.response.status_code}")
-            app.logger.error(f"Response content: {e.response.text}")
+            app.logger.error("Response content: %s", log_payload(e.response.text))
             # 特别处理速率限制错误
             if e.response.status_code == 429:
                 return jsonify({"error": "Rate limit exceeded. Please try again later.", "retry_after": 60}), 429
@@ -621,6 +1226,187 @@ def get_all_wiki_nodes(space_id):
                 return jsonify({"error": e.response.text}), e.response.status_code
         return jsonify({"error": str(e)}), 500
 
+# --- Crawl Jobs ---
+
+def crawl_job_status(job_id):
+    """
+    查询爬取任务：正在进行的任务返回内存中的实时状态，否则返回检查点中的状态
+    :return: (SharedCrawl 或 None, 任务信息或 None)
+    """
+    crawl = crawl_hub.find_job(job_id)
+    if crawl is not None:
+        return crawl, crawl.job
+    return None, crawl_jobs.get(job_id)
+
+@app.route('/api/wiki/<space_id>/jobs', methods=['POST'])
+def create_crawl_job(space_id):
+    """启动知识空间的后台爬取任务；已有进行中的任务时加入它，有中断的任务时从检查点恢复"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Unauthorized"}), 401
+    user_access_token = auth_header.split(' ')[1]
+
+    data = request.get_json(silent=True) or {}
+    previous = tree_cache.load(space_tree_key(space_id, user_access_token)) if parse_refresh_param(data.get('refresh')) != 'full' else None
+    # 任务的结果通过事件流按批次推送或从缓存读取，不需要在内存中保留节点树
+    crawl, started = join_space_crawl(space_id, user_access_token, previous, detached=True, retain_tree=False)
+    status = job_summary(crawl.job)
+    status.update(live=True, shared=not started)
+    app.logger.info(f"Crawl job {status['job_id']} for space {space_id}: {'started' if started else 'joined'}")
+    return jsonify(status), 202
+
+@app.route('/api/wiki/jobs/<job_id>', methods=['GET'])
+def get_crawl_job(job_id):
+    """轮询爬取任务的状态"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({"error": "Unauthorized"}), 401
+    user_access_token = auth_header.split(' ')[1]
+
+    crawl, job = crawl_job_status(job_id)
+    # 任务只对发起它的用户可见
+    if job is None or job['scope'] != tree_scope(user_access_token):
+        return jsonify({"error": "Crawl job not found"}), 404
+    if not check_space_access(job['space_id'], user_access_token):
+        return jsonify({"error": "No access to this space"}), 403
+    status = job_summary(job)
+    status.update(live=crawl is not None, subscribers=crawl.subscribers if crawl is not None else 0)
+    return jsonify(status)
+
+@app.route('/api/wiki/jobs/<job_id>/events', methods=['GET'])
+def stream_crawl_job(job_id):
+    """
+    订阅爬取任务的 SSE 事件流，事件格式与增量模式（mode=incremental）相同
+    进行中的任务先补发已拉取的节点再推送后续进度；已完成的任务推送缓存中的节点树
+    """
+    # 从查询参数或Authorization头获取token
+    user_access_token = request.args.get('token')
+    if not user_access_token:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Unauthorized"}), 401
+        user_access_token = auth_header.split(' ')[1]
+
+    crawl, job = crawl_job_status(job_id)
+    if job is None or job['scope'] != tree_scope(user_access_token):
+        return jsonify({"error": "Crawl job not found"}), 404
+    if not check_space_access(job['space_id'], user_access_token):
+        return jsonify({"error": "No access to this space"}), 403
+    if crawl is not None:
+        return sse_response(
+            lambda: generate_incremental_nodes(job['space_id'], user_access_token, crawl=crawl),
+            lambda: agenerate_incremental_nodes(job['space_id'], user_access_token, crawl=crawl)
+        )
+    if job['status'] == 'done' and tree_cache.load(scoped_key(job['space_id'], job['scope'])) is not None:
+        return sse_response(
+            lambda: generate_incremental_nodes(job['space_id'], user_access_token),
+            lambda: agenerate_incremental_nodes(job['space_id'], user_access_token)
+        )
+    return jsonify({
+        "error": f"Crawl job is {job['status']}, POST /api/wiki/{job['space_id']}/jobs to resume it",
+        "job": job_summary(job)
+    }), 409
+
+# --- Markdown Outline ---
+OUTLINE_CHUNK_SIZE = int(os.getenv('OUTLINE_CHUNK_SIZE', '16384'))  # 流式输出大纲时每次写出的字符数
+
+def parse_outline_options(options):
+    """
+    从查询参数或请求体中解析大纲渲染选项
+    depth: 最多渲染的层数；root: 只渲染以该节点为根的子树；
+    expanded: 已展开节点的 token 列表（或逗号分隔的字符串）；target: 目标节点 token；
+    tokens: 是否附带节点 token，默认完整大纲附带、按展开节点过滤时不附带（与前端的两种格式一致）
+    """
+    depth = options.get('depth')
+    expanded = options.get('expanded')
+    if isinstance(expanded, str):
+        expanded = [token for token in expanded.split(',') if token]
+    tokens = options.get('tokens')
+    if tokens is None or tokens == '':
+        show_token = expanded is None
+    elif isinstance(tokens, str):
+        show_token = tokens.lower() in ('1', 'true')
+    else:
+        show_token = bool(tokens)
+    return {
+        'max_depth': int(depth) if depth not in (None, '') else None,
+        'root_token': options.get('root') or None,
+        'expanded': set(expanded) if expanded is not None else None,
+        'target_token': options.get('target') or None,
+        'show_token': show_token
+    }
+
+def render_space_outline(space_id, user_access_token, max_depth=None, root_token=None, expanded=None, target_token=None, show_token=True):
+    """
+    读取缓存（或爬取）的知识空间节点树，返回逐行产出 Markdown 大纲的生成器
+    节点树在调用时就会获取，飞书请求失败或 root_token 不存在时在开始输出前抛出异常
+    """
+    roots, _ = get_space_tree(space_id, user_access_token)
+    if root_token:
+        node = find_node(roots, root_token)
+        if node is None:
+            raise KeyError(root_token)
+        roots = [node]
+    return iter_markdown_outline(roots, max_depth, show_token, expanded, target_token)
+
+def iter_text_chunks(lines, chunk_size):
+    """把逐行产出的文本合并成大约 chunk_size 个字符的块，减少流式响应的写出次数"""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def resolve_outline_placeholder(data, user_access_token):
+    """
+    LLM 接口传入 space_id 时在服务端渲染知识库大纲，代替请求体中的原始 Markdown
+    渲染选项放在 outline 字段中，outline.placeholder 指定填充的占位符，默认 KNOWLEDGE_BASE_STRUCTURE
+    :return: (占位符名, 大纲文本)
+    """
+    options = data.get('outline') or {}
+    placeholder = options.get('placeholder') or 'KNOWLEDGE_BASE_STRUCTURE'
+    outline = ''.join(render_space_outline(data['space_id'], user_access_token, **parse_outline_options(options)))
+    app.logger.info(f"Rendered outline for space_id: {data['space_id']}, length: {len(outline)}")
+    return placeholder, outline
+
+def outline_error_response(e):
+    """把渲染大纲时的异常转换为 JSON 错误响应"""
+    if isinstance(e, KeyError):
+        return jsonify({"error": f"Node not found in space tree: {e.args[0]}"}), 404
+    if isinstance(e, ValueError):
+        return jsonify({"error": f"Invalid outline options: {e}"}), 400
+    app.logger.error(f"Request error while rendering outline: {str(e)}")
+    if e.response is not None:
+        if e.response.status_code == 429:
+            return jsonify({"error": "Rate limit exceeded. Please try again later.", "retry_after": 60}), 429
+        try:
+            return jsonify({"error": e.response.json()}), e.response.status_code
+        except ValueError:
+            return jsonify({"error": e.response.text}), e.response.status_code
+    return jsonify({"error": str(e)}), 500
+
+@app.route('/api/wiki/<space_id>/outline', methods=['GET'])
+def get_wiki_outline(space_id):
+    # 从查询参数或Authorization头获取token
+    user_access_token = request.args.get('token')
+    if not user_access_token:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Unauthorized"}), 401
+        user_access_token = auth_header.split(' ')[1]
+
+    try:
+        lines = render_space_outline(space_id, user_access_token, **parse_outline_options(request.args))
+    except (FeishuRequestError, KeyError, ValueError) as e:
+        return outline_error_response(e)
+    return Response(iter_text_chunks(lines, OUTLINE_CHUNK_SIZE), content_type='text/markdown; charset=utf-8')
+
 # 兼容旧版本的API端点，用于导出全量导航数据
 @app.route('/api/wiki/nodes/export', methods=['GET'])
 def export_wiki_nodes():
@@ -638,11 +1424,23 @@ def export_wiki_nodes():
         user_access_token = auth_header.split(' ')[1]
 
     app.logger.info(f"SSE export connection attempt started for space_id: {space_id}")
+
+    # 增量模式：按页推送 nodes 事件，不在最后一次性发送整棵树
+    if request.args.get('mode') == 'incremental':
+        refresh = parse_refresh_param(request.args.get('refresh'))
+        return sse_response(
+            lambda: generate_incremental_nodes(space_id, user_access_token, refresh),
+            lambda: agenerate_incremental_nodes(space_id, user_access_token, refresh)
+        )
     
     # 创建一个队列来传递进度更新
     import queue
     progress_queue = queue.Queue()
     result = []
+    cache_status = {}
+    # 客户端断开时置位，通知爬取线程停止等待；没有其他订阅者时爬取随之取消
+    closed = threading.Event()
+    refresh = parse_refresh_param(request.args.get('refresh'))
 
     def generate():
         try:
@@ -658,11 +1456,14 @@ def export_wiki_nodes():
                 try:
                     nonlocal result
                     app.logger.info(f"Starting to fetch all nodes for export, space_id: {space_id}")
-                    all_nodes = fetch_all_nodes_recursively(space_id, user_access_token, progress_callback=progress_callback)
+                    all_nodes, status = get_space_tree(space_id, user_access_token, progress_callback, refresh, stop=closed)
                     result.extend(all_nodes)
+                    cache_status.update(status)
                     app.logger.info(f"Finished fetching all nodes for export, space_id: {space_id}, node count: {len(result)}")
                     # 发送完成信号
                     progress_queue.put(None)
+                except CrawlCancelled:
+                    app.logger.info(f"Client disconnected, stopped fetching nodes for export, space_id: {space_id}")
                 except Exception as e:
                     app.logger.error(f"Error while fetching nodes for export, space_id: {space_id}, error: {str(e)}")
                     # 发送错误信号
@@ -698,16 +1499,16 @@ def export_wiki_nodes():
             
             # 发送最终结果
             app.logger.info(f"Sending final export result for space_id: {space_id}, node count: {len(result)}")
-            yield f"data: {{\"type\": \"result\", \"data\": {json.dumps(result)}}}\n\n"
+            yield f"data: {{\"type\": \"result\", \"data\": {json.dumps(result)}, \"cache\": {json.dumps(cache_status)}}}\n\n"
             
             # 显式结束流
             app.logger.info(f"SSE export stream ended normally for space_id: {space_id}")
             yield "data: \n\n"
-        except requests.exceptions.RequestException as e:
+        except FeishuRequestError as e:
             app.logger.error(f"Request error in export: {str(e)}")
             if e.response is not None:
                 app.logger.error(f"Response status: {e.response.status_code}")
-                app.logger.error(f"Response content: {e.response.text}")
+                app.logger.error("Response content: %s", log_payload(e.response.text))
                 # 特别处理速率限制错误
                 if e.response.status_code == 429:
                     app.logger.info(f"Rate limit exceeded for export, space_id: {space_id}")
@@ -727,9 +1528,11 @@ def export_wiki_nodes():
             # 显式结束流
             app.logger.info(f"SSE export stream ended with unexpected error for space_id: {space_id}")
             yield "data: \n\n"
+        finally:
+            closed.set()
     
     app.logger.info(f"SSE export connection established for space_id: {space_id}")
-    return Response(generate(), content_type='text/event-stream')
+    return sse_response(generate, lambda: agenerate_space_tree_events(space_id, user_access_token, refresh, "export"))
 
 @app.route('/api/wiki/<space_id>/nodes/all/stream', methods=['GET'])
 def get_all_wiki_nodes_stream(space_id):
@@ -742,11 +1545,23 @@ def get_all_wiki_nodes_stream(space_id):
         user_access_token = auth_header.split(' ')[1]
 
     app.logger.info(f"SSE connection attempt started for space_id: {space_id}")
+
+    # 增量模式：按页推送 nodes 事件，不在最后一次性发送整棵树
+    if request.args.get('mode') == 'incremental':
+        refresh = parse_refresh_param(request.args.get('refresh'))
+        return sse_response(
+            lambda: generate_incremental_nodes(space_id, user_access_token, refresh),
+            lambda: agenerate_incremental_nodes(space_id, user_access_token, refresh)
+        )
     
     # 创建一个队列来传递进度更新
     import queue
     progress_queue = queue.Queue()
     result = []
+    cache_status = {}
+    # 客户端断开时置位，通知爬取线程停止等待；没有其他订阅者时爬取随之取消
+    closed = threading.Event()
+    refresh = parse_refresh_param(request.args.get('refresh'))
 
     def generate():
         try:
@@ -762,11 +1577,14 @@ def get_all_wiki_nodes_stream(space_id):
                 try:
                     nonlocal result
                     app.logger.info(f"Starting to fetch all nodes for space_id: {space_id}")
-                    all_nodes = fetch_all_nodes_recursively(space_id, user_access_token, progress_callback=progress_callback)
+                    all_nodes, status = get_space_tree(space_id, user_access_token, progress_callback, refresh, stop=closed)
                     result.extend(all_nodes)
+                    cache_status.update(status)
                     app.logger.info(f"Finished fetching all nodes for space_id: {space_id}, node count: {len(result)}")
                     # 发送完成信号
                     progress_queue.put(None)
+                except CrawlCancelled:
+                    app.logger.info(f"Client disconnected, stopped fetching nodes for space_id: {space_id}")
                 except Exception as e:
                     app.logger.error(f"Error while fetching nodes for space_id: {space_id}, error: {str(e)}")
                     # 发送错误信号
@@ -802,16 +1620,16 @@ def get_all_wiki_nodes_stream(space_id):
             
             # 发送最终结果
             app.logger.info(f"Sending final result for space_id: {space_id}, node count: {len(result)}")
-            yield f"data: {{\"type\": \"result\", \"data\": {json.dumps(result)}}}\n\n"
+            yield f"data: {{\"type\": \"result\", \"data\": {json.dumps(result)}, \"cache\": {json.dumps(cache_status)}}}\n\n"
             
             # 显式结束流
             app.logger.info(f"SSE stream ended normally for space_id: {space_id}")
             yield "data: \n\n"
-        except requests.exceptions.RequestException as e:
+        except FeishuRequestError as e:
             app.logger.error(f"Request error: {str(e)}")
             if e.response is not None:
                 app.logger.error(f"Response status: {e.response.status_code}")
-                app.logger.error(f"Response content: {e.response.text}")
+                app.logger.error("Response content: %s", log_payload(e.response.text))
                 # 特别处理速率限制错误
                 if e.response.status_code == 429:
                     app.logger.info(f"Rate limit exceeded for space_id: {space_id}")
@@ -831,9 +1649,11 @@ def get_all_wiki_nodes_stream(space_id):
             # 显式结束流
             app.logger.info(f"SSE stream ended with unexpected error for space_id: {space_id}")
             yield "data: \n\n"
+        finally:
+            closed.set()
     
     app.logger.info(f"SSE connection established for space_id: {space_id}")
-    return Response(generate(), content_type='text/event-stream')
+    return sse_response(generate, lambda: agenerate_space_tree_events(space_id, user_access_token, refresh))
 
 @app.route('/api/wiki/<space_id>/nodes', methods=['GET'])
 def get_wiki_nodes(space_id):
@@ -854,14 +1674,14 @@ def get_wiki_nodes(space_id):
 
     try:
         # Fetch nodes with pagination
-        data = fetch_node_children(space_id, parent_node_token, user_access_token, page_token)
+        data = fetch_nodes_page(space_id, user_access_token, parent_node_token, page_token)
         return jsonify(data)
 
-    except requests.exceptions.RequestException as e:
+    except FeishuRequestError as e:
         app.logger.error(f"Request error: {str(e)}")
         if e.response is not None:
             app.logger.error(f"Response status: {e.response.status_code}")
-            app.logger.error(f"Response content: {e.response.text}")
+            app.logger.error("Response content: %s", log_payload(e.response.text))
             try:
                 error_data = e.response.json()
                 return jsonify({"error": error_data}), e.response.status_code
@@ -869,11 +1689,78 @@ def get_wiki_nodes(space_id):
                 return jsonify({"error": e.response.text}), e.response.status_code
         return jsonify({"error": str(e)}), 500
 
+# --- Document Content Cache ---
+# 按 (obj_token, 文档版本) 缓存文档纯文本内容，同一文档重复分析时无需重新下载
+document_cache = DocumentCache(
+    max_bytes=int(os.getenv('DOC_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+    max_entry_bytes=int(os.getenv('DOC_CACHE_MAX_ENTRY_BYTES', str(8 * 1024 * 1024)))
+)
+
+def raw_content_url(obj_type, obj_token):
+    if obj_type == 'doc':
+        return f"/doc/v1/documents/{obj_token}/raw_content"
+    return f"/docx/v1/documents/{obj_token}/raw_content"
+
+def fetch_document_revision(obj_token, user_access_token):
+    """
+    获取 docx 文档当前的 revision_id，同时确认当前用户有权限访问该文档
+    获取失败时返回 None，由调用方直接下载文档内容
+    """
+    try:
+        response = feishu_client.get(f"/docx/v1/documents/{obj_token}", user_access_token=user_access_token)
+        raise_for_status(response)
+        data = response.json()
+    except (FeishuRequestError, ValueError) as e:
+        app.logger.warning(f"Failed to fetch revision of document {obj_token}: {e}")
+        return None
+    if data.get("code") != 0:
+        app.logger.warning(f"Failed to fetch revision of document {obj_token}: {data.get('msg')}")
+        return None
+    return data.get("data", {}).get("document", {}).get("revision_id")
+
+def document_revision(obj_type, obj_token, user_access_token, edit_time=None):
+    """
+    文档内容缓存使用的文档版本，每种文档类型只使用一种版本字段，不同入口缓存的同一文档可以互相命中：
+    docx 文档使用 revision_id（同时用当前用户的 token 确认访问权限），
+    旧版 doc 文档没有 revision_id，使用用当前用户 token 获取到的知识库节点 obj_edit_time
+    :return: 版本字符串，无法确定版本时返回 None（不使用缓存）
+    """
+    if obj_type == 'docx':
+        revision = fetch_document_revision(obj_token, user_access_token)
+        return None if revision is None else f"revision_id:{revision}"
+    return None if edit_time is None else f"obj_edit_time:{edit_time}"
+
+def fetch_document_content(obj_type, obj_token, user_access_token, edit_time=None):
+    """
+    获取文档纯文本内容，优先读取文档内容缓存
+    :param edit_time: 用当前用户 token 获取到的知识库节点 obj_edit_time，仅作为没有 revision_id 的文档类型的版本
+    :return: (文档内容, 是否命中缓存)
+    """
+    revision = document_revision(obj_type, obj_token, user_access_token, edit_time)
+    if revision is not None:
+        content = document_cache.get(obj_token, revision)
+        if content is not None:
+            app.logger.info(f"Document content cache hit: {obj_token} (revision: {revision}, length: {len(content)})")
+            return content, True
+
+    url = raw_content_url(obj_type, obj_token)
+    app.logger.info(f"Fetching document content from Feishu with URL: {url}")
+    response = feishu_client.get(url, user_access_token=user_access_token)
+    raise_for_status(response)
+    data = response.json()
+    if data.get("code") != 0:
+        app.logger.error(f"Feishu API error code: {data.get('code')}")
+        raise FeishuRequestError(data.get("msg", "Failed to fetch document content"))
+    content = data.get("data", {}).get('content', '')
+    app.logger.info(f"Successfully fetched document content, length: {len(content)}")
+    if revision is not None:
+        document_cache.put(obj_token, revision, content)
+    return content, False
+
 @app.route('/api/wiki/doc/<obj_token>', methods=['GET'])
 def get_wiki_document(obj_token):
     # 记录请求信息，便于调试
     app.logger.info(f"=== Incoming /api/wiki/doc/{obj_token} Request ===")
-    app.logger.info(f"Request headers: {dict(request.headers)}")
     
     # 支持多种认证方式，增强健壮性
     user_access_token = None
@@ -899,40 +1786,20 @@ def get_wiki_document(obj_token):
     token_preview = user_access_token[:10] + "..." if len(user_access_token) > 10 else user_access_token
     app.logger.info(f"Authentication successful, token preview: {token_preview}")
     
-    url = f"https://open.feishu.cn/open-apis/docx/v1/documents/{obj_token}/raw_content"
-    headers = {
-        "Authorization": f"Bearer {user_access_token}"
-    }
-    
-    app.logger.info(f"Fetching document content from Feishu with URL: {url}")
     app.logger.info(f"Document obj_token: {obj_token}")
 
     try:
-        response = requests.get(url, headers=headers)
-        app.logger.info(f"Feishu API response status: {response.status_code}")
-        app.logger.info(f"Feishu API response headers: {dict(response.headers)}")
-        
-        response.raise_for_status()
-        data = response.json()
-        app.logger.info(f"Feishu API response data: {data}")
-        
-        if data.get("code") == 0:
-            document_data = data.get("data", {})
-            content_length = len(document_data.get('content', ''))
-            app.logger.info(f"Successfully fetched document content, length: {content_length}")
-            return jsonify(document_data)
-        else:
-            error_msg = data.get("msg", "Failed to fetch document")
-            app.logger.error(f"Feishu API returned error: {error_msg}")
-            app.logger.error(f"Feishu API error code: {data.get('code')}")
-            return jsonify({"error": error_msg}), 500
-    except requests.exceptions.RequestException as e:
+        content, cache_hit = fetch_document_content('docx', obj_token, user_access_token)
+        response = jsonify({"content": content})
+        response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+        return response
+    except FeishuRequestError as e:
         error_msg = f"Failed to fetch document content: {e}"
         app.logger.error(error_msg)
         if e.response is not None:
             app.logger.error(f"Response status: {e.response.status_code}")
-            app.logger.error(f"Response headers: {dict(e.response.headers)}")
-            app.logger.error(f"Response content: {e.response.text}")
+            app.logger.error("Response headers: %s", log_payload(e.response.headers))
+            app.logger.error("Response content: %s", log_payload(e.response.text))
             try:
                 error_data = e.response.json()
                 return jsonify({"error": error_data}), e.response.status_code
@@ -940,6 +1807,185 @@ def get_wiki_document(obj_token):
                 return jsonify({"error": e.response.text}), e.response.status_code
         return jsonify({"error": str(e)}), 500
 
+# --- LLM Client ---
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', ARK_BASE_URL)
+
+# 按 (API Key, base_url) 复用的大模型客户端，连续的分析请求可以复用 keep-alive 连接
+llm_clients = LLMClientRegistry(
+    max_clients=int(os.getenv('LLM_MAX_CLIENTS', '16')),
+    idle_timeout=float(os.getenv('LLM_CLIENT_IDLE_TIMEOUT', '300')),
+    connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.getenv('LLM_READ_TIMEOUT', '300')),
+    max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+    max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '10'))
+)
+
+# ASGI 模式下流式接口使用的 AsyncOpenAI 客户端，配置与 llm_clients 相同
+async_llm_clients = AsyncLLMClientRegistry(
+    max_clients=int(os.getenv('LLM_MAX_CLIENTS', '16')),
+    idle_timeout=float(os.getenv('LLM_CLIENT_IDLE_TIMEOUT', '300')),
+    connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT', '5')),
+    read_timeout=float(os.getenv('LLM_READ_TIMEOUT', '300')),
+    max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+    max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '10'))
+)
+
+# 流式输出的合并窗口：与上一个 SSE 事件间隔不足 LLM_SSE_COALESCE_MS 的连续同类型片段合并为一个事件，
+# 事件格式不变，快速模型每个回答的事件数和写入次数可减少一个数量级
+LLM_SSE_COALESCE_MS = float(os.getenv('LLM_SSE_COALESCE_MS', '100'))  # 毫秒，0 表示每个片段单独发送
+LLM_SSE_COALESCE_BYTES = int(os.getenv('LLM_SSE_COALESCE_BYTES', '2048'))  # 缓冲的文本达到该字节数时立即发送
+
+def new_delta_coalescer():
+    return DeltaCoalescer(max_bytes=LLM_SSE_COALESCE_BYTES, max_delay=LLM_SSE_COALESCE_MS / 1000)
+
+class LLMStreamTimer:
+    """
+    记录一次流式大模型调用的首 token 延迟、输出速度和总时长
+    token 数按流式返回的 reasoning/content 片段数近似（流式响应中每个片段通常对应一个 token）
+    :param stream: 指标中的 stream 标签，如 chat stream、stream analysis
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.tokens = 0
+        self.events = 0
+        # 客户端中途断开时生成器被关闭，不会执行到设置 outcome 的位置
+        self.outcome = 'cancelled'
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            llm_first_token_seconds.observe(self.stream, value=self.first_token_at - self.started)
+        self.tokens += 1
+
+    def finish(self):
+        now = time.perf_counter()
+        llm_stream_seconds.observe(self.stream, self.outcome, value=now - self.started)
+        llm_tokens_total.inc(self.stream, amount=self.tokens)
+        llm_events_total.inc(self.stream, amount=self.events)
+        if self.tokens > 1 and now > self.first_token_at:
+            llm_tokens_per_second.observe(self.stream, value=(self.tokens - 1) / (now - self.first_token_at))
+
+# --- LLM Response Cache ---
+# 请求体中 use_cache 为 true 时启用：相同模型、提示词、temperature 和 max_tokens 的请求直接回放上一次的完整响应
+llm_response_cache = LLMResponseCache(
+    max_bytes=int(os.getenv('LLM_RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    ttl=int(os.getenv('LLM_RESPONSE_CACHE_TTL', '3600'))  # 秒
+)
+
+def iter_delta_events(chunk):
+    """取出流式响应中一个 chunk 的 (类型, 文本) 片段，推理内容（reasoning_content）在正文之前"""
+    if not chunk.choices:
+        return
+    delta = chunk.choices[0].delta
+    reasoning_content = getattr(delta, 'reasoning_content', None) or ""
+    if reasoning_content:
+        yield 'reasoning', reasoning_content
+    content = getattr(delta, 'content', None) or ""
+    if content:
+        yield 'content', content
+
+def format_llm_event(event_type, text):
+    # 使用 json.dumps 确保内容被正确转义
+    return f"data: {json.dumps({'type': event_type, 'content': text})}\n\n"
+
+def replay_llm_events(events):
+    """按与实时流相同的 SSE 格式回放缓存的响应"""
+    for event_type, text in events:
+        yield format_llm_event(event_type, text)
+    yield "data: [DONE]\n\n"
+
+def generate_llm_stream(api_key, call_params, cache_key=None, cached_events=None, label="LLM stream"):
+    """
+    流式调用大模型并转发为 SSE：{"type": "reasoning"|"content", "content": ...}，结束时发送 [DONE]
+    :param cache_key: 可选，完整结束的响应写入响应缓存时使用的键
+    :param cached_events: 可选，命中缓存时直接回放的片段
+    """
+    if cached_events is not None:
+        app.logger.info(f"LLM response cache hit for {label}, replaying {len(cached_events)} segments")
+        yield from replay_llm_events(cached_events)
+        return
+    recorder = LLMResponseRecorder()
+    timer = LLMStreamTimer(label)
+
+    def deltas(stream):
+        try:
+            for chunk in stream:
+                for event_type, text in iter_delta_events(chunk):
+                    timer.token()
+                    recorder.add(event_type, text)
+                    yield event_type, text
+        finally:
+            # 客户端中途断开时关闭上游连接，模型不再继续生成
+            stream.response.close()
+
+    try:
+        with llm_clients.lease(api_key, LLM_BASE_URL) as client:
+            stream = client.chat.completions.create(**call_params)
+            # 连续的同类型片段合并后发送，等待上游期间也按合并窗口发送已缓冲的片段，上游出错时已收到的片段先发送出去
+            events = new_delta_coalescer().coalesce(deltas(stream))
+            try:
+                for event_type, text in events:
+                    timer.events += 1
+                    yield format_llm_event(event_type, text)
+            finally:
+                events.close()
+        timer.outcome = 'ok'
+        # 只缓存完整结束的响应
+        if cache_key:
+            llm_response_cache.put(cache_key, recorder.result())
+        # 发送结束信号
+        yield "data: [DONE]\n\n"
+    except Exception as e:
+        timer.outcome = 'error'
+        app.logger.error(f"LLM Request error: {str(e)}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        timer.finish()
+
+async def agenerate_llm_stream(api_key, call_params, cache_key=None, cached_events=None, label="LLM stream"):
+    """generate_llm_stream 的异步版本（ASGI 模式），使用 AsyncOpenAI 客户端，等待模型输出时不占用线程"""
+    if cached_events is not None:
+        app.logger.info(f"LLM response cache hit for {label}, replaying {len(cached_events)} segments")
+        for frame in replay_llm_events(cached_events):
+            yield frame
+        return
+    recorder = LLMResponseRecorder()
+    timer = LLMStreamTimer(label)
+
+    async def deltas(stream):
+        async for chunk in stream:
+            for event_type, text in iter_delta_events(chunk):
+                timer.token()
+                recorder.add(event_type, text)
+                yield event_type, text
+
+    try:
+        async with async_llm_clients.lease(api_key, LLM_BASE_URL) as client:
+            stream = await client.chat.completions.create(**call_params)
+            # 等待上游期间也按合并窗口发送已缓冲的片段
+            events = new_delta_coalescer().acoalesce(deltas(stream))
+            try:
+                async for event_type, text in events:
+                    timer.events += 1
+                    yield format_llm_event(event_type, text)
+            finally:
+                await events.aclose()
+                # 客户端中途断开时关闭上游连接，模型不再继续生成
+                await stream.response.aclose()
+        timer.outcome = 'ok'
+        if cache_key:
+            llm_response_cache.put(cache_key, recorder.result())
+        yield "data: [DONE]\n\n"
+    except Exception as e:
+        timer.outcome = 'error'
+        app.logger.error(f"LLM Request error: {str(e)}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        timer.finish()
+
 @app.route('/api/chat/stream', methods=['POST'])
 def chat_stream():
     data = request.json
@@ -950,65 +1996,67 @@ def chat_stream():
     if not all([api_key, messages]):
         return jsonify({"error": "Missing required parameters"}), 400
 
-    def generate():
-        try:
-            # 使用OpenAI SDK进行流式调用
-            client = OpenAI(
-                base_url="https://ark.cn-beijing.volces.com/api/v3",
-                api_key=api_key
-            )
-            
-            stream = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=True,
-            )
-            
-            for chunk in stream:
-                if not chunk.choices:
-                    continue
-                
-                # 处理 reasoning_content
-                reasoning_content = ""
-                if hasattr(chunk.choices[0].delta, 'reasoning_content'):
-                    reasoning_content = chunk.choices[0].delta.reasoning_content or ""
-                if reasoning_content:
-                    # 按照SSE格式返回推理内容，并添加前缀以区分
-                    # 使用 json.dumps 确保内容被正确转义
-                    import json
-                    yield f"data: {{\"type\": \"reasoning\", \"content\": {json.dumps(reasoning_content)}}}\n\n"
-                
-                # 处理 content
-                content = ""
-                if hasattr(chunk.choices[0].delta, 'content'):
-                    content = chunk.choices[0].delta.content or ""
-                if content:
-                    # 按照SSE格式返回内容，并添加前缀以区分
-                    # 使用 json.dumps 确保内容被正确转义
-                    import json
-                    yield f"data: {{\"type\": \"content\", \"content\": {json.dumps(content)}}}\n\n"
-            
-            # 发送结束信号
-            yield "data: [DONE]\n\n"
-        except Exception as e:
-            app.logger.error(f"LLM request error: {e}")
-            # 使用 json.dumps 确保错误信息被正确转义
-            import json
-            yield f"data: {{\"error\": {json.dumps(str(e))}}}\n\n"
+    call_params = {"model": model, "messages": messages, "stream": True}
+    return sse_response(
+        lambda: generate_llm_stream(api_key, call_params, label="chat stream"),
+        lambda: agenerate_llm_stream(api_key, call_params, label="chat stream")
+    )
 
-    return Response(generate(), content_type='text/event-stream')
+
+# --- Prompt Budget ---
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '96000'))  # 提示词的估算 token 上限，0 表示不限制
+PROMPT_OUTLINE_MAX_DEPTH = int(os.getenv('PROMPT_OUTLINE_MAX_DEPTH', '6'))  # 超出预算时大纲最多保留的层数
+PROMPT_OUTLINE_MAX_SIBLINGS = int(os.getenv('PROMPT_OUTLINE_MAX_SIBLINGS', '50'))  # 超出预算时每组同级节点最多保留的数量
+# 请求体中 token_budget 的取值范围，超出时按边界处理
+PROMPT_TOKEN_BUDGET_MIN = int(os.getenv('PROMPT_TOKEN_BUDGET_MIN', '1000'))
+PROMPT_TOKEN_BUDGET_MAX = int(os.getenv('PROMPT_TOKEN_BUDGET_MAX', '1000000'))
+
+def request_token_budget(data):
+    """
+    请求体中的 token_budget，未提供时使用 PROMPT_TOKEN_BUDGET
+    必须是正整数（或整数字符串），否则抛出 ValueError；超出 [PROMPT_TOKEN_BUDGET_MIN, PROMPT_TOKEN_BUDGET_MAX] 时按边界处理
+    """
+    value = data.get('token_budget')
+    if value is None:
+        return PROMPT_TOKEN_BUDGET
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"Invalid token_budget: {value!r}, expected a positive integer")
+    try:
+        budget = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid token_budget: {value!r}, expected a positive integer")
+    if budget <= 0:
+        raise ValueError(f"Invalid token_budget: {value!r}, expected a positive integer")
+    return min(max(budget, PROMPT_TOKEN_BUDGET_MIN), PROMPT_TOKEN_BUDGET_MAX)
+
+def apply_prompt_budget(prompt_template, placeholders, data):
+    """
+    在占位符替换前把提示词控制在 token 预算内：先折叠知识库大纲，再截断文档正文
+    请求体中的 token_budget 可以覆盖默认预算，outline.target（或 target_token）指定需要保留路径的目标节点
+    """
+    budget = request_token_budget(data)
+    target_token = (data.get('outline') or {}).get('target') or data.get('target_token')
+    fitted, report = fit_placeholders(
+        prompt_template, placeholders, budget, target_token,
+        max_depth=PROMPT_OUTLINE_MAX_DEPTH, max_siblings=PROMPT_OUTLINE_MAX_SIBLINGS
+    )
+    if report['collapsed'] or report['truncated']:
+        app.logger.warning(
+            f"Prompt exceeds token budget ({report['estimated_tokens']} > {budget}), "
+            f"collapsed outlines: {report['collapsed']}, truncated: {report['truncated']}, "
+            f"estimated tokens after fitting: {report['final_tokens']}"
+        )
+    return fitted
 
 
 def replace_placeholders(prompt_template, placeholders):
     """
     统一的占位符替换函数
+    模板解析后按内容缓存，所有占位符在一次拼接中同时替换，已替换进来的内容（例如文档正文中的 {WIKI_TITLE}）不会被再次替换
     :param prompt_template: 提示词模板
     :param placeholders: 占位符字典
     :return: 替换后的提示词
     """
-    app.logger.info(f"Starting placeholder replacement with template length: {len(prompt_template) if prompt_template else 0}")
-    app.logger.debug(f"Placeholders to replace: {placeholders}")
-    
     if not prompt_template:
         app.logger.warning("Empty prompt_template provided to replace_placeholders")
         return prompt_template
@@ -1017,38 +2065,18 @@ def replace_placeholders(prompt_template, placeholders):
         app.logger.error(f"Invalid placeholders type: {type(placeholders)}, expected dict")
         return prompt_template
     
-    result = prompt_template
-    replaced_count = 0
-    
-    for placeholder, value in placeholders.items():
-        if not isinstance(placeholder, str):
-            app.logger.warning(f"Invalid placeholder type: {type(placeholder)}, skipping")
-            continue
-            
-        placeholder_pattern = f'{{{placeholder}}}'
-        if placeholder_pattern in result:
-            # 确保占位符被正确替换，即使值为None也替换为空字符串
-            replacement_value = str(value) if value is not None else ''
-            result = result.replace(placeholder_pattern, replacement_value)
-            replaced_count += 1
-            app.logger.debug(f"Replaced placeholder '{placeholder}' with value (length: {len(replacement_value)})")
-        else:
-            app.logger.debug(f"Placeholder '{placeholder}' not found in template")
+    template = compile_template(prompt_template)
+    result, missing = template.render(placeholders)
+    if missing:
+        app.logger.warning(f"Found unreplaced placeholders: {missing}")
     
-    # 检查是否还有未替换的占位符
-    import re
-    remaining_placeholders = re.findall(r'\{([^}]+)\}', result)
-    if remaining_placeholders:
-        app.logger.warning(f"Found unreplaced placeholders: {remaining_placeholders}")
-    
-    app.logger.info(f"Placeholder replacement completed: {replaced_count} placeholders replaced")
-    app.logger.debug(f"Final prompt length after replacement: {len(result)}")
+    app.logger.debug(f"Placeholder replacement completed: {len(template.slots) - len(missing)} slots filled, final prompt length: {len(result)}")
     return result
 
 @app.route('/api/llm/stream_analysis', methods=['POST'])
 def stream_analysis():
     data = request.json
-    app.logger.info(f"Received stream_analysis request with data: {data}")
+    app.logger.info("Received stream_analysis request with data: %s", log_payload(data))
     
     api_key = data.get('api_key')
     model = data.get('model', 'doubao-seed-1-6-250615')  # 默认模型参数
@@ -1062,16 +2090,31 @@ def stream_analysis():
         app.logger.error(error_msg)
         return jsonify({"error": error_msg}), 400
 
+    try:
+        request_token_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     # 如果提供了提示词模板和占位符，则进行替换以生成 messages
     if prompt_template:
         # 合并默认占位符和传入的占位符
         all_placeholders = {}
-        # 可以在这里添加一些默认的占位符
+        # 传入 space_id 时由服务端渲染知识库大纲
+        if data.get('space_id'):
+            auth_header = request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Bearer '):
+                return jsonify({"error": "Unauthorized"}), 401
+            try:
+                name, outline = resolve_outline_placeholder(data, auth_header.split(' ')[1])
+            except (FeishuRequestError, KeyError, ValueError) as e:
+                return outline_error_response(e)
+            all_placeholders[name] = outline
         all_placeholders.update(placeholders)
+        all_placeholders = apply_prompt_budget(prompt_template, all_placeholders, data)
         prompt = replace_placeholders(prompt_template, all_placeholders)
         # 使用替换后的提示词
         messages = [{'role': 'user', 'content': prompt}]
-        app.logger.info(f"Prompt after placeholder replacement: {prompt}")
+        app.logger.info("Prompt after placeholder replacement: %s", log_payload(prompt))
     
     # 如果到这里还没有 messages，则报错
     if not messages:
@@ -1089,279 +2132,445 @@ def stream_analysis():
     if max_tokens is not None:
         extra_params['max_tokens'] = max_tokens
 
-    def generate():
-        try:
-            # 使用OpenAI SDK进行流式调用
-            client = OpenAI(
-                base_url="https://ark.cn-beijing.volces.com/api/v3",
-                api_key=api_key
-            )
-            
-            # 准备调用参数
-            call_params = {
-                "model": model,
-                "messages": messages,
-                "stream": True,
-                **extra_params  # 展开额外参数
-            }
-            
-            app.logger.info(f"Calling LLM with params: {call_params}")
-            app.logger.info(f"Prompt sent to LLM (first 500 chars): {call_params['messages'][0]['content'][:500]}...")
-            
-            stream = client.chat.completions.create(**call_params)
-            
-            for chunk in stream:
-                if not chunk.choices:
-                    continue
-                
-                # 处理 reasoning_content
-                reasoning_content = ""
-                if hasattr(chunk.choices[0].delta, 'reasoning_content'):
-                    reasoning_content = chunk.choices[0].delta.reasoning_content or ""
-                if reasoning_content:
-                    # 按照SSE格式返回推理内容，并添加前缀以区分
-                    # 使用 json.dumps 确保内容被正确转义
-                    import json
-                    yield f"data: {{\"type\": \"reasoning\", \"content\": {json.dumps(reasoning_content)}}}\n\n"
-                
-                # 处理 content
-                content = ""
-                if hasattr(chunk.choices[0].delta, 'content'):
-                    content = chunk.choices[0].delta.content or ""
-                if content:
-                    # 按照SSE格式返回内容，并添加前缀以区分
-                    # 使用 json.dumps 确保内容被正确转义
-                    import json
-                    yield f"data: {{\"type\": \"content\", \"content\": {json.dumps(content)}}}\n\n"
-            
-            # 发送结束信号
-            yield "data: [DONE]\n\n"
-        except Exception as e:
-            error_msg = f"LLM Request error: {str(e)}"
-            app.logger.error(error_msg)
-            # 使用 json.dumps 确保错误信息被正确转义
-            import json
-            yield f"data: {{\"error\": {json.dumps(str(e))}}}\n\n"
+    # 可选的响应缓存，命中时不再调用大模型
+    cache_key = response_cache_key(api_key, LLM_BASE_URL, model, messages, temperature, max_tokens) if data.get('use_cache') else None
+    cached_events = llm_response_cache.get(cache_key) if cache_key else None
+
+    # 准备调用参数
+    call_params = {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        **extra_params  # 展开额外参数
+    }
+    if cached_events is None:
+        app.logger.info("Calling LLM with params: %s", log_payload(call_params))
 
     app.logger.info("Starting stream response for LLM analysis")
-    return Response(generate(), content_type='text/event-stream')
+    response = sse_response(
+        lambda: generate_llm_stream(api_key, call_params, cache_key, cached_events, "stream analysis"),
+        lambda: agenerate_llm_stream(api_key, call_params, cache_key, cached_events, "stream analysis")
+    )
+    response.headers['X-Cache'] = 'HIT' if cached_events is not None else 'MISS'
+    return response
+
+# 未提供提示词模板时使用的文档导入评估提示词
+DEFAULT_DOC_IMPORT_PROMPT = """你是一位专业的知识管理专家，具备以下能力：
+1. 深入理解文档内容，分析其主题、关键信息和潜在价值。
+2. 熟悉知识库的现有结构，能够准确判断文档的最佳归属节点。
+3. 提供清晰、有说服力的分析和建议，帮助用户做出决策。
+
+## 评估材料
+**知识库标题**：
+{WIKI_TITLE}
+
+**导入文档内容**：
+{IMPORTED_DOCUMENT_CONTENT}
+
+**当前知识库结构**：
+{KNOWLEDGE_BASE_STRUCTURE}
+
+## 评估任务
+请根据以上材料，完成以下三个任务：
+
+### 1. 内容匹配度分析
+分析导入文档与知识库现有节点的相关性，评估其在知识库中的潜在价值。
+
+### 2. 归属节点建议
+基于内容分析，推荐1-3个最适合的现有节点作为文档的归属位置，并简要说明理由。
+
+### 3. 导入决策
+综合以上分析，给出是否建议导入该文档的最终决策（建议导入/暂不建议导入），并提供简要说明。"""
+
+# 配置化的支持文档类型，便于扩展
+SUPPORTED_DOC_TYPES = ['doc', 'docx']
+
+def load_import_document(doc_token, doc_type, user_access_token):
+    """
+    获取待导入文档的纯文本内容，wiki 类型先通过 get_node 解析实际的 obj_type 和 obj_token
+    节点信息不完整或文档类型不支持时抛出 ValueError，飞书请求失败时抛出 FeishuRequestError
+    """
+    # 如果是wiki类型，需要先获取实际的obj_type和obj_token
+    if doc_type == 'wiki':
+        app.logger.info(f"Processing wiki type document with token: {doc_token}")
+        # 爬取过的节点直接从映射中取得，否则调用获取知识空间节点接口（同一用户对同一节点的并发请求只发送一次）
+        node_detail = node_resolver.resolve(
+            doc_token,
+            lambda token: fetch_wiki_node(token, user_access_token),
+            flight_key=(doc_token, user_access_token)
+        )
+        actual_obj_type = node_detail.get("obj_type")
+        actual_obj_token = node_detail.get("obj_token")
+        app.logger.info(f"Wiki node resolved - obj_type: {actual_obj_type}, obj_token: {actual_obj_token}")
+        
+        # 检查obj_type是否为支持的文档类型
+        if not actual_obj_type:
+            error_msg = f"Failed to extract document type from wiki node. Response structure may have changed."
+            app.logger.error(error_msg)
+            app.logger.error(f"Available fields in node_detail: {list(node_detail.keys()) if node_detail else 'None'}")
+            raise ValueError(error_msg)
+        
+        # 检查obj_token是否存在
+        if not actual_obj_token:
+            error_msg = f"Failed to extract document token from wiki node. Document token is required."
+            app.logger.error(error_msg)
+            app.logger.error(f"Document type: {actual_obj_type}, Available fields: {list(node_detail.keys()) if node_detail else 'None'}")
+            raise ValueError(error_msg)
+        
+        if actual_obj_type not in SUPPORTED_DOC_TYPES:
+            error_msg = f"Unsupported document type: {actual_obj_type}. Only {', '.join(SUPPORTED_DOC_TYPES)} types are supported."
+            app.logger.error(error_msg)
+            raise ValueError(error_msg)
+        
+        # docx 文档由 fetch_document_content 获取 revision_id 校验缓存和访问权限；
+        # 刚用当前用户的 token 获取到的 obj_edit_time 只用作旧版 doc 文档的版本
+        doc_obj_type, doc_obj_token = actual_obj_type, actual_obj_token
+        doc_edit_time = node_detail.get("obj_edit_time")
+        app.logger.info(f"Fetching document content for wiki with resolved token: {doc_obj_token}")
+    else:
+        # 直接使用doc_token获取文档内容
+        doc_obj_type, doc_obj_token, doc_edit_time = 'docx', doc_token, None
+    
+    # 获取文档内容，同一版本的文档命中缓存时不再重新下载
+    doc_content, _ = fetch_document_content(doc_obj_type, doc_obj_token, user_access_token, doc_edit_time)
+    return doc_content
+
+def build_doc_import_prompt(data, doc_content, wiki_node_md):
+    """按请求中的提示词模板和占位符构造文档导入评估提示词"""
+    prompt_template = data.get('prompt_template')  # 从请求参数获取提示词模板
+    wiki_title = data.get('wiki_title')  # 从请求参数获取知识库标题
+    placeholders = data.get('placeholders', {})  # 获取占位符字典
+    # 如果提供了提示词模板，则使用模板替换占位符，否则使用默认提示词
+    if not prompt_template:
+        prompt_template = DEFAULT_DOC_IMPORT_PROMPT
+        app.logger.info(f"Using default prompt template")
+    # 合并默认占位符和传入的占位符
+    # 优化占位符命名以提高可维护性
+    all_placeholders = {
+        'IMPORTED_DOCUMENT_CONTENT': doc_content,
+        'KNOWLEDGE_BASE_STRUCTURE': wiki_node_md,
+        'WIKI_TITLE': wiki_title or ''
+    }
+    all_placeholders.update(placeholders)
+    all_placeholders = apply_prompt_budget(prompt_template, all_placeholders, data)
+    prompt = replace_placeholders(prompt_template, all_placeholders)
+    # 记录占位符替换前后的对比，便于调试
+    app.logger.info(f"Placeholder replacement debug:")
+    app.logger.info(f"  - IMPORTED_DOCUMENT_CONTENT length: {len(doc_content)}")
+    app.logger.info(f"  - KNOWLEDGE_BASE_STRUCTURE length: {len(wiki_node_md)}")
+    app.logger.info(f"  - WIKI_TITLE: {wiki_title}")
+    app.logger.info("  - Received placeholders: %s", log_payload(placeholders))
+    app.logger.info(f"Prompt after placeholder replacement (first 200 chars): {prompt[:200]}...")
+    return prompt
 
 @app.route('/api/llm/doc_import_analysis', methods=['POST'])
 def doc_import_analysis():
     data = request.json
-    app.logger.info(f"Received doc_import_analysis request with data: {data}")
+    app.logger.info("Received doc_import_analysis request with data: %s", log_payload(data))
     
     doc_token = data.get('doc_token')
     doc_type = data.get('doc_type', 'docx')  # 获取文档类型，默认为docx
     wiki_node_md = data.get('wiki_node_md')
     api_key = data.get('api_key')
     model = data.get('model', 'doubao-seed-1-6-250615')  # 从请求参数获取模型名称，使用新的默认值
-    prompt_template = data.get('prompt_template')  # 从请求参数获取提示词模板
-    wiki_title = data.get('wiki_title')  # 从请求参数获取知识库标题
-    placeholders = data.get('placeholders', {})  # 获取占位符字典
     user_access_token = request.headers.get('Authorization')
     if user_access_token:
         user_access_token = user_access_token.replace('Bearer ', '')
 
-    if not all([doc_token, wiki_node_md, api_key, user_access_token]):
+    if not all([doc_token, wiki_node_md or data.get('space_id'), api_key, user_access_token]):
         error_msg = "Missing required parameters"
         app.logger.error(error_msg)
         return jsonify({"error": error_msg}), 400
 
+    try:
+        request_token_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # 未传入 wiki_node_md 时根据 space_id 在服务端渲染知识库大纲
+    if not wiki_node_md:
+        try:
+            _, wiki_node_md = resolve_outline_placeholder(data, user_access_token)
+        except (FeishuRequestError, KeyError, ValueError) as e:
+            return outline_error_response(e)
+
     # 1. Get document content from Feishu
-    doc_content = ''
     try:
-        # 如果是wiki类型，需要先获取实际的obj_type和obj_token
-        if doc_type == 'wiki':
-            app.logger.info(f"Processing wiki type document with token: {doc_token}")
-            # 调用获取知识空间节点接口
-            node_url = f"https://open.feishu.cn/open-apis/wiki/v2/spaces/get_node?token={doc_token}"
-            headers = {"Authorization": f"Bearer {user_access_token}"}
-            app.logger.info(f"Fetching wiki node info with URL: {node_url}")
-            
-            node_response = requests.get(node_url, headers=headers)
-            node_response.raise_for_status()
-            node_data = node_response.json()
-            app.logger.info(f"Received wiki node info: {node_data}")
-            
-            if node_data.get("code") == 0:
-                node_info = node_data.get("data", {})
-                # 从嵌套的node对象中获取obj_type和obj_token
-                node_detail = node_info.get("node", {})
-                actual_obj_type = node_detail.get("obj_type")
-                actual_obj_token = node_detail.get("obj_token")
-                
-                # 添加详细的调试日志，记录完整的数据结构
-                app.logger.info(f"Wiki node data structure - node_info: {node_info}")
-                app.logger.info(f"Wiki node detail - node_detail: {node_detail}")
-                app.logger.info(f"Wiki node resolved - obj_type: {actual_obj_type}, obj_token: {actual_obj_token}")
-                
-                # 配置化的支持文档类型，便于扩展
-                SUPPORTED_DOC_TYPES = ['doc', 'docx']
-                
-                # 检查obj_type是否为支持的文档类型
-                if not actual_obj_type:
-                    error_msg = f"Failed to extract document type from wiki node. Response structure may have changed."
-                    app.logger.error(error_msg)
-                    app.logger.error(f"Available fields in node_detail: {list(node_detail.keys()) if node_detail else 'None'}")
-                    return jsonify({"error": error_msg}), 400
-                
-                # 检查obj_token是否存在
-                if not actual_obj_token:
-                    error_msg = f"Failed to extract document token from wiki node. Document token is required."
-                    app.logger.error(error_msg)
-                    app.logger.error(f"Document type: {actual_obj_type}, Available fields: {list(node_detail.keys()) if node_detail else 'None'}")
-                    return jsonify({"error": error_msg}), 400
-                
-                if actual_obj_type not in SUPPORTED_DOC_TYPES:
-                    error_msg = f"Unsupported document type: {actual_obj_type}. Only {', '.join(SUPPORTED_DOC_TYPES)} types are supported."
-                    app.logger.error(error_msg)
-                    app.logger.error(f"Document token: {actual_obj_token}, Available types: {list(node_detail.keys()) if node_detail else 'None'}")
-                    return jsonify({"error": error_msg}), 400
-                
-                # 根据文档类型构建不同的API URL，增强可扩展性
-                if actual_obj_type == 'docx':
-                    doc_url = f"https://open.feishu.cn/open-apis/docx/v1/documents/{actual_obj_token}/raw_content"
-                elif actual_obj_type == 'doc':
-                    doc_url = f"https://open.feishu.cn/open-apis/doc/v1/documents/{actual_obj_token}/raw_content"
-                else:
-                    # 理论上不会执行到这里，因为前面已经检查了支持的类型
-                    error_msg = f"Document type {actual_obj_type} not implemented yet."
-                    app.logger.error(error_msg)
-                    return jsonify({"error": error_msg}), 500
-                app.logger.info(f"Fetching document content for wiki with resolved URL: {doc_url}")
-            else:
-                error_msg = node_data.get("msg", "Failed to fetch wiki node info")
-                app.logger.error(error_msg)
-                return jsonify({"error": error_msg}), 500
-        else:
-            # 直接使用doc_token获取文档内容
-            doc_url = f"https://open.feishu.cn/open-apis/docx/v1/documents/{doc_token}/raw_content"
-            app.logger.info(f"Fetching document content from Feishu with URL: {doc_url}")
-        
-        # 获取文档内容
-        headers = {"Authorization": f"Bearer {user_access_token}"}
-        response = requests.get(doc_url, headers=headers)
-        response.raise_for_status()
-        doc_data = response.json()
-        app.logger.info(f"Received response from Feishu: {doc_data}")
-        
-        if doc_data.get("code") == 0:
-            doc_content = doc_data.get("data", {}).get('content', '')
-            app.logger.info(f"Successfully fetched document content, length: {len(doc_content)}")
-        else:
-            error_msg = doc_data.get("msg", "Failed to fetch document content")
-            app.logger.error(error_msg)
-            return jsonify({"error": error_msg}), 500
-            
-    except requests.exceptions.RequestException as e:
+        doc_content = load_import_document(doc_token, doc_type, user_access_token)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except FeishuRequestError as e:
         error_msg = f"Failed to fetch document content: {e}"
         app.logger.error(error_msg)
         return jsonify({"error": str(e)}), 500
 
     # 2. Construct prompt and call LLM
-    # 如果提供了提示词模板，则使用模板替换占位符，否则使用默认提示词
-    # 优化占位符命名以提高可维护性
-    if prompt_template:
-        # 合并默认占位符和传入的占位符
-        all_placeholders = {
-            'IMPORTED_DOCUMENT_CONTENT': doc_content,
-            'KNOWLEDGE_BASE_STRUCTURE': wiki_node_md,
-            'WIKI_TITLE': wiki_title or ''
-        }
-        all_placeholders.update(placeholders)
-        prompt = replace_placeholders(prompt_template, all_placeholders)
-        # 记录占位符替换前后的对比，便于调试
-        app.logger.info(f"Placeholder replacement debug:")
-        app.logger.info(f"  - IMPORTED_DOCUMENT_CONTENT length: {len(doc_content)}")
-        app.logger.info(f"  - KNOWLEDGE_BASE_STRUCTURE length: {len(wiki_node_md)}")
-        app.logger.info(f"  - WIKI_TITLE: {wiki_title}")
-        app.logger.info(f"  - Received placeholders: {placeholders}")
-        app.logger.info(f"Prompt after placeholder replacement (first 200 chars): {prompt[:200]}...")
-    else:
-        prompt = f"""你是一位专业的知识管理专家，具备以下能力：
-1. 深入理解文档内容，分析其主题、关键信息和潜在价值。
-2. 熟悉知识库的现有结构，能够准确判断文档的最佳归属节点。
-3. 提供清晰、有说服力的分析和建议，帮助用户做出决策。
+    prompt = build_doc_import_prompt(data, doc_content, wiki_node_md)
 
-## 评估材料
-**知识库标题**：
-{wiki_title or ''}
+    # 可选的响应缓存，命中时不再调用大模型
+    cache_key = response_cache_key(api_key, LLM_BASE_URL, model, [{'role': 'user', 'content': prompt}]) if data.get('use_cache') else None
+    cached_events = llm_response_cache.get(cache_key) if cache_key else None
 
-**导入文档内容**：
-{doc_content}
+    call_params = {
+        "model": model,
+        "messages": [{'role': 'user', 'content': prompt}],
+        "stream": True,
+    }
+    if cached_events is None:
+        app.logger.info("Calling LLM with params: %s", log_payload(call_params))
 
-**当前知识库结构**：
-{wiki_node_md}
+    def generate():
+        try:
+            yield from generate_llm_stream(api_key, call_params, cache_key, cached_events, "document import analysis")
+        finally:
+            app.logger.info("Finished stream response for document import analysis")
 
-## 评估任务
-请根据以上材料，完成以下三个任务：
+    async def agenerate():
+        try:
+            async for frame in agenerate_llm_stream(api_key, call_params, cache_key, cached_events, "document import analysis"):
+                yield frame
+        finally:
+            app.logger.info("Finished stream response for document import analysis")
 
-### 1. 内容匹配度分析
-分析导入文档与知识库现有节点的相关性，评估其在知识库中的潜在价值。
+    app.logger.info("Starting stream response for document import analysis")
+    response = sse_response(generate, agenerate)
+    response.headers['X-Cache'] = 'HIT' if cached_events is not None else 'MISS'
+    return response
 
-### 2. 归属节点建议
-基于内容分析，推荐1-3个最适合的现有节点作为文档的归属位置，并简要说明理由。
+# --- Batch Document Import Analysis ---
+DOC_BATCH_MAX_DOCS = int(os.getenv('DOC_BATCH_MAX_DOCS', '200'))  # 单次批量分析的文档数上限
+DOC_BATCH_MAX_WORKERS = int(os.getenv('DOC_BATCH_MAX_WORKERS', '8'))  # 同时处理的文档数（包括已获取内容、等待大模型的文档）
+DOC_BATCH_LLM_CONCURRENCY = int(os.getenv('DOC_BATCH_LLM_CONCURRENCY', '4'))  # 同时进行的大模型调用数
+DOC_BATCH_HEARTBEAT = float(os.getenv('DOC_BATCH_HEARTBEAT', '15'))  # 没有新事件时每隔多少秒发送一次 SSE 注释，保持连接
+DOC_BATCH_IDLE_TIMEOUT = float(os.getenv('DOC_BATCH_IDLE_TIMEOUT', '600'))  # 超过该时间没有新事件时，未完成的文档按超时失败处理
 
-### 3. 导入决策
-综合以上分析，给出是否建议导入该文档的最终决策（建议导入/暂不建议导入），并提供简要说明。"""
-        app.logger.info(f"Using default prompt template")
+class LLMCallCancelled(Exception):
+    """调用方已不再需要结果（例如批量分析的客户端已断开），大模型调用被提前终止"""
 
-    def generate():
+def collect_llm_response(api_key, call_params, cancel_event=None):
+    """
+    以流式方式调用大模型，收集完整的 reasoning / content 片段
+    :param cancel_event: 可选的 threading.Event，置位后在收到下一个片段时关闭上游连接并抛出 LLMCallCancelled
+    """
+    recorder = LLMResponseRecorder()
+    timer = LLMStreamTimer('batch analysis')
+    try:
+        with llm_clients.lease(api_key, LLM_BASE_URL) as client:
+            stream = client.chat.completions.create(**call_params)
+            try:
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise LLMCallCancelled("LLM call cancelled")
+                    for event_type, text in iter_delta_events(chunk):
+                        timer.token()
+                        recorder.add(event_type, text)
+            finally:
+                # 提前结束时关闭上游连接，模型不再继续生成
+                stream.response.close()
+        timer.outcome = 'ok'
+    except LLMCallCancelled:
+        # 取消的调用在指标中记为 cancelled
+        raise
+    except Exception:
+        timer.outcome = 'error'
+        raise
+    finally:
+        timer.finish()
+    return recorder.result()
+
+def parse_batch_docs(data):
+    """
+    解析批量分析的文档列表，docs 中的元素可以是 doc_token 字符串或 {"doc_token", "doc_type"} 对象，
+    未指定 doc_type 时使用请求体中的 doc_type（默认 docx）；重复的 doc_token 只分析一次
+    """
+    default_type = data.get('doc_type', 'docx')
+    docs = []
+    seen = set()
+    for item in data.get('docs') or []:
+        if isinstance(item, dict):
+            doc_token, doc_type = item.get('doc_token'), item.get('doc_type', default_type)
+        else:
+            doc_token, doc_type = item, default_type
+        if not doc_token or not isinstance(doc_token, str):
+            raise ValueError(f"Invalid doc entry: {item}")
+        if doc_token not in seen:
+            seen.add(doc_token)
+            docs.append((doc_token, doc_type))
+    return docs
+
+@app.route('/api/llm/doc_import_analysis/batch', methods=['POST'])
+def batch_doc_import_analysis():
+    data = request.json or {}
+    api_key = data.get('api_key')
+    model = data.get('model', 'doubao-seed-1-6-250615')
+    wiki_node_md = data.get('wiki_node_md')
+    user_access_token = request.headers.get('Authorization')
+    if user_access_token:
+        user_access_token = user_access_token.replace('Bearer ', '')
+
+    try:
+        docs = parse_batch_docs(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not all([docs, wiki_node_md or data.get('space_id'), api_key, user_access_token]):
+        error_msg = "Missing required parameters"
+        app.logger.error(error_msg)
+        return jsonify({"error": error_msg}), 400
+    if len(docs) > DOC_BATCH_MAX_DOCS:
+        return jsonify({"error": f"Too many documents: {len(docs)} (max {DOC_BATCH_MAX_DOCS})"}), 400
+
+    try:
+        request_token_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # 知识库大纲只渲染一次，所有文档共用
+    if not wiki_node_md:
         try:
-            # 使用OpenAI SDK进行流式调用
-            client = OpenAI(
-                base_url="https://ark.cn-beijing.volces.com/api/v3",
-                api_key=api_key
-            )
-            
+            _, wiki_node_md = resolve_outline_placeholder(data, user_access_token)
+        except (FeishuRequestError, KeyError, ValueError) as e:
+            return outline_error_response(e)
+
+    app.logger.info(f"Starting batch document import analysis for {len(docs)} documents")
+    closed = threading.Event()
+    llm_slots = threading.Semaphore(DOC_BATCH_LLM_CONCURRENCY)
+    # 尚未完成（没有 result / error 事件）的文档
+    pending = {doc_token for doc_token, _ in docs}
+    failures = []
+
+    def analyze(doc_token, doc_type, emit):
+        """获取单个文档并调用大模型，结果通过 emit 发出；飞书调用受共享的频率限制约束"""
+        if closed.is_set():
+            return
+        try:
+            doc_content = load_import_document(doc_token, doc_type, user_access_token)
+            prompt = build_doc_import_prompt(data, doc_content, wiki_node_md)
             call_params = {
                 "model": model,
                 "messages": [{'role': 'user', 'content': prompt}],
                 "stream": True,
             }
-            app.logger.info(f"Calling LLM with params: {call_params}")
-            
-            stream = client.chat.completions.create(**call_params)
-            
-            for chunk in stream:
-                if not chunk.choices:
-                    continue
-                
-                # 处理 reasoning_content
-                reasoning_content = ""
-                if hasattr(chunk.choices[0].delta, 'reasoning_content'):
-                    reasoning_content = chunk.choices[0].delta.reasoning_content or ""
-                if reasoning_content:
-                    # 按照SSE格式返回推理内容，并添加前缀以区分
-                    # 使用 json.dumps 确保内容被正确转义
-                    import json
-                    yield f"data: {{\"type\": \"reasoning\", \"content\": {json.dumps(reasoning_content)}}}\n\n"
-                
-                # 处理 content
-                content = ""
-                if hasattr(chunk.choices[0].delta, 'content'):
-                    content = chunk.choices[0].delta.content or ""
-                if content:
-                    # 按照SSE格式返回内容，并添加前缀以区分
-                    # 使用 json.dumps 确保内容被正确转义
-                    import json
-                    yield f"data: {{\"type\": \"content\", \"content\": {json.dumps(content)}}}\n\n"
-            
-            # 发送结束信号
-            yield "data: [DONE]\n\n"
+            cache_key = response_cache_key(api_key, LLM_BASE_URL, model, call_params['messages']) if data.get('use_cache') else None
+            segments = llm_response_cache.get(cache_key) if cache_key else None
+            cached = segments is not None
+            if segments is None:
+                with llm_slots:
+                    if closed.is_set():
+                        return
+                    emit({'type': 'analyzing', 'doc_token': doc_token})
+                    segments = collect_llm_response(api_key, call_params, cancel_event=closed)
+                if cache_key:
+                    llm_response_cache.put(cache_key, segments)
+            result = {'type': 'result', 'doc_token': doc_token, 'reasoning': '', 'content': '', 'cached': cached}
+            for segment_type, text in segments:
+                result[segment_type] += text
+            emit(result)
+        except LLMCallCancelled:
+            app.logger.info(f"Batch document import analysis cancelled for {doc_token}")
         except Exception as e:
-            error_msg = f"LLM Request error: {str(e)}"
-            app.logger.error(error_msg)
-            # 使用 json.dumps 确保错误信息被正确转义
-            import json
-            yield f"data: {{\"error\": {json.dumps(str(e))}}}\n\n"
+            app.logger.error(f"Batch document import analysis failed for {doc_token}: {str(e)}")
+            emit({'type': 'error', 'doc_token': doc_token, 'message': str(e)})
+
+    def start_batch(emit):
+        executor = ThreadPoolExecutor(
+            max_workers=max(DOC_BATCH_MAX_WORKERS, DOC_BATCH_LLM_CONCURRENCY), thread_name_prefix='doc-batch'
+        )
+        for doc_token, doc_type in docs:
+            executor.submit(analyze, doc_token, doc_type, emit)
+        return executor
+
+    def stop_batch(executor):
+        # 客户端断开或超时时不再开始新的文档，进行中的大模型调用在收到下一个片段时关闭上游连接
+        closed.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        app.logger.info(f"Finished batch document import analysis for {len(docs)} documents")
+
+    def event_frame(event):
+        if event['type'] in ('result', 'error'):
+            pending.discard(event['doc_token'])
+            if event['type'] == 'error':
+                failures.append(event['doc_token'])
+        return f"data: {json.dumps(event)}\n\n"
+
+    def timeout_frames():
+        app.logger.error(f"Batch document import analysis timed out, {len(pending)} documents unfinished")
+        for doc_token, _ in docs:
+            if doc_token in pending:
+                yield event_frame({'type': 'error', 'doc_token': doc_token, 'message': 'Analysis timed out'})
+
+    def done_frames():
+        yield f"data: {json.dumps({'type': 'done', 'total': len(docs), 'succeeded': len(docs) - len(failures), 'failed': len(failures)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    def generate():
+        events = queue.Queue()
+        executor = start_batch(events.put)
+        idle_since = time.monotonic()
+        try:
+            while pending:
+                try:
+                    event = events.get(timeout=DOC_BATCH_HEARTBEAT)
+                except queue.Empty:
+                    if time.monotonic() - idle_since >= DOC_BATCH_IDLE_TIMEOUT:
+                        yield from timeout_frames()
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                idle_since = time.monotonic()
+                yield event_frame(event)
+            yield from done_frames()
         finally:
-            app.logger.info("Finished stream response for document import analysis")
+            stop_batch(executor)
 
-    app.logger.info("Starting stream response for document import analysis")
-    return Response(generate(), content_type='text/event-stream')
+    async def agenerate():
+        """ASGI 模式：文档仍在线程池中处理，等待事件时不占用线程"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(event):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            except RuntimeError:
+                # 事件循环已关闭，客户端早已断开
+                pass
+
+        executor = start_batch(emit)
+        idle_since = time.monotonic()
+        try:
+            while pending:
+                try:
+                    event = await asyncio.wait_for(events.get(), DOC_BATCH_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - idle_since >= DOC_BATCH_IDLE_TIMEOUT:
+                        for frame in timeout_frames():
+                            yield frame
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                idle_since = time.monotonic()
+                yield event_frame(event)
+            for frame in done_frames():
+                yield frame
+        finally:
+            stop_batch(executor)
+
+    return sse_response(generate, agenerate)
 
 if __name__ == '__main__':
     load_dotenv()
-    app.run(port=BACKEND_PORT, debug=False, use_reloader=False)
\ No newline at end of file
+    if os.getenv('SERVER_MODE', 'asgi').lower() == 'wsgi':
+        # Flask 自带的开发服务器，每个 SSE 流在整个生命周期内占用一个线程，仅用于调试
+        app.run(port=BACKEND_PORT, debug=False, use_reloader=False)
+    else:
+        import sys
+        import uvicorn
+        # asgi.py 通过 import app 取得应用，直接运行本文件时让它复用当前模块，避免重复初始化
+        sys.modules.setdefault('app', sys.modules[__name__])
+        from asgi import application
+        uvicorn.run(
+            application,
+            host=os.getenv('BACKEND_HOST', '127.0.0.1'),
+            port=int(BACKEND_PORT),
+            timeout_graceful_shutdown=int(os.getenv('SERVER_GRACEFUL_SHUTDOWN', '5')),
+            log_level=os.getenv('SERVER_LOG_LEVEL', 'info')
+        )
\ No newline at end of file
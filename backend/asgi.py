@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from app import app, async_llm_clients, ASYNC_STREAM_ENVIRON_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class FlaskASGIAdapter:
+    """
+    在 ASGI 服务器（如 uvicorn）中运行 Flask 应用
+    普通接口在线程池中按 WSGI 方式执行；通过 sse_response 提供了异步生成器的流式接口，
+    视图函数在线程池中完成参数校验后立即归还线程，之后由事件循环驱动异步生成器推送 SSE，
+    等待大模型输出或爬取进度时不占用线程，少量线程即可同时保持数百个流。
+    客户端断开时取消异步生成器（或关闭同步生成器），与 WSGI 模式下关闭生成器的效果相同。
+    :param wsgi_app: Flask 应用
+    :param max_workers: 执行 WSGI 请求和同步流式响应的线程数
+    :param on_shutdown: 可选，服务器退出时 await 的协程函数
+    """
+
+    def __init__(self, wsgi_app, max_workers=32, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix='asgi-wsgi')
+        self.on_shutdown = on_shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.on_shutdown:
+                    try:
+                        await self.on_shutdown()
+                    except Exception as e:
+                        logger.warning(f"Error during shutdown: {e}")
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            # 请求体还没读完客户端就断开了
+            return
+        environ = self._environ(scope, body)
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(self.executor, self._call_wsgi, environ)
+
+        agenerate = environ[ASYNC_STREAM_ENVIRON_KEY]
+        if agenerate is not None:
+            headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+        })
+        if agenerate is not None:
+            await self._send_async_stream(agenerate(), receive, send)
+        elif isinstance(content, bytes):
+            await send({'type': 'http.response.body', 'body': content})
+        else:
+            await self._send_sync_stream(content, receive, send)
+
+    def _call_wsgi(self, environ):
+        """在线程池中执行 Flask 应用，有 Content-Length 的普通响应直接读出完整内容"""
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]), headers]
+            return self._write
+
+        iterable = self.wsgi_app(environ, start_response)
+        status, headers = response
+        if environ[ASYNC_STREAM_ENVIRON_KEY] is None and not any(name.lower() == 'content-length' for name, _ in headers):
+            return status, headers, iterable
+        try:
+            return status, headers, b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def _write(self, data):
+        raise NotImplementedError("The WSGI write() callable is not supported")
+
+    async def _send_async_stream(self, generator, receive, send):
+        """由事件循环驱动异步生成器，客户端断开时取消生成器"""
+        async def pump():
+            async for frame in generator:
+                await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        pump_task = asyncio.ensure_future(pump())
+        disconnect_task = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            if not pump_task.done():
+                # CancelledError 在生成器当前等待的位置抛出，生成器中的 finally 随之执行（如退出爬取订阅、关闭上游连接）
+                pump_task.cancel()
+            try:
+                await pump_task
+            except asyncio.CancelledError:
+                pass
+        finally:
+            disconnect_task.cancel()
+            await generator.aclose()
+
+    async def _send_sync_stream(self, iterable, receive, send):
+        """在线程池中逐块读取同步生成器，客户端断开时在生成器当前这一块返回后关闭它"""
+        loop = asyncio.get_running_loop()
+        iterator = iter(iterable)
+        close = getattr(iterable, 'close', None)
+        disconnect_task = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            while True:
+                chunk_future = loop.run_in_executor(self.executor, next, iterator, None)
+                await asyncio.wait({chunk_future, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+                if not chunk_future.done():
+                    # 生成器正在其他线程中执行，不能立即关闭
+                    if close is not None:
+                        chunk_future.add_done_callback(lambda _: self.executor.submit(close))
+                    return
+                chunk = chunk_future.result()
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+        finally:
+            disconnect_task.cancel()
+
+    async def _wait_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': '',
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            # 告诉 sse_response 可以返回异步生成器
+            ASYNC_STREAM_ENVIRON_KEY: None,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+application = FlaskASGIAdapter(
+    app,
+    max_workers=int(os.getenv('ASGI_WSGI_THREADS', '32')),
+    on_shutdown=async_llm_clients.aclose
+)
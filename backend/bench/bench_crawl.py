@@ -0,0 +1,223 @@
+"""
+知识空间爬取基准
+在本地启动飞书接口模拟服务（feishu_mock.py），对不同形状的合成节点树执行爬取，
+报告墙钟时间、发出的请求数、峰值线程数和峰值内存。每个用例在独立的子进程中运行，
+子进程通过 FEISHU_BASE_URL 指向模拟服务，峰值内存和线程数互不影响。
+
+模式：
+  crawl     调用 fetch_all_nodes_recursively 爬取整棵树（CRAWL_ENGINE 由 --engines 指定）
+  children  通过 /api/wiki/<space_id>/nodes 逐个展开第一层节点，衡量单次分页请求的开销
+
+用法：python bench/bench_crawl.py [--shapes wide,deep,balanced] [--engines thread,async]
+      [--latency-ms 20] [--error-429 0.01] [--error-99991400 0.01] [--mode crawl]
+自定义形状：--shapes name=深度:扇出[:节点上限]，例如 --shapes huge=3:40:50000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from feishu_mock import FeishuMockServer, SyntheticWiki, add_fault_arguments
+
+# 名称 -> (深度, 扇出, 节点上限)
+SHAPES = {
+    'flat': (1, 2000, None),       # 一层 2000 个节点，只有顺序的分页
+    'wide': (2, 200, None),        # 200 x 200，子节点分页可以充分并发
+    'balanced': (4, 8, None),      # 4680 个节点
+    'deep': (10, 2, None),         # 深而窄，每层都要等上一层返回
+}
+
+
+def parse_shapes(value):
+    shapes = []
+    for spec in value.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        if '=' in spec:
+            name, params = spec.split('=', 1)
+            numbers = [int(n) for n in params.split(':')]
+            depth, fanout = numbers[:2]
+            max_nodes = numbers[2] if len(numbers) > 2 else None
+            shapes.append((name, (depth, fanout, max_nodes)))
+        elif spec in SHAPES:
+            shapes.append((spec, SHAPES[spec]))
+        else:
+            raise SystemExit(f"Unknown shape '{spec}', expected one of {', '.join(SHAPES)} or name=depth:fanout[:max_nodes]")
+    return shapes
+
+
+def current_rss():
+    """当前常驻内存（字节），不支持时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """进程的峰值常驻内存（字节）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KB，macOS 上是字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class ThreadSampler:
+    """在后台线程中定期采样活动线程数（不计采样线程自身）"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='thread-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(mode, space_id):
+    """子进程：导入后端，在模拟服务上执行一次爬取，结果以一行 JSON 输出到 stdout"""
+    import app as backend
+
+    token = 'u-bench'
+    rss_before = current_rss()
+    with ThreadSampler() as sampler:
+        started = time.perf_counter()
+        if mode == 'crawl':
+            nodes = backend.fetch_all_nodes_recursively(space_id, token)
+            roots = nodes
+        else:
+            client = backend.app.test_client()
+            headers = {'Authorization': f'Bearer {token}'}
+            roots = client.get(f'/api/wiki/{space_id}/nodes', headers=headers).get_json()['items']
+            for item in roots:
+                page_token = None
+                while True:
+                    query = {'parent_node_token': item['node_token']}
+                    if page_token:
+                        query['page_token'] = page_token
+                    data = client.get(f'/api/wiki/{space_id}/nodes', headers=headers, query_string=query).get_json()
+                    if not data.get('has_more'):
+                        break
+                    page_token = data['page_token']
+        wall = time.perf_counter() - started
+
+    def count(items):
+        return sum(1 + count(item.get('children') or []) for item in items)
+
+    result = {
+        'wall': wall,
+        'nodes': count(roots) if mode == 'crawl' else len(roots),
+        'peak_threads': sampler.peak,
+        'rss_before': rss_before,
+        'peak_rss': peak_rss(),
+    }
+    print(json.dumps(result))
+
+
+def run_case(server, mode, engine, args, workdir):
+    env = dict(os.environ)
+    env.update({
+        'FEISHU_BASE_URL': server.base_url,
+        'CRAWL_ENGINE': engine,
+        'TREE_CACHE_PATH': os.path.join(workdir, f'tree-{engine}.db'),
+        'LOG_LEVEL': args.log_level,
+        # 默认放开令牌桶，测量爬取本身的开销；--rate-factor 0.8 可以复现生产环境的飞书频率限制
+        'RATE_LIMIT_SAFETY_FACTOR': str(args.rate_factor),
+        'RATE_LIMIT_MAX_FACTOR': str(max(args.rate_factor, 1.0)),
+    })
+    if args.workers:
+        env['CRAWL_MAX_WORKERS'] = str(args.workers)
+        env['CRAWL_ASYNC_CONCURRENCY'] = str(args.workers)
+    command = [sys.executable, os.path.abspath(__file__), '--worker', mode, '--space-id', server.wiki.space_id]
+    server.reset_stats()
+    # 日志目录等相对路径落在临时目录中
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Benchmark worker failed for engine {engine}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['stats'] = server.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', default='flat,wide,balanced,deep', help='节点树形状，逗号分隔')
+    parser.add_argument('--engines', default='thread,async', help='爬取引擎，逗号分隔')
+    parser.add_argument('--mode', choices=('crawl', 'children'), default='crawl')
+    parser.add_argument('--workers', type=int, default=None, help='覆盖 CRAWL_MAX_WORKERS 和 CRAWL_ASYNC_CONCURRENCY')
+    parser.add_argument('--rate-factor', type=float, default=1000.0,
+                        help='RATE_LIMIT_SAFETY_FACTOR，默认几乎不限流；0.8 为生产环境的设置')
+    parser.add_argument('--log-level', default='WARNING', help='子进程的 LOG_LEVEL')
+    parser.add_argument('--json', dest='json_path', help='把完整结果另存为 JSON 文件')
+    add_fault_arguments(parser)
+    parser.add_argument('--worker', choices=('crawl', 'children'), help=argparse.SUPPRESS)
+    parser.add_argument('--space-id', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.space_id)
+        return
+
+    shapes = parse_shapes(args.shapes)
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    if args.mode == 'children':
+        # children 模式不经过爬取引擎
+        engines = engines[:1]
+    server = FeishuMockServer(
+        SyntheticWiki(1, 1), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_429=args.error_429, error_99991400=args.error_99991400, seed=args.seed
+    ).start()
+    print(f"mode={args.mode} latency={args.latency_ms}+{args.jitter_ms}ms error_429={args.error_429} "
+          f"error_99991400={args.error_99991400} rate_factor={args.rate_factor}")
+    print(f"{'shape':>10} {'engine':>7} {'nodes':>7} {'pages':>6} {'wall(s)':>8} {'requests':>9} "
+          f"{'429':>5} {'99991400':>9} {'ms/req':>7} {'threads':>8} {'rss0(MB)':>9} {'peak(MB)':>9}")
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, (depth, fanout, max_nodes) in shapes:
+                wiki = SyntheticWiki(depth, fanout, max_nodes=max_nodes)
+                server.configure(wiki=wiki)
+                for engine in engines:
+                    result = run_case(server, args.mode, engine, args, workdir)
+                    stats = result['stats']
+                    requests = stats.get('requests.total', 0)
+                    rss_before = f"{result['rss_before'] / 2 ** 20:9.1f}" if result['rss_before'] else f"{'-':>9}"
+                    print(f"{name:>10} {engine if args.mode == 'crawl' else '-':>7} {result['nodes']:>7} "
+                          f"{wiki.page_count:>6} {result['wall']:8.2f} {requests:>9} "
+                          f"{stats.get('injected.429', 0):>5} {stats.get('injected.99991400', 0):>9} "
+                          f"{result['wall'] / max(requests, 1) * 1000:7.2f} {result['peak_threads']:>8} "
+                          f"{rss_before} {result['peak_rss'] / 2 ** 20:9.1f}")
+                    result.update(shape=name, depth=depth, fanout=fanout, max_nodes=max_nodes, engine=engine,
+                                  mode=args.mode, expected_nodes=len(wiki.nodes), pages=wiki.page_count)
+                    results.append(result)
+    finally:
+        server.stop()
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+大模型 SSE 转发吞吐基准
+启动本地 OpenAI 兼容的流式模拟服务（llm_mock.py）和后端服务（子进程，LLM_BASE_URL 指向模拟服务），
+按不同并发数同时打开 N 个 SSE 客户端，与直接连接模拟服务的基线对比，报告：
+  - 首字节时间（TTFB）及相对基线增加的部分
+  - 每个 chunk 的转发开销：(经后端的流时长 - 直连的流时长) / token 数
+  - 每个流消耗的后端 CPU 时间、后端峰值线程数和内存
+  - 可持续的最大并发流数：没有错误、TTFB 增量和流时长膨胀都在阈值内的最大并发数
+
+接口：chat（/api/chat/stream）、analysis（/api/llm/stream_analysis）、
+      doc_import（/api/llm/doc_import_analysis，文档内容来自进程内的飞书模拟服务）
+
+用法：python bench/bench_sse.py [--endpoint chat] [--concurrency 1,10,50,100,200] [--server asgi]
+      [--tps 50 --output-tokens 200 --reasoning-tokens 50] [--env LLM_MAX_CONNECTIONS=500]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from feishu_mock import FeishuMockServer, SyntheticWiki
+from llm_mock import add_stream_arguments, stream_argv
+
+ENDPOINTS = {
+    'chat': '/api/chat/stream',
+    'analysis': '/api/llm/stream_analysis',
+    'doc_import': '/api/llm/doc_import_analysis',
+}
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return math.nan
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def mean(values):
+    return sum(values) / len(values) if values else math.nan
+
+
+class ProcessSampler:
+    """定期读取 /proc/<pid> 中后端进程的 CPU 时间、线程数和常驻内存（仅 Linux）"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self._task = None
+
+    def cpu_seconds(self):
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            # utime、stime 是 ')' 之后的第 12、13 个字段
+            return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        except OSError:
+            return math.nan
+
+    def sample(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        self.peak_threads = max(self.peak_threads, int(line.split()[1]))
+                    elif line.startswith('VmRSS:'):
+                        self.peak_rss = max(self.peak_rss, int(line.split()[1]) * 1024)
+        except OSError:
+            pass
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+        self.sample()
+
+
+async def read_stream(client, method, url, started, **kwargs):
+    """读取一个 SSE 流，返回首字节时间、总时长、帧数和是否出错"""
+    result = {'ttfb': None, 'duration': None, 'frames': 0, 'bytes': 0, 'error': None}
+    buffer = b''
+    try:
+        async with client.stream(method, url, **kwargs) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result['error'] = f'HTTP {response.status_code}'
+                return result
+            async for data in response.aiter_raw():
+                if result['ttfb'] is None:
+                    result['ttfb'] = time.perf_counter() - started
+                result['bytes'] += len(data)
+                buffer += data
+                *frames, buffer = buffer.split(b'\n\n')
+                for frame in frames:
+                    result['frames'] += 1
+                    if frame.startswith(b'data: {"error"'):
+                        result['error'] = frame[6:200].decode('utf-8', errors='replace')
+        if result['ttfb'] is None:
+            result['error'] = 'empty response'
+    except httpx.HTTPError as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['duration'] = time.perf_counter() - started
+    return result
+
+
+async def run_level(client, concurrency, request_factory):
+    async def one(index):
+        method, url, kwargs = request_factory(index)
+        return await read_stream(client, method, url, time.perf_counter(), **kwargs)
+
+    return await asyncio.gather(*(one(index) for index in range(concurrency)))
+
+
+def summarize(results):
+    ok = [r for r in results if not r['error']]
+    return {
+        'streams': len(results),
+        'errors': len(results) - len(ok),
+        'error_samples': sorted({r['error'] for r in results if r['error']})[:3],
+        'ttfb_p50': percentile([r['ttfb'] for r in ok], 0.5),
+        'ttfb_p95': percentile([r['ttfb'] for r in ok], 0.95),
+        'duration_mean': mean([r['duration'] for r in ok]),
+        'duration_p95': percentile([r['duration'] for r in ok], 0.95),
+        'frames_mean': mean([r['frames'] for r in ok]),
+        'bytes_mean': mean([r['bytes'] for r in ok]),
+    }
+
+
+def start_llm_mock(args):
+    command = [sys.executable, os.path.join(BENCH_DIR, 'llm_mock.py'), '--port', '0'] + stream_argv(args)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    if not line.startswith('LLM_BASE_URL='):
+        process.kill()
+        raise SystemExit(f"LLM mock failed to start: {line}")
+    return process, line.split('=', 1)[1]
+
+
+def stop_llm_mock(process):
+    """SIGINT 让模拟服务输出统计后退出，返回统计信息"""
+    process.send_signal(signal.SIGINT)
+    try:
+        output, _ = process.communicate(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return {}
+    for line in output.splitlines():
+        if line.startswith('Stats: '):
+            return json.loads(line[len('Stats: '):])
+    return {}
+
+
+def start_backend(args, llm_base_url, feishu_base_url, workdir):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'BACKEND_PORT': str(port),
+        'SERVER_MODE': args.server,
+        'SERVER_LOG_LEVEL': 'warning',
+        'LOG_LEVEL': args.log_level,
+        'LLM_BASE_URL': llm_base_url,
+        'FEISHU_BASE_URL': feishu_base_url,
+        'TREE_CACHE_PATH': os.path.join(workdir, 'tree.db'),
+        # 每个流都会与模拟服务建立一个连接，默认的 20 个连接会让超出的流排队
+        'LLM_MAX_CONNECTIONS': str(max(args.concurrency_levels) + 10),
+        'LLM_MAX_KEEPALIVE_CONNECTIONS': str(max(args.concurrency_levels) + 10),
+        'RATE_LIMIT_SAFETY_FACTOR': '1000',
+        'RATE_LIMIT_MAX_FACTOR': '1000',
+    })
+    for item in args.env:
+        name, value = item.split('=', 1)
+        env[name] = value
+    log = open(os.path.join(workdir, 'backend.log'), 'w')
+    # 日志目录等相对路径落在临时目录中
+    process = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'app.py')], cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            httpx.get(f'{base_url}/api/admin/metrics', timeout=1)
+            return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    log.close()
+    with open(os.path.join(workdir, 'backend.log')) as f:
+        sys.stderr.write(f.read()[-4000:])
+    raise SystemExit("Backend failed to start")
+
+
+def request_factories(args, llm_base_url, backend_url, level):
+    """返回 (直连模拟服务, 经后端转发) 两个请求构造函数，每个请求的消息都不同，避免命中响应缓存"""
+    def messages(index):
+        return [{'role': 'user', 'content': f'benchmark level {level} client {index} {time.time()}'}]
+
+    def direct(index):
+        body = {'model': 'mock-model', 'messages': messages(index), 'stream': True}
+        # 基线不注入错误，只衡量正常的流
+        headers = {'Authorization': 'Bearer bench', 'X-Mock-Faults': 'off'}
+        return 'POST', f'{llm_base_url}/chat/completions', {'json': body, 'headers': headers}
+
+    def relay(index):
+        body = {'api_key': 'bench', 'model': 'mock-model', 'messages': messages(index)}
+        headers = {}
+        if args.endpoint == 'doc_import':
+            body.update(doc_token='doxn00000000', doc_type='docx', wiki_node_md=f'# Benchmark {index}\n- Node 0')
+            headers['Authorization'] = 'Bearer u-bench'
+        return 'POST', f'{backend_url}{ENDPOINTS[args.endpoint]}', {'json': body, 'headers': headers}
+
+    return direct, relay
+
+
+async def run_benchmark(args, llm_base_url, backend_url, backend_pid):
+    sampler = ProcessSampler(backend_pid)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(args.concurrency_levels))
+    timeout = httpx.Timeout(args.timeout, connect=30)
+    # 注入了错误时，经后端的流出现错误是预期的，不作为判断可持续并发的条件
+    faults = args.error_500 or args.error_429 or args.disconnect_rate
+    results = []
+    max_sustainable = 0
+    # 并发数从小到大，第一次不满足条件后即使更高的并发数碰巧通过也不再提高
+    streak = True
+    print(f"{'N':>5} {'err':>4} {'ttfb50':>7} {'ttfb95':>7} {'+ttfb95':>8} {'dur(s)':>7} {'direct':>7} "
+          f"{'us/chunk':>9} {'frames':>7} {'cpu ms/str':>10} {'threads':>8} {'rss(MB)':>8} {'ok':>3}")
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        for level in args.concurrency_levels:
+            direct, relay = request_factories(args, llm_base_url, backend_url, level)
+            baseline = summarize(await run_level(client, level, direct))
+            cpu_before = sampler.cpu_seconds()
+            with sampler:
+                started = time.perf_counter()
+                relayed = summarize(await run_level(client, level, relay))
+                wall = time.perf_counter() - started
+            cpu = sampler.cpu_seconds() - cpu_before
+
+            tokens = args.output_tokens + args.reasoning_tokens
+            ttfb_overhead = relayed['ttfb_p95'] - baseline['ttfb_p95']
+            overhead_per_chunk = (relayed['duration_mean'] - baseline['duration_mean']) / max(tokens, 1)
+            sustainable = (
+                (faults or relayed['errors'] == 0)
+                and ttfb_overhead * 1000 <= args.ttfb_slo_ms
+                and relayed['duration_mean'] <= baseline['duration_mean'] * (1 + args.max_slowdown)
+            )
+            streak = streak and sustainable
+            if streak:
+                max_sustainable = level
+            print(f"{level:>5} {relayed['errors']:>4} {relayed['ttfb_p50'] * 1000:7.1f} {relayed['ttfb_p95'] * 1000:7.1f} "
+                  f"{ttfb_overhead * 1000:8.1f} {relayed['duration_mean']:7.2f} {baseline['duration_mean']:7.2f} "
+                  f"{overhead_per_chunk * 1e6:9.1f} {relayed['frames_mean']:7.0f} {cpu / level * 1000:10.2f} "
+                  f"{sampler.peak_threads:>8} {sampler.peak_rss / 2 ** 20:8.1f} {'yes' if sustainable else 'no':>3}")
+            if relayed['error_samples']:
+                print(f"      errors: {relayed['error_samples']}")
+            results.append({
+                'concurrency': level, 'relay': relayed, 'direct': baseline, 'wall': wall, 'cpu_seconds': cpu,
+                'cpu_ms_per_stream': cpu / level * 1000, 'overhead_us_per_chunk': overhead_per_chunk * 1e6,
+                'ttfb_overhead_ms': ttfb_overhead * 1000, 'backend_peak_threads': sampler.peak_threads,
+                'backend_peak_rss': sampler.peak_rss, 'sustainable': sustainable,
+            })
+            if not sustainable and args.stop_on_failure:
+                break
+    return results, max_sustainable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='chat')
+    parser.add_argument('--concurrency', default='1,10,50,100,200', help='并发流数，逗号分隔，从小到大')
+    parser.add_argument('--server', choices=('asgi', 'wsgi'), default='asgi', help='后端的 SERVER_MODE')
+    parser.add_argument('--env', action='append', default=[], help='传给后端的环境变量 NAME=VALUE，可多次指定')
+    parser.add_argument('--ttfb-slo-ms', type=float, default=250.0,
+                        help='可持续并发的条件：p95 TTFB 比直连增加不超过该值（毫秒）')
+    parser.add_argument('--max-slowdown', type=float, default=0.2,
+                        help='可持续并发的条件：平均流时长比直连增加不超过该比例')
+    parser.add_argument('--stop-on-failure', action='store_true', help='某个并发数不满足条件后不再继续')
+    parser.add_argument('--timeout', type=float, default=300.0, help='单个流的读取超时（秒）')
+    parser.add_argument('--log-level', default='WARNING', help='后端的 LOG_LEVEL')
+    parser.add_argument('--json', dest='json_path', help='把完整结果另存为 JSON 文件')
+    add_stream_arguments(parser)
+    args = parser.parse_args()
+    args.concurrency_levels = [int(n) for n in args.concurrency.split(',') if n]
+
+    llm_process, llm_base_url = start_llm_mock(args)
+    feishu = FeishuMockServer(SyntheticWiki(1, 1)).start()
+    backend = None
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            backend, backend_url = start_backend(args, llm_base_url, feishu.base_url, workdir)
+            tokens = args.output_tokens + args.reasoning_tokens
+            print(f"endpoint={args.endpoint} server={args.server} tps={args.tps} ttft={args.ttft_ms}ms "
+                  f"tokens={tokens} (reasoning {args.reasoning_tokens}, {args.reasoning_mode}) "
+                  f"ideal stream time={args.ttft_ms / 1000 + tokens / args.tps:.2f}s")
+            results, max_sustainable = asyncio.run(run_benchmark(args, llm_base_url, backend_url, backend.pid))
+            backend.terminate()
+            backend.wait(timeout=30)
+    finally:
+        if backend is not None and backend.poll() is None:
+            backend.kill()
+        feishu.stop()
+        llm_stats = stop_llm_mock(llm_process)
+
+    print(f"max sustainable concurrent streams: {max_sustainable or 'none'} "
+          f"(p95 TTFB overhead <= {args.ttfb_slo_ms:.0f}ms, stream time <= +{args.max_slowdown:.0%}"
+          f"{'' if args.error_500 or args.error_429 or args.disconnect_rate else ', no errors'})")
+    print(f"LLM mock: {llm_stats}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'results': results, 'max_sustainable': max_sustainable, 'llm_mock': llm_stats}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
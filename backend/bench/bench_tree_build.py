@@ -0,0 +1,93 @@
+"""
+节点树构建微基准
+在单个父节点下生成大量兄弟节点（全部 has_child），按每页 50 个分批挂载，
+对比索引构建（WikiTreeBuilder）与旧实现中逐个线性查找父节点的耗时。
+
+用法：python bench/bench_tree_build.py [--sizes 10000,20000,40000,80000] [--legacy-max 20000]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wiki_tree import WikiTreeBuilder
+
+PAGE_SIZE = 50
+
+
+def make_pages(sibling_count):
+    """生成 sibling_count 个兄弟节点的分页数据，每个节点带一个子节点"""
+    siblings = [{'node_token': f'n{i}', 'title': f'node {i}', 'has_child': True} for i in range(sibling_count)]
+    pages = [siblings[i:i + PAGE_SIZE] for i in range(0, sibling_count, PAGE_SIZE)]
+    children = {item['node_token']: [{'node_token': f"{item['node_token']}-c", 'has_child': False}] for item in siblings}
+    return pages, children
+
+
+def build_indexed(pages, children):
+    builder = WikiTreeBuilder()
+    for page in pages:
+        builder.add_children(None, page)
+    for parent_token, items in children.items():
+        builder.add_children(parent_token, items)
+    return builder.roots
+
+
+def build_legacy(pages, children):
+    """旧实现：nodes 随分页不断增长，每个有子节点的条目都线性扫描 nodes 来挂载"""
+    nodes = []
+    for page in pages:
+        nodes.extend(page)
+        for item in page:
+            for n in nodes:
+                if n['node_token'] == item['node_token']:
+                    n['children'] = children[item['node_token']]
+                    break
+    return nodes
+
+
+def measure(build, sibling_count, repeat):
+    best = None
+    for _ in range(repeat):
+        pages, children = make_pages(sibling_count)
+        # 关闭 GC，避免分代回收的抖动干扰单次测量
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            build(pages, children)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,20000,40000,80000', help='兄弟节点数量，逗号分隔')
+    parser.add_argument('--legacy-max', type=int, default=20000, help='旧实现只测到这个规模，避免运行过久')
+    parser.add_argument('--repeat', type=int, default=3, help='每个规模重复次数，取最快一次')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    print(f"{'siblings':>10} {'indexed(ms)':>12} {'ns/node':>9} {'legacy(ms)':>12}")
+    per_node = []
+    for size in sizes:
+        indexed = measure(build_indexed, size, args.repeat)
+        per_node.append(indexed / size)
+        legacy = f"{measure(build_legacy, size, 1) * 1000:12.1f}" if size <= args.legacy_max else f"{'-':>12}"
+        print(f"{size:>10} {indexed * 1000:12.1f} {indexed / size * 1e9:9.0f} {legacy}")
+
+    # 线性构建时每个节点的耗时应基本不随规模增长
+    growth = per_node[-1] / per_node[0]
+    print(f"per-node cost growth from {sizes[0]} to {sizes[-1]} siblings: {growth:.2f}x")
+    if growth > 3:
+        print("WARNING: tree build does not look linear")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+本地飞书知识库接口模拟服务
+提供 /wiki/v2/spaces、/wiki/v2/spaces/{space_id}、/wiki/v2/spaces/{space_id}/nodes（分页、has_child）、
+/wiki/v2/spaces/get_node、/docx/v1/documents/{obj_token} 和 raw_content，节点树按深度、扇出和节点总数合成，
+可注入延迟、HTTP 429 和飞书 99991400 频率限制错误。不依赖第三方库。
+
+单独运行：python bench/feishu_mock.py --depth 3 --fanout 20 --latency-ms 20
+然后以 FEISHU_BASE_URL=http://127.0.0.1:8765/open-apis 启动后端，即可离线爬取合成的知识空间
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = '/open-apis'
+MAX_PAGE_SIZE = 50
+DEFAULT_PAGE_SIZE = 20
+
+
+class SyntheticWiki:
+    """
+    合成的知识空间节点树
+    第一层有 roots 个节点（默认等于 fanout），深度未到 depth 的节点各有 fanout 个子节点，
+    按广度优先生成，节点总数达到 max_nodes 时停止（has_child 与实际生成的子节点一致）
+    :param depth: 树的层数
+    :param fanout: 每个节点的子节点数
+    :param roots: 第一层的节点数
+    :param max_nodes: 节点总数上限，None 表示不限制
+    :param doc_bytes: raw_content 返回的文档正文大小
+    :param space_id: 知识空间 ID
+    """
+
+    def __init__(self, depth=3, fanout=10, roots=None, max_nodes=None, doc_bytes=2048, space_id='bench_space'):
+        self.depth = depth
+        self.fanout = fanout
+        self.doc_bytes = doc_bytes
+        self.space_id = space_id
+        self.children = {None: []}
+        self.nodes = {}
+        self.documents = {}
+
+        queue = deque([(None, 1, roots if roots is not None else fanout)])
+        while queue and (max_nodes is None or len(self.nodes) < max_nodes):
+            parent, level, count = queue.popleft()
+            for _ in range(count):
+                if max_nodes is not None and len(self.nodes) >= max_nodes:
+                    break
+                node = self._new_node(parent)
+                self.children[parent].append(node)
+                if level < depth and fanout > 0:
+                    self.children[node['node_token']] = []
+                    queue.append((node['node_token'], level + 1, fanout))
+        for node in self.nodes.values():
+            node['has_child'] = bool(self.children.get(node['node_token']))
+
+    def _new_node(self, parent):
+        index = len(self.nodes)
+        node = {
+            'space_id': self.space_id,
+            'node_token': f'wikn{index:08d}',
+            'obj_token': f'doxn{index:08d}',
+            'obj_type': 'docx',
+            'parent_node_token': parent or '',
+            'node_type': 'origin',
+            'origin_node_token': f'wikn{index:08d}',
+            'origin_space_id': self.space_id,
+            'has_child': False,
+            'title': f'Node {index}',
+            'obj_create_time': '1700000000',
+            'obj_edit_time': '1700000000',
+            'node_create_time': '1700000000',
+        }
+        self.nodes[node['node_token']] = node
+        self.documents[node['obj_token']] = node
+        return node
+
+    @property
+    def page_count(self):
+        """完整爬取一次需要的分页请求数（每页 MAX_PAGE_SIZE 个节点）"""
+        return sum(max(1, -(-len(items) // MAX_PAGE_SIZE)) for items in self.children.values())
+
+    def document_content(self, node):
+        line = f"{node['title']} synthetic content for benchmark.\n"
+        return (line * (self.doc_bytes // len(line) + 1))[:self.doc_bytes]
+
+    def space_info(self):
+        return {
+            'space_id': self.space_id,
+            'name': f'Benchmark space ({len(self.nodes)} nodes)',
+            'description': f'depth={self.depth}, fanout={self.fanout}',
+            'visibility': 'private',
+        }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，关闭 Nagle 算法避免与客户端的延迟确认叠加出 40ms 的停顿
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.handle_api(self)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.handle_api(self)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FeishuMockServer(ThreadingHTTPServer):
+    """
+    飞书开放平台接口的本地模拟，每个连接一个线程
+    :param wiki: SyntheticWiki
+    :param latency_ms: 每次请求的基础延迟（毫秒）
+    :param jitter_ms: 在基础延迟上随机增加 0~jitter_ms 毫秒
+    :param error_429: 返回 HTTP 429 的概率
+    :param error_99991400: 返回飞书频率限制错误码 99991400 的概率
+    :param seed: 随机数种子，相同的种子注入相同序列的错误
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, wiki, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0, error_429=0.0,
+                 error_99991400=0.0, seed=0):
+        super().__init__((host, port), MockRequestHandler)
+        self.wiki = wiki
+        self._random = random.Random(seed)
+        self._stats = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.configure(latency_ms=latency_ms, jitter_ms=jitter_ms, error_429=error_429, error_99991400=error_99991400)
+
+    def configure(self, **options):
+        """修改延迟和错误注入参数，对之后的请求生效"""
+        for name in ('latency_ms', 'jitter_ms', 'error_429', 'error_99991400'):
+            if name in options:
+                setattr(self, name, float(options[name]))
+        if 'wiki' in options:
+            self.wiki = options['wiki']
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{API_PREFIX}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='feishu-mock', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def stats(self):
+        """各接口收到的请求数（requests.<endpoint>）和注入的错误数（injected.<kind>）"""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _roll(self):
+        """返回本次请求的延迟（秒）和要注入的错误"""
+        with self._lock:
+            delay = (self.latency_ms + self._random.random() * self.jitter_ms) / 1000
+            value = self._random.random()
+        if value < self.error_429:
+            return delay, '429'
+        if value < self.error_429 + self.error_99991400:
+            return delay, '99991400'
+        return delay, None
+
+    def handle_api(self, handler):
+        url = urlsplit(handler.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else url.path
+        endpoint, route = self._route(handler.command, path)
+        self._count(f'requests.{endpoint}')
+        self._count('requests.total')
+
+        delay, error = self._roll()
+        if delay > 0:
+            time.sleep(delay)
+        if route is None:
+            handler.send_json(404, {'code': 404, 'msg': f'no mock route for {path}'})
+            return
+        if endpoint != 'oauth' and not (handler.headers.get('Authorization') or '').startswith('Bearer '):
+            handler.send_json(400, {'code': 99991661, 'msg': 'Missing access token for authorization.'})
+            return
+        if error == '429':
+            self._count('injected.429')
+            handler.send_json(429, {'msg': 'too many requests'})
+            return
+        if error == '99991400':
+            self._count('injected.99991400')
+            handler.send_json(400, {'code': 99991400, 'msg': 'request trigger frequency limit'})
+            return
+        status, body = route(query)
+        handler.send_json(status, body)
+
+    def _route(self, method, path):
+        """返回 (接口名, 处理函数)，接口名与 feishu_client.endpoint_name 的分类一致"""
+        parts = path.strip('/').split('/')
+        if path.startswith('/authen/') and method == 'POST':
+            return 'oauth', self._oauth
+        if parts[:3] == ['wiki', 'v2', 'spaces']:
+            if len(parts) == 3:
+                return 'spaces', self._spaces
+            if parts[3] == 'get_node':
+                return 'get_node', self._get_node
+            if len(parts) == 4:
+                return 'spaces', lambda query: self._space(parts[3])
+            if len(parts) == 5 and parts[4] == 'nodes':
+                return 'nodes', lambda query: self._nodes(parts[3], query)
+        if len(parts) == 4 and parts[:3] in (['docx', 'v1', 'documents'], ['doc', 'v1', 'documents']):
+            return 'document', lambda query: self._document(parts[3])
+        if len(parts) == 5 and parts[1:3] == ['v1', 'documents'] and parts[4] == 'raw_content':
+            return 'raw_content', lambda query: self._raw_content(parts[3])
+        return 'unknown', None
+
+    def _page(self, items, query):
+        page_size = min(int(query.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset = int(query.get('page_token') or 0)
+        end = offset + page_size
+        data = {'items': items[offset:end], 'has_more': end < len(items)}
+        if data['has_more']:
+            data['page_token'] = str(end)
+        return data
+
+    def _oauth(self, query):
+        return 200, {'code': 0, 'access_token': 'u-mock', 'refresh_token': 'ur-mock', 'expires_in': 7200}
+
+    def _spaces(self, query):
+        return 200, {'code': 0, 'msg': 'success', 'data': self._page([self.wiki.space_info()], query)}
+
+    def _space(self, space_id):
+        if space_id != self.wiki.space_id:
+            return 400, {'code': 131005, 'msg': 'space not found'}
+        return 200, {'code': 0, 'msg': 'success', 'data': {'space': self.wiki.space_info()}}
+
+    def _nodes(self, space_id, query):
+        if space_id != self.wiki.space_id:
+            return 400, {'code': 131005, 'msg': 'space not found'}
+        parent = query.get('parent_node_token') or None
+        items = self.wiki.children.get(parent)
+        if items is None:
+            # 叶子节点没有子节点列表
+            items = [] if parent in self.wiki.nodes else None
+        if items is None:
+            return 400, {'code': 131005, 'msg': 'node not found'}
+        return 200, {'code': 0, 'msg': 'success', 'data': self._page(items, query)}
+
+    def _get_node(self, query):
+        node = self.wiki.nodes.get(query.get('token'))
+        if node is None:
+            return 400, {'code': 131005, 'msg': 'node not found'}
+        return 200, {'code': 0, 'msg': 'success', 'data': {'node': node}}
+
+    def _document(self, obj_token):
+        node = self.wiki.documents.get(obj_token)
+        if node is None:
+            return 404, {'code': 1770002, 'msg': 'not found'}
+        document = {'document_id': obj_token, 'revision_id': int(node['obj_edit_time']), 'title': node['title']}
+        return 200, {'code': 0, 'msg': 'success', 'data': {'document': document}}
+
+    def _raw_content(self, obj_token):
+        node = self.wiki.documents.get(obj_token)
+        if node is None:
+            return 404, {'code': 1770002, 'msg': 'not found'}
+        return 200, {'code': 0, 'msg': 'success', 'data': {'content': self.wiki.document_content(node)}}
+
+
+def add_wiki_arguments(parser):
+    parser.add_argument('--depth', type=int, default=3, help='节点树层数')
+    parser.add_argument('--fanout', type=int, default=10, help='每个节点的子节点数')
+    parser.add_argument('--max-nodes', type=int, default=None, help='节点总数上限')
+    parser.add_argument('--doc-bytes', type=int, default=2048, help='raw_content 返回的文档大小')
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='每次请求的基础延迟（毫秒）')
+    parser.add_argument('--jitter-ms', type=float, default=5.0, help='随机增加的延迟上限（毫秒）')
+    parser.add_argument('--error-429', type=float, default=0.0, help='返回 HTTP 429 的概率')
+    parser.add_argument('--error-99991400', type=float, default=0.0, help='返回 99991400 的概率')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_wiki_arguments(parser)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    wiki = SyntheticWiki(args.depth, args.fanout, max_nodes=args.max_nodes, doc_bytes=args.doc_bytes)
+    server = FeishuMockServer(
+        wiki, args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_429=args.error_429, error_99991400=args.error_99991400, seed=args.seed
+    )
+    print(f"Serving space '{wiki.space_id}' with {len(wiki.nodes)} nodes ({wiki.page_count} pages)")
+    print(f"FEISHU_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Requests: {server.stats()}")
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+本地 OpenAI 兼容的大模型流式接口模拟服务
+实现 POST .../chat/completions：stream=true 时按设定的 token/秒逐个输出 chat.completion.chunk，
+可以在正文前或与正文交替输出 reasoning_content，并可注入 HTTP 500、429 和流中途断开。
+基于 asyncio，单个进程即可同时保持数百个流。不依赖第三方库。
+
+单独运行：python bench/llm_mock.py --tps 50 --output-tokens 300 --reasoning-tokens 100
+然后以 LLM_BASE_URL=http://127.0.0.1:8766/v1 启动后端
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+CHAT_PATH_SUFFIX = '/chat/completions'
+TOKEN_TEXT = '知识库节点分析结果'
+# 请求头 X-Mock-Faults: off 的请求不注入错误，用于测量基线
+FAULTS_HEADER = 'x-mock-faults'
+
+
+class LLMMockServer:
+    """
+    :param tokens_per_second: 每个流每秒输出的 chunk 数（每个 chunk 一个 token）
+    :param ttft_ms: 收到请求到输出第一个 token 的延迟（毫秒）
+    :param output_tokens: 正文 token 数
+    :param reasoning_tokens: reasoning_content token 数
+    :param reasoning_mode: before 表示推理内容全部在正文之前，interleave 表示两者交替输出
+    :param chars_per_token: 每个 token 的字符数
+    :param error_500: 返回 HTTP 500 的概率
+    :param error_429: 返回 HTTP 429 的概率
+    :param disconnect_rate: 输出一半后直接断开连接的概率
+    :param seed: 随机数种子
+    带 X-Mock-Faults: off 请求头的请求不注入错误
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, tokens_per_second=50.0, ttft_ms=200.0, output_tokens=200,
+                 reasoning_tokens=0, reasoning_mode='before', chars_per_token=2, error_500=0.0, error_429=0.0,
+                 disconnect_rate=0.0, seed=0):
+        self.host = host
+        self.port = port
+        self.tokens_per_second = tokens_per_second
+        self.ttft_ms = ttft_ms
+        self.output_tokens = output_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.reasoning_mode = reasoning_mode
+        self.chars_per_token = chars_per_token
+        self.error_500 = error_500
+        self.error_429 = error_429
+        self.disconnect_rate = disconnect_rate
+        self._random = random.Random(seed)
+        self._server = None
+        self._sequence = 0
+        self.active_streams = 0
+        self.stats = {
+            'requests': 0, 'streams_started': 0, 'streams_completed': 0, 'peak_streams': 0,
+            'injected_500': 0, 'injected_429': 0, 'injected_disconnects': 0, 'cancelled_by_client': 0,
+        }
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/v1'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def delta_plan(self):
+        """本次响应依次输出的 (字段, 文本) 列表"""
+        token = (TOKEN_TEXT * (self.chars_per_token // len(TOKEN_TEXT) + 1))[:self.chars_per_token]
+        reasoning = [('reasoning_content', token)] * self.reasoning_tokens
+        content = [('content', token)] * self.output_tokens
+        if self.reasoning_mode != 'interleave':
+            return reasoning + content
+        plan = []
+        for index in range(max(len(reasoning), len(content))):
+            plan.extend(reasoning[index:index + 1])
+            plan.extend(content[index:index + 1])
+        return plan
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if method != 'POST' or not path.split('?', 1)[0].endswith(CHAT_PATH_SUFFIX):
+                    await self._send_json(writer, 404, {'error': {'message': f'no mock route for {method} {path}'}})
+                elif not await self._chat_completions(writer, json.loads(body or b'{}'), headers.get(FAULTS_HEADER) != 'off'):
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        lines = head.decode('latin1').split('\r\n')
+        method, path, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        body = await reader.readexactly(length) if length else b''
+        return method, path, headers, body
+
+    async def _send_json(self, writer, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} MOCK\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'
+            .encode('latin1') + payload
+        )
+        await writer.drain()
+
+    async def _chat_completions(self, writer, params, inject_faults=True):
+        """返回 False 表示连接已不可继续使用"""
+        self.stats['requests'] += 1
+        self._sequence += 1
+        completion_id = f'chatcmpl-mock-{self._sequence}'
+        model = params.get('model', 'mock-model')
+        value = self._random.random() if inject_faults else 1.0
+        if value < self.error_500:
+            self.stats['injected_500'] += 1
+            await self._send_json(writer, 500, {'error': {'message': 'injected server error', 'type': 'server_error'}})
+            return True
+        if value < self.error_500 + self.error_429:
+            self.stats['injected_429'] += 1
+            await self._send_json(writer, 429, {'error': {'message': 'injected rate limit', 'type': 'rate_limit_error'}})
+            return True
+        disconnect = inject_faults and self._random.random() < self.disconnect_rate
+        plan = self.delta_plan()
+
+        if not params.get('stream'):
+            await asyncio.sleep((self.ttft_ms + len(plan) * 1000 / self.tokens_per_second) / 1000)
+            message = {'role': 'assistant', 'content': ''.join(text for field, text in plan if field == 'content')}
+            reasoning = ''.join(text for field, text in plan if field == 'reasoning_content')
+            if reasoning:
+                message['reasoning_content'] = reasoning
+            await self._send_json(writer, 200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(plan), 'total_tokens': len(plan)},
+            })
+            return True
+
+        self.stats['streams_started'] += 1
+        self.active_streams += 1
+        self.stats['peak_streams'] = max(self.stats['peak_streams'], self.active_streams)
+        try:
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                b'Transfer-Encoding: chunked\r\n\r\n'
+            )
+
+            def chunk(delta, finish_reason=None):
+                event = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                }
+                return f'data: {json.dumps(event, ensure_ascii=False)}\n\n'
+
+            async def send(frame):
+                data = frame.encode('utf-8')
+                writer.write(f'{len(data):x}\r\n'.encode('latin1') + data + b'\r\n')
+                await writer.drain()
+
+            # 与真实接口一样，第一个 chunk（带 role）在首 token 时才输出
+            await asyncio.sleep(self.ttft_ms / 1000)
+            await send(chunk({'role': 'assistant', 'content': ''}))
+            # 按固定时刻输出而不是每次 sleep 固定间隔，避免调度误差累积
+            started = time.monotonic()
+            interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+            for index, (field, text) in enumerate(plan):
+                if disconnect and index == len(plan) // 2:
+                    self.stats['injected_disconnects'] += 1
+                    writer.transport.abort()
+                    return False
+                delay = started + index * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await send(chunk({field: text}))
+            await send(chunk({}, 'stop'))
+            await send('data: [DONE]\n\n')
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            self.stats['streams_completed'] += 1
+            return True
+        except (ConnectionError, asyncio.CancelledError):
+            self.stats['cancelled_by_client'] += 1
+            raise
+        finally:
+            self.active_streams -= 1
+
+
+def add_stream_arguments(parser):
+    parser.add_argument('--tps', type=float, default=50.0, help='每个流每秒输出的 token 数')
+    parser.add_argument('--ttft-ms', type=float, default=200.0, help='首 token 延迟（毫秒）')
+    parser.add_argument('--output-tokens', type=int, default=200, help='正文 token 数')
+    parser.add_argument('--reasoning-tokens', type=int, default=0, help='reasoning_content token 数')
+    parser.add_argument('--reasoning-mode', choices=('before', 'interleave'), default='before',
+                        help='推理内容在正文之前输出，或与正文交替输出')
+    parser.add_argument('--chars-per-token', type=int, default=2, help='每个 token 的字符数')
+    parser.add_argument('--error-500', type=float, default=0.0, help='返回 HTTP 500 的概率')
+    parser.add_argument('--error-429', type=float, default=0.0, help='返回 HTTP 429 的概率')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help='流输出一半时断开连接的概率')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+
+def stream_argv(args):
+    """把 add_stream_arguments 解析出的参数还原为命令行，用于在子进程中启动模拟服务"""
+    return [
+        '--tps', str(args.tps), '--ttft-ms', str(args.ttft_ms), '--output-tokens', str(args.output_tokens),
+        '--reasoning-tokens', str(args.reasoning_tokens), '--reasoning-mode', args.reasoning_mode,
+        '--chars-per-token', str(args.chars_per_token), '--error-500', str(args.error_500),
+        '--error-429', str(args.error_429), '--disconnect-rate', str(args.disconnect_rate), '--seed', str(args.seed),
+    ]
+
+
+def server_from_args(args, host='127.0.0.1', port=0):
+    return LLMMockServer(
+        host, port, tokens_per_second=args.tps, ttft_ms=args.ttft_ms, output_tokens=args.output_tokens,
+        reasoning_tokens=args.reasoning_tokens, reasoning_mode=args.reasoning_mode,
+        chars_per_token=args.chars_per_token, error_500=args.error_500, error_429=args.error_429,
+        disconnect_rate=args.disconnect_rate, seed=args.seed
+    )
+
+
+async def serve(server):
+    await server.start()
+    # 第一行输出地址，bench_sse.py 从这里读取端口
+    print(f"LLM_BASE_URL={server.base_url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(f"Stats: {json.dumps(server.stats)}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    add_stream_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(server_from_args(args, args.host, args.port)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
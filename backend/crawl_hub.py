@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from wiki_crawler import CrawlCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCrawl:
+    """
+    一次正在进行的爬取，多个订阅者共享它的事件流和结果
+    每个订阅者有自己的有界队列（queue_size 个事件），发布事件时某个订阅者的队列已满则等待，
+    消费慢的客户端让爬取暂停，而不是在内存中堆积事件；事件本身不在这里保留。
+    后加入的订阅者先回放已发布的事件再接收新事件：回放由 replay 提供（例如从检查点读取已拉取的节点），
+    发布事件时在锁内调用 replay.record(event)，新订阅者加入时在同一把锁内调用 replay(nodes) 取得回放，
+    因此每个订阅者看到的都是完整的事件序列，既不重复也不遗漏。
+    最后一个订阅者离开时，没有标记为 detached 的爬取置位 cancel_event，由爬取引擎协作停止。
+    :param queue_size: 每个订阅者等待消费的事件数上限
+    """
+
+    def __init__(self, key, queue_size=16):
+        self.key = key
+        self.queue_size = max(1, int(queue_size))
+        self.replay = None
+        self.done = False
+        self.result = None
+        self.error = None
+        self.subscribers = 0
+        self.job = None
+        self.detached = False
+        self.cancel_event = threading.Event()
+        self._cond = threading.Condition()
+        self._queues = []
+        self._async_waiters = []
+
+    def publish(self, event):
+        """
+        把事件 (类型, ...) 放入每个订阅者的队列；队列已满时等待订阅者取走事件、离开或爬取被取消
+        只接收进度的订阅者不会收到 nodes 事件
+        """
+        with self._cond:
+            if self.replay is not None:
+                self.replay.record(event)
+            # 等待期间加入的订阅者已经在回放中包含了这个事件
+            targets = list(self._queues)
+            for pending, nodes in targets:
+                if event[0] == 'nodes' and not nodes:
+                    continue
+                while len(pending) >= self.queue_size and not self.cancel_event.is_set() and self._subscribed(pending):
+                    self._cond.wait(timeout=1)
+                if len(pending) < self.queue_size:
+                    pending.append(event)
+            self._notify()
+
+    def _subscribed(self, pending):
+        return any(entry[0] is pending for entry in self._queues)
+
+    @contextmanager
+    def locked(self):
+        """持有发布事件和订阅者加入共用的锁，用于与 replay 状态一起更新的操作（例如写入检查点）"""
+        with self._cond:
+            yield
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        """在锁内调用，唤醒同步和异步订阅者"""
+        self._cond.notify_all()
+        for loop, wakeup in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭，订阅者不会再等待
+                pass
+
+    def wait(self):
+        """等待爬取结束"""
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+
+    def _join(self, nodes):
+        """在锁内调用：登记订阅者的队列并取得回放"""
+        self.subscribers += 1
+        entry = (deque(), nodes)
+        self._queues.append(entry)
+        replay = self.replay(nodes) if self.replay is not None else iter(())
+        return entry, replay
+
+    def _take(self, pending):
+        """在锁内调用：取出队列中的所有事件，并唤醒等待队列空位的发布者"""
+        events = list(pending)
+        pending.clear()
+        if events:
+            self._cond.notify_all()
+        return events
+
+    def subscribe(self, stop=None, nodes=True):
+        """
+        依次产出爬取事件，爬取成功结束后返回，爬取失败时抛出爬取过程中的异常
+        :param stop: 可选的 threading.Event，置位后（例如客户端已断开）停止订阅并抛出 CrawlCancelled，
+                     用于在其他线程中订阅的情况；在生成器中直接订阅时关闭生成器即可
+        :param nodes: 为 False 时只接收进度事件，不回放也不接收节点批次
+        """
+        with self._cond:
+            entry, replay = self._join(nodes)
+        try:
+            for event in replay:
+                yield event
+            while True:
+                with self._cond:
+                    while not entry[0] and not self.done:
+                        if stop is not None and stop.is_set():
+                            raise CrawlCancelled("Subscriber stopped")
+                        self._cond.wait(timeout=1 if stop is not None else None)
+                    events = self._take(entry[0])
+                    done = self.done
+                for event in events:
+                    yield event
+                if done:
+                    break
+        finally:
+            self._leave(entry)
+        if self.error is not None:
+            raise self.error
+
+    async def subscribe_async(self, nodes=True):
+        """subscribe 的异步版本，等待新事件时不占用线程，回放在线程中读取；关闭生成器（aclose）即结束订阅"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            entry, replay = self._join(nodes)
+            self._async_waiters.append(waiter)
+        try:
+            while True:
+                event = await asyncio.to_thread(next, replay, None)
+                if event is None:
+                    break
+                yield event
+            while True:
+                with self._cond:
+                    events = self._take(entry[0])
+                    done = self.done
+                    if not events and not done:
+                        waiter[1].clear()
+                for event in events:
+                    yield event
+                if done:
+                    break
+                if not events:
+                    await waiter[1].wait()
+        finally:
+            self._leave(entry, waiter)
+        if self.error is not None:
+            raise self.error
+
+    def _leave(self, entry, waiter=None):
+        with self._cond:
+            self.subscribers -= 1
+            self._queues.remove(entry)
+            if waiter is not None:
+                self._async_waiters.remove(waiter)
+            # 唤醒可能在等待这个队列空位的发布者
+            self._cond.notify_all()
+            orphaned = self.subscribers == 0 and not self.detached and not self.done
+        if orphaned:
+            logger.info(f"All subscribers of crawl {self.key} left, cancelling it")
+            self.cancel_event.set()
+
+
+class CrawlHub:
+    """
+    按键合并并发的爬取（single-flight）
+    同一个键同时只有一次爬取在进行，之后到达的请求订阅这次爬取的进度和结果，而不是重新开始一次。
+    :param queue_size: 每个订阅者等待消费的事件数上限，见 SharedCrawl
+    """
+
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._crawls = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, run, prepare=None):
+        """
+        加入 key 对应的爬取，没有正在进行的爬取时在后台线程中调用 run(crawl) 启动一次，
+        run 的返回值作为爬取结果，run 通过 crawl.publish 发布进度事件
+        :param prepare: 可选，新启动爬取时在其对其他请求可见之前调用 prepare(crawl)，例如为它分配任务
+        :return: (SharedCrawl, 是否新启动)
+        """
+        while True:
+            with self._lock:
+                crawl = self._crawls.get(key)
+                cancelling = crawl is not None and not crawl.done and crawl.cancel_event.is_set()
+                if not cancelling:
+                    started = crawl is None or crawl.done
+                    if started:
+                        crawl = SharedCrawl(key, self.queue_size)
+                        if prepare:
+                            prepare(crawl)
+                        self._crawls[key] = crawl
+                    break
+            # 正在取消的爬取不再接收订阅者，等它停止（最多一个请求的时间）后重新启动
+            crawl.wait()
+        if started:
+            threading.Thread(target=self._run, args=(crawl, run), daemon=True).start()
+        return crawl, started
+
+    def _run(self, crawl, run):
+        try:
+            crawl.finish(result=run(crawl))
+        except CrawlCancelled as e:
+            logger.info(f"Shared crawl {crawl.key} cancelled: {str(e)}")
+            crawl.finish(error=e)
+        except Exception as e:
+            logger.error(f"Shared crawl {crawl.key} failed: {str(e)}")
+            crawl.finish(error=e)
+        finally:
+            with self._lock:
+                if self._crawls.get(crawl.key) is crawl:
+                    del self._crawls[crawl.key]
+
+    def find_job(self, job_id):
+        """按任务 id 查找正在进行的爬取"""
+        with self._lock:
+            for crawl in self._crawls.values():
+                if crawl.job is not None and crawl.job['job_id'] == job_id:
+                    return crawl
+        return None
+
+    def active(self):
+        """正在进行的爬取：键 -> 订阅者数量"""
+        with self._lock:
+            return {key: crawl.subscribers for key, crawl in self._crawls.items()}
@@ -0,0 +1,207 @@
+import json
+import time
+import uuid
+
+from tree_cache import scoped_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_jobs (
+    job_id TEXT PRIMARY KEY,
+    space_id TEXT NOT NULL,
+    scope TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    node_count INTEGER NOT NULL DEFAULT 0,
+    pages_fetched INTEGER NOT NULL DEFAULT 0,
+    failed_pages INTEGER NOT NULL DEFAULT 0,
+    frontier TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_crawl_jobs_space ON crawl_jobs (space_id, status);
+"""
+
+_COLUMNS = ('job_id', 'space_id', 'scope', 'status', 'created_at', 'updated_at',
+            'node_count', 'pages_fetched', 'failed_pages', 'frontier', 'error')
+
+# 任务状态 running: 正在爬取；done: 已完成并写入缓存；
+# interrupted: 中断（顶层页面失败或有页面拉取失败），可以从检查点恢复，失败的页面会重新拉取
+
+
+class CrawlJobStore:
+    """
+    后台爬取任务及其检查点，与节点树缓存共用同一个 SQLite 文件
+    检查点由两部分组成：已拉取的节点（写在节点表的 staging 键下，与 TreeCacheWriter 的格式一致）
+    和尚未完成的页面列表（frontier），两者在同一个事务中更新，恢复时不会重复或遗漏节点。
+    进程退出后任务停留在 running 状态，超过 stale_after 秒没有更新检查点的任务视为中断。
+    :param cache: WikiTreeCache
+    :param stale_after: running 状态的任务多久没有更新检查点后视为中断（秒）
+    :param retention: 已结束或中断的任务保留多久（秒），过期后连同已拉取的节点一起删除；
+                      同样时间内没有重新爬取的节点树缓存也一并删除
+    """
+
+    def __init__(self, cache, stale_after=60, retention=86400):
+        self.cache = cache
+        self.stale_after = stale_after
+        self.retention = retention
+        with cache.transaction() as conn:
+            conn.executescript(_SCHEMA)
+
+    def create(self, space_id, scope=None):
+        """创建新任务，顺带清理过期的任务"""
+        self.purge()
+        now = time.time()
+        job = {
+            'job_id': uuid.uuid4().hex, 'space_id': space_id, 'scope': scope, 'status': 'running',
+            'created_at': now, 'updated_at': now, 'node_count': 0, 'pages_fetched': 0,
+            'failed_pages': 0, 'frontier': None, 'error': None
+        }
+        with self.cache.transaction() as conn:
+            conn.execute(
+                f"INSERT INTO crawl_jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                tuple(job[column] for column in _COLUMNS)
+            )
+        return job
+
+    def find_resumable(self, space_id, scope=None):
+        """查找 space_id 下可以恢复的任务（中断的任务，或长时间没有更新检查点的 running 任务）"""
+        stale_before = time.time() - self.stale_after
+        row = self.cache.query(
+            f"SELECT {', '.join(_COLUMNS)} FROM crawl_jobs "
+            "WHERE space_id = ? AND scope IS ? AND frontier IS NOT NULL "
+            "AND (status = 'interrupted' OR (status = 'running' AND updated_at < ?)) "
+            "ORDER BY updated_at DESC LIMIT 1",
+            (space_id, scope, stale_before), one=True
+        )
+        return self._to_job(row)
+
+    def claim(self, job):
+        """把可恢复的任务重新标记为 running，多个进程同时恢复同一任务时只有一个成功"""
+        now = time.time()
+        with self.cache.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE crawl_jobs SET status = 'running', updated_at = ?, error = NULL "
+                "WHERE job_id = ? AND status = ? AND updated_at = ?",
+                (now, job['job_id'], job['status'], job['updated_at'])
+            )
+        if cursor.rowcount != 1:
+            return None
+        return dict(job, status='running', updated_at=now, error=None)
+
+    def get(self, job_id):
+        row = self.cache.query(f"SELECT {', '.join(_COLUMNS)} FROM crawl_jobs WHERE job_id = ?", (job_id,), one=True)
+        return self._to_job(row)
+
+    def list(self, space_id=None, limit=20):
+        query = f"SELECT {', '.join(_COLUMNS)} FROM crawl_jobs"
+        params = ()
+        if space_id:
+            query += " WHERE space_id = ?"
+            params = (space_id,)
+        rows = self.cache.query(query + " ORDER BY created_at DESC LIMIT ?", params + (limit,))
+        return [self._to_job(row) for row in rows]
+
+    def writer(self, job):
+        """任务已拉取节点的 TreeCacheWriter，staging 键由 job_id 决定，恢复时接着写入；完成后写入任务 scope 的缓存"""
+        return self.cache.writer(scoped_key(job['space_id'], job['scope']), f"{job['space_id']}#job-{job['job_id']}")
+
+    def checkpoint(self, job, writer, batches, frontier):
+        """
+        保存检查点：在一个事务内写入上次检查点之后拉取的节点，并更新未完成的页面列表
+        :param batches: [(parent_node_token, items), ...]
+        :param frontier: [(parent_node_token, page_token), ...]
+        """
+        rows = []
+        for parent_node_token, items in batches:
+            rows.extend(writer.stage(parent_node_token, items))
+        job.update(
+            frontier=[list(page) for page in frontier], node_count=writer.node_count, updated_at=time.time()
+        )
+        with self.cache.transaction() as conn:
+            self.cache.insert_nodes(rows, transaction=conn)
+            self._update(conn, job)
+
+    def finish(self, job, status, error=None):
+        job.update(status=status, error=error, updated_at=time.time())
+        if status == 'done':
+            job['frontier'] = None
+        with self.cache.transaction() as conn:
+            self._update(conn, job)
+
+    def _update(self, conn, job):
+        conn.execute(
+            "UPDATE crawl_jobs SET status = ?, updated_at = ?, node_count = ?, pages_fetched = ?, "
+            "failed_pages = ?, frontier = ?, error = ? WHERE job_id = ?",
+            (job['status'], job['updated_at'], job['node_count'], job['pages_fetched'], job['failed_pages'],
+             json.dumps(job['frontier']) if job['frontier'] is not None else None, job['error'], job['job_id'])
+        )
+
+    def purge(self):
+        """删除超过保留期的任务及其已拉取的节点，以及超过保留期没有重新爬取的节点树缓存"""
+        expired_before = time.time() - self.retention
+        with self.cache.transaction() as conn:
+            expired = conn.execute(
+                "SELECT job_id, space_id FROM crawl_jobs WHERE updated_at < ?", (expired_before,)
+            ).fetchall()
+            for job_id, space_id in expired:
+                self.cache.delete_nodes(f"{space_id}#job-{job_id}", transaction=conn)
+                conn.execute("DELETE FROM crawl_jobs WHERE job_id = ?", (job_id,))
+            self.cache.purge(expired_before, transaction=conn)
+        return len(expired)
+
+    def _to_job(self, row):
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        if job['frontier'] is not None:
+            job['frontier'] = json.loads(job['frontier'])
+        return job
+
+
+class JobReplay:
+    """
+    爬取任务的事件回放（SharedCrawl.replay），供中途加入的订阅者使用：
+    依次回放最近的进度、检查点中已写入的节点（从 SQLite 分批读取）和上次检查点之后拉取的批次，
+    内存中只保留最近一个检查点间隔内的批次，而不是已发布的全部事件
+    :param writer: 任务的 TreeCacheWriter（CrawlJobStore.writer）
+    :param batch_size: 从 SQLite 回放时每个 nodes 事件的最大节点数
+    """
+
+    def __init__(self, writer, batch_size=100):
+        self.writer = writer
+        self.batch_size = batch_size
+        # 已写入检查点的节点数，恢复的任务从已有的检查点开始
+        self.staged = writer.node_count
+        # 上次检查点之后拉取的 (parent_node_token, items)，下一个检查点写入它们
+        self.recent = []
+        self.count = writer.node_count
+
+    def record(self, event):
+        if event[0] == 'nodes':
+            self.recent.append((event[1], event[2]))
+        elif event[0] == 'progress':
+            self.count = event[1]
+
+    def checkpointed(self):
+        """recent 中的批次已写入检查点"""
+        self.recent = []
+        self.staged = self.writer.node_count
+
+    def __call__(self, nodes=True):
+        """取得当前的回放（在 SharedCrawl 的锁内调用），节点在迭代时才读取"""
+        return self._events(self.count, self.staged if nodes else 0, list(self.recent) if nodes else [])
+
+    def _events(self, count, staged, recent):
+        if count:
+            yield ('progress', count)
+        for parent_node_token, items in self.writer.iter_batches(staged, self.batch_size):
+            yield ('nodes', parent_node_token, items)
+        for parent_node_token, items in recent:
+            yield ('nodes', parent_node_token, items)
+
+
+def job_summary(job):
+    """对外展示的任务状态，不包含 frontier 明细和 scope"""
+    summary = {key: job[key] for key in _COLUMNS if key not in ('frontier', 'scope')}
+    summary['pending_pages'] = len(job['frontier']) if job['frontier'] is not None else 0
+    return summary
@@ -0,0 +1,178 @@
+import asyncio
+import queue
+import threading
+import time
+
+_END = object()
+# 同步版本的读取线程最多预读的片段数，消费者跟不上时读取线程等待
+READ_AHEAD = 256
+
+
+async def _next_delta(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+
+def _read_deltas(deltas, pending, stopped):
+    """在后台线程中把 deltas 的片段依次放入 pending，结束时放入 _END，出错时放入异常；stopped 置位后退出"""
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for delta in deltas:
+            if not put(delta):
+                return
+        put(_END)
+    except Exception as e:
+        put(e)
+    finally:
+        if hasattr(deltas, 'close'):
+            deltas.close()
+
+
+class DeltaCoalescer:
+    """
+    合并流式大模型输出中连续的同类型片段（reasoning / content），减少 SSE 事件数和写入次数
+    与上一次输出间隔超过 max_delay 时片段立即输出（首个片段、停顿之后的片段不增加延迟），
+    否则先缓冲，直到距上一次输出满 max_delay 或缓冲的文本达到 max_bytes；类型变化时先输出已缓冲的片段，
+    因此输出的事件类型和顺序与逐个片段输出时相同，只是每个事件的文本更长。
+    :param max_bytes: 缓冲文本（UTF-8）达到该字节数时立即输出，0 表示不按大小输出
+    :param max_delay: 两次输出之间的最短间隔（秒），0 表示不合并，每个片段单独输出
+    """
+
+    def __init__(self, max_bytes=2048, max_delay=0.1, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.clock = clock
+        self._type = None
+        self._parts = []
+        self._size = 0
+        self._last_emit = None
+
+    @property
+    def enabled(self):
+        return self.max_delay > 0
+
+    def add(self, event_type, text):
+        """加入一个片段，返回现在应该输出的 [(类型, 文本), ...]"""
+        if not self.enabled:
+            return [(event_type, text)]
+        ready = []
+        if self._type is not None and event_type != self._type:
+            ready.append(self._take())
+        self._type = event_type
+        self._parts.append(text)
+        if self.max_bytes:
+            self._size += len(text.encode('utf-8'))
+        if (self.max_bytes and self._size >= self.max_bytes) or self._due():
+            ready.append(self._take())
+        return ready
+
+    def deadline(self):
+        """缓冲的片段最晚应该输出的时刻（clock 的时间），没有缓冲时返回 None"""
+        if self._type is None:
+            return None
+        return self._last_emit + self.max_delay
+
+    def flush(self):
+        """取出所有缓冲的片段"""
+        return [self._take()] if self._type is not None else []
+
+    def _due(self):
+        return self._last_emit is None or self.clock() - self._last_emit >= self.max_delay
+
+    def _take(self):
+        event = (self._type, ''.join(self._parts))
+        self._type = None
+        self._parts = []
+        self._size = 0
+        self._last_emit = self.clock()
+        return event
+
+    def coalesce(self, deltas):
+        """
+        合并同步迭代器 deltas 产生的 (类型, 文本)
+        启用合并时在后台线程中读取 deltas，等待上游期间也按 deadline 输出已缓冲的片段；
+        上游出错时先输出已缓冲的片段再抛出异常。消费者提前关闭时读取线程在收到下一个片段后退出并关闭 deltas，
+        关闭上游连接的清理代码应放在 deltas 的 finally 中
+        """
+        if not self.enabled:
+            yield from deltas
+            return
+        pending = queue.Queue(READ_AHEAD)
+        stopped = threading.Event()
+        threading.Thread(
+            target=_read_deltas, args=(deltas, pending, stopped), name='delta-coalescer', daemon=True
+        ).start()
+        try:
+            while True:
+                deadline = self.deadline()
+                timeout = None if deadline is None else max(0.0, deadline - self.clock())
+                try:
+                    delta = pending.get(timeout=timeout)
+                except queue.Empty:
+                    yield from self.flush()
+                    continue
+                if delta is _END:
+                    break
+                if isinstance(delta, Exception):
+                    yield from self.flush()
+                    raise delta
+                yield from self.add(*delta)
+        finally:
+            stopped.set()
+        yield from self.flush()
+
+    async def acoalesce(self, deltas):
+        """
+        coalesce 的异步版本，等待上游时也按 deadline 输出已缓冲的片段
+        有缓冲时在单独的任务中等待下一个片段，超时只输出缓冲而不取消等待，上游读取不会被打断
+        """
+        iterator = deltas.__aiter__()
+        next_delta = None
+        try:
+            while True:
+                deadline = self.deadline()
+                if deadline is None and next_delta is None:
+                    delta = await _next_delta(iterator)
+                else:
+                    if next_delta is None:
+                        next_delta = asyncio.ensure_future(_next_delta(iterator))
+                    timeout = None if deadline is None else max(0.0, deadline - self.clock())
+                    done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+                    if not done:
+                        for event in self.flush():
+                            yield event
+                        continue
+                    delta, next_delta = next_delta.result(), None
+                if delta is _END:
+                    break
+                for event in self.add(*delta):
+                    yield event
+        except Exception:
+            for event in self.flush():
+                yield event
+            raise
+        finally:
+            if next_delta is not None:
+                await self._discard(next_delta)
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+        for event in self.flush():
+            yield event
+
+    async def _discard(self, task):
+        """消费者提前结束时取消还在等待的读取，并取走任务的结果，避免未处理异常的警告"""
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class DocumentCache:
+    """
+    按字节数限制大小的文档内容 LRU 缓存
+    以 (obj_token, revision) 为键，同一类文档的 revision 必须来自同一个版本字段（见 app.document_revision），
+    文档有新版本写入时同一 obj_token 的旧版本会被移除；总大小超过 max_bytes 时淘汰最久未使用的文档。
+    缓存不区分用户，调用方需要在读取缓存前用当前用户的 token 确认文档的访问权限（例如获取文档元数据）。
+    :param max_bytes: 缓存内容的总字节数上限（按 UTF-8 编码计算）
+    :param max_entry_bytes: 单个文档的字节数上限，超过的文档不缓存
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._revisions = {}
+        self._lock = threading.Lock()
+
+    def get(self, obj_token, revision):
+        key = (obj_token, str(revision))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, obj_token, revision, content):
+        size = len(content.encode('utf-8'))
+        if size > self.max_entry_bytes:
+            return False
+        key = (obj_token, str(revision))
+        with self._lock:
+            previous = self._revisions.get(obj_token)
+            if previous is not None:
+                self._remove(previous)
+            self._entries[key] = (content, size)
+            self._revisions[obj_token] = key
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def invalidate(self, obj_token):
+        with self._lock:
+            key = self._revisions.get(obj_token)
+            if key is not None:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+            if self._revisions.get(key[0]) == key:
+                del self._revisions[key[0]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
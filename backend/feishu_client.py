@@ -0,0 +1,193 @@
+import logging
+import re
+import time
+
+import httpx
+
+try:
+    import h2  # noqa: F401  HTTP/2 需要 httpx[http2]
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+FEISHU_BASE_URL = 'https://open.feishu.cn/open-apis'
+
+
+class FeishuRequestError(Exception):
+    """
+    飞书接口请求失败
+    response 为飞书返回的 httpx.Response；连接失败、超时等网络层错误时为 None
+    """
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def endpoint_name(url):
+    """把请求地址归类为频率限制对应的接口名"""
+    path = str(url).split('?', 1)[0]
+    if '/authen/' in path:
+        return 'oauth'
+    if path.endswith('/raw_content'):
+        return 'raw_content'
+    if path.rstrip('/').rsplit('/', 2)[-2:-1] == ['documents'] and '/docx/v1/' in path:
+        return 'document'
+    if path.endswith('/wiki/v2/spaces/get_node'):
+        return 'get_node'
+    if path.endswith('/nodes'):
+        return 'nodes'
+    if '/wiki/v2/spaces' in path:
+        return 'spaces'
+    return 'default'
+
+
+# 飞书接口的响应体通常以 {"code": N 开头，读取错误码时不必解析整个响应（例如文档正文）
+_CODE_PREFIX = re.compile(rb'\s*\{\s*"code"\s*:\s*(-?\d+)')
+
+
+def response_code(response, max_parse_bytes=65536):
+    """
+    读取飞书响应中的业务错误码，无法确定时返回 None
+    响应体不以 code 开头时，只有较小的响应才完整解析
+    """
+    content = response.content
+    match = _CODE_PREFIX.match(content[:64])
+    if match:
+        return int(match.group(1))
+    if len(content) > max_parse_bytes:
+        return None
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    return data.get('code') if isinstance(data, dict) else None
+
+
+def raise_for_status(response):
+    """HTTP 状态码为 4xx/5xx 时抛出 FeishuRequestError"""
+    if response.is_error:
+        raise FeishuRequestError(
+            f"{response.status_code} Error for url: {response.request.url}", response=response
+        )
+
+
+class FeishuClient:
+    """
+    所有飞书开放平台调用共用的 HTTP 客户端
+    内部持有一个带连接池的 httpx.Client，连接保持 keep-alive，可用时启用 HTTP/2，
+    避免每次请求都重新进行 TCP + TLS 握手。
+    :param base_url: 飞书开放平台接口地址，请求时传入的相对路径会拼接在其后
+    :param max_connections: 连接池最大连接数
+    :param max_keepalive_connections: 连接池中保持空闲的最大连接数
+    :param connect_timeout: 建立连接的超时时间（秒）
+    :param read_timeout: 读取响应的超时时间（秒）
+    :param http2: 是否启用 HTTP/2，未安装 h2 时自动退回 HTTP/1.1
+    :param rate_limiter: 可选的 FeishuRateLimiter，每次请求（包括重试）发出前都先获取对应接口的配额
+    :param tenant: 频率限制按租户划分时使用的租户标识
+    :param observer: 可选，每次请求结束后调用 observer(endpoint, response, elapsed, rate_limit_wait)，
+                     网络层失败时 response 为 None，用于记录延迟和错误码等指标
+    """
+
+    client_class = httpx.Client
+
+    def __init__(self, base_url=FEISHU_BASE_URL, max_connections=20, max_keepalive_connections=10,
+                 connect_timeout=5.0, read_timeout=30.0, http2=True, rate_limiter=None, tenant='default',
+                 observer=None):
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested for Feishu client but the 'h2' package is not installed, falling back to HTTP/1.1")
+        self.base_url = base_url
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.rate_limiter = rate_limiter
+        self.tenant = tenant
+        self.observer = observer
+        self._client = self.client_class(
+            base_url=base_url,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+    def request(self, method, url, user_access_token=None, params=None, json=None, headers=None):
+        """
+        发送请求并返回 httpx.Response，不检查 HTTP 状态码
+        :param url: 相对于 base_url 的路径，也可以是完整 URL
+        :param user_access_token: 提供时自动添加 Authorization 头
+        """
+        request_headers = dict(headers or {})
+        if user_access_token:
+            request_headers['Authorization'] = f"Bearer {user_access_token}"
+        endpoint = endpoint_name(url)
+        wait = self.rate_limiter.acquire(endpoint, self.tenant) if self.rate_limiter is not None else 0
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self._client.request(method, url, params=params, json=json, headers=request_headers)
+            return response
+        except httpx.HTTPError as e:
+            raise FeishuRequestError(f"{type(e).__name__}: {e}") from e
+        finally:
+            self._observe(endpoint, response, started, wait)
+
+    def _observe(self, endpoint, response, started, wait):
+        if self.observer is None:
+            return
+        try:
+            self.observer(endpoint, response, time.perf_counter() - started, wait)
+        except Exception as e:
+            logger.warning(f"Feishu request observer failed: {e}")
+
+    def get(self, url, user_access_token=None, params=None, headers=None):
+        return self.request('GET', url, user_access_token=user_access_token, params=params, headers=headers)
+
+    def post(self, url, user_access_token=None, params=None, json=None, headers=None):
+        return self.request('POST', url, user_access_token=user_access_token, params=params, json=json, headers=headers)
+
+    def close(self):
+        self._client.close()
+
+
+class AsyncFeishuClient(FeishuClient):
+    """
+    FeishuClient 的异步版本，内部使用 httpx.AsyncClient，参数相同
+    限流配额与同步客户端共用同一个 rate_limiter；启用 HTTP/2 时所有并发请求在同一个连接上多路复用。
+    连接池绑定第一次使用它的事件循环，应在同一个事件循环中使用并在结束时 await aclose()。
+    """
+
+    client_class = httpx.AsyncClient
+
+    async def request(self, method, url, user_access_token=None, params=None, json=None, headers=None):
+        request_headers = dict(headers or {})
+        if user_access_token:
+            request_headers['Authorization'] = f"Bearer {user_access_token}"
+        endpoint = endpoint_name(url)
+        wait = await self.rate_limiter.acquire_async(endpoint, self.tenant) if self.rate_limiter is not None else 0
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await self._client.request(method, url, params=params, json=json, headers=request_headers)
+            return response
+        except httpx.HTTPError as e:
+            raise FeishuRequestError(f"{type(e).__name__}: {e}") from e
+        finally:
+            self._observe(endpoint, response, started, wait)
+
+    async def get(self, url, user_access_token=None, params=None, headers=None):
+        return await self.request('GET', url, user_access_token=user_access_token, params=params, headers=headers)
+
+    async def post(self, url, user_access_token=None, params=None, json=None, headers=None):
+        return await self.request('POST', url, user_access_token=user_access_token, params=params, json=json, headers=headers)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
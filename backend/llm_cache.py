@@ -0,0 +1,93 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def response_cache_key(api_key, base_url, model, messages, temperature=None, max_tokens=None):
+    """
+    由 API Key、接口地址、模型、渲染后的提示词（messages）、temperature 和 max_tokens 计算缓存键
+    键中包含 API Key 和接口地址的哈希，无效的 Key 或其他服务商的请求不会命中别人调用得到的缓存
+    """
+    credential_hash = hashlib.sha256(json.dumps([api_key, base_url]).encode('utf-8')).hexdigest()
+    prompt_hash = hashlib.sha256(
+        json.dumps(messages, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    return hashlib.sha256(
+        json.dumps([credential_hash, model, prompt_hash, temperature, max_tokens]).encode('utf-8')
+    ).hexdigest()
+
+
+class LLMResponseRecorder:
+    """记录一次流式响应的 reasoning / content 片段，连续的同类型片段合并为一段"""
+
+    def __init__(self):
+        self.events = []
+
+    def add(self, event_type, text):
+        if self.events and self.events[-1][0] == event_type:
+            self.events[-1][1].append(text)
+        else:
+            self.events.append((event_type, [text]))
+
+    def result(self):
+        return [(event_type, ''.join(parts)) for event_type, parts in self.events]
+
+
+class LLMResponseCache:
+    """
+    大模型流式响应的内存缓存
+    以 response_cache_key 为键保存完整的 [(类型, 文本), ...] 序列，命中时可以按原有 SSE 协议直接回放；
+    条目超过 ttl 秒后失效，总大小超过 max_bytes 时淘汰最久未使用的条目。
+    :param max_bytes: 缓存内容的总字节数上限（按 UTF-8 编码计算）
+    :param ttl: 条目有效期（秒）
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, events):
+        size = sum(len(text.encode('utf-8')) for _, text in events)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (events, time.monotonic(), size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "responses": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+ARK_BASE_URL = 'https://ark.cn-beijing.volces.com/api/v3'
+
+
+class _Entry:
+    def __init__(self, client):
+        self.client = client
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.evicted = False
+
+
+class LLMClientRegistry:
+    """
+    按 (api_key 哈希, base_url) 复用的 OpenAI 兼容客户端
+    每个客户端持有自己的 httpx 连接池，同一个 API Key 的连续请求可以复用 keep-alive 连接，
+    省去每次分析都重新进行 TCP + TLS 握手的开销。
+    客户端数量超过 max_clients 时淘汰最久未使用的，空闲超过 idle_timeout 秒的客户端也会被关闭；
+    正在使用中的客户端被淘汰时，等最后一个请求结束后再关闭。
+    :param max_clients: 最多保留的客户端数量
+    :param idle_timeout: 客户端空闲多久后关闭（秒）
+    :param connect_timeout: 建立连接的超时时间（秒）
+    :param read_timeout: 读取响应的超时时间（秒），推理模型首个 token 之前可能要思考较长时间
+    :param max_connections: 每个客户端连接池的最大连接数
+    :param max_keepalive_connections: 每个客户端连接池中保持空闲的最大连接数
+    """
+
+    def __init__(self, max_clients=16, idle_timeout=300.0, connect_timeout=5.0, read_timeout=300.0,
+                 max_connections=20, max_keepalive_connections=10):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=idle_timeout
+        )
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(api_key, base_url):
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest(), base_url
+
+    @contextmanager
+    def lease(self, api_key, base_url=ARK_BASE_URL):
+        """
+        借出一个客户端，在 with 块内使用，块结束（包括流式响应被客户端中断）时归还
+        """
+        entry, expired = self._acquire(api_key, base_url)
+        self._close_all(expired)
+        try:
+            yield entry.client
+        finally:
+            if self._release(entry):
+                self._close_all([entry])
+
+    def _acquire(self, api_key, base_url):
+        """取出（或创建）客户端并增加引用计数，返回 (条目, 需要关闭的已淘汰条目)"""
+        key = self.key(api_key, base_url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(self._create(api_key, base_url))
+                self._entries[key] = entry
+                logger.debug(f"Created LLM client for {base_url}, {len(self._entries)} clients pooled")
+            self._entries.move_to_end(key)
+            entry.active += 1
+            return entry, self._evict()
+
+    def _release(self, entry):
+        """归还客户端，返回是否需要立即关闭（已被淘汰且没有其他请求在使用）"""
+        with self._lock:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+            return entry.evicted and entry.active == 0
+
+    def _create(self, api_key, base_url):
+        return OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=self.timeout,
+            http_client=httpx.Client(timeout=self.timeout, limits=self.limits)
+        )
+
+    def _evict(self):
+        """在锁内调用，移除超出数量或空闲过久的客户端，返回其中可以立即关闭的"""
+        now = time.monotonic()
+        removed = []
+        for key, entry in list(self._entries.items()):
+            if entry.active == 0 and now - entry.last_used > self.idle_timeout:
+                removed.append(self._entries.pop(key))
+        while len(self._entries) > self.max_clients:
+            _, entry = self._entries.popitem(last=False)
+            removed.append(entry)
+        for entry in removed:
+            entry.evicted = True
+        return [entry for entry in removed if entry.active == 0]
+
+    def _close_all(self, entries):
+        for entry in entries:
+            try:
+                entry.client.close()
+            except Exception as e:
+                logger.warning(f"Failed to close LLM client: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "active_requests": sum(entry.active for entry in self._entries.values())
+            }
+
+    def close(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            for entry in entries:
+                entry.evicted = True
+        self._close_all([entry for entry in entries if entry.active == 0])
+
+
+class AsyncLLMClientRegistry(LLMClientRegistry):
+    """
+    LLMClientRegistry 的异步版本，复用 AsyncOpenAI 客户端，供 ASGI 模式下的流式接口使用
+    客户端绑定创建它的事件循环，只应在同一个事件循环中使用
+    """
+
+    @asynccontextmanager
+    async def lease(self, api_key, base_url=ARK_BASE_URL):
+        entry, expired = self._acquire(api_key, base_url)
+        await self._aclose_all(expired)
+        try:
+            yield entry.client
+        finally:
+            if self._release(entry):
+                await self._aclose_all([entry])
+
+    def _create(self, api_key, base_url):
+        return AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=self.timeout,
+            http_client=httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        )
+
+    async def _aclose_all(self, entries):
+        for entry in entries:
+            try:
+                await entry.client.close()
+            except Exception as e:
+                logger.warning(f"Failed to close LLM client: {e}")
+
+    async def aclose(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            for entry in entries:
+                entry.evicted = True
+        await self._aclose_all([entry for entry in entries if entry.active == 0])
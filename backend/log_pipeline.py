@@ -0,0 +1,118 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# 记录请求体、响应内容等大块数据时，每个字符串字段保留的最大字符数，0 表示不截断
+field_limit = 2000
+# 记录请求头时隐去这些头的值（小写）
+SENSITIVE_HEADERS = ('authorization', 'user-access-token', 'cookie')
+
+
+def set_field_limit(limit):
+    global field_limit
+    field_limit = max(0, int(limit))
+
+
+def truncate_fields(value, limit):
+    """
+    逐个截断 value 中过长的字符串字段（递归处理 dict、list、tuple 和类 dict 对象，如请求头）
+    被截断的字段注明原长度，其余结构保持不变
+    """
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    if isinstance(value, str):
+        if limit and len(value) > limit:
+            return f"{value[:limit]}...(truncated, {len(value)} chars)"
+        return value
+    if isinstance(value, dict) or hasattr(value, 'items'):
+        return {key: truncate_fields(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate_fields(item, limit) for item in value]
+    return value
+
+
+class LogPayload:
+    """
+    延迟格式化的日志参数，以 %s 参数的形式传给 logger：
+    日志级别未启用时不做任何转换；启用时在 QueueListener 的后台线程中才截断并转换为字符串，
+    请求线程只负责把记录放入队列
+    :param value: 要记录的数据（请求体、响应内容、请求头等）
+    :param limit: 单个字符串字段的最大长度，缺省使用 field_limit
+    :param redact: 顶层中值需要隐去的键（不区分大小写），用于请求头中的令牌
+    """
+
+    __slots__ = ('value', 'limit', 'redact')
+
+    def __init__(self, value, limit=None, redact=()):
+        self.value = value
+        self.limit = limit
+        self.redact = redact
+
+    def __str__(self):
+        limit = field_limit if self.limit is None else self.limit
+        value = self.value
+        if self.redact:
+            value = {key: '[REDACTED]' if key.lower() in self.redact else item for key, item in value.items()}
+        return str(truncate_fields(value, limit))
+
+
+def log_payload(value, limit=None):
+    return LogPayload(value, limit)
+
+
+def log_headers(headers):
+    """延迟格式化的请求头，Authorization 等携带令牌的头只记录为 [REDACTED]"""
+    return LogPayload(headers, redact=SENSITIVE_HEADERS)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    把日志记录放入有界队列，格式化和写入由 QueueListener 在后台线程中完成
+    与标准 QueueHandler 不同：prepare 不在调用线程中格式化消息（LogPayload 等参数保持延迟），
+    队列已满时丢弃记录并计数，而不是阻塞或在请求线程中报错
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 同一进程内的队列不需要序列化，记录原样交给后台线程
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def start_queue_logging(handlers, queue_size=10000, logger=None):
+    """
+    让 logger（默认根日志记录器）经由队列输出到 handlers：
+    调用线程只把记录放入队列，控制台和文件的写入（包括文件轮转）在一个后台线程中进行
+    :param handlers: 实际输出日志的处理器，各自的级别和格式仍然生效
+    :param queue_size: 队列容量，写入跟不上时超出的记录被丢弃
+    :return: (NonBlockingQueueHandler, QueueListener)
+    """
+    log_queue = queue.Queue(max(1, int(queue_size)))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    (logger or logging.getLogger()).addHandler(queue_handler)
+    listener.start()
+    # 进程退出前写完队列中剩余的记录
+    atexit.register(listener.stop)
+    return queue_handler, listener
+
+
+def stop_queue_logging(queue_handler, listener, logger=None):
+    """
+    停止 start_queue_logging 建立的管道：从 logger 上移除队列处理器，
+    后台线程写完队列中剩余的记录后退出，再关闭各处理器（释放日志文件）
+    """
+    (logger or logging.getLogger()).removeHandler(queue_handler)
+    atexit.unregister(listener.stop)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
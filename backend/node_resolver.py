@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+from single_flight import SingleFlight
+
+
+class NodeResolver:
+    """
+    知识库节点 token -> (obj_type, obj_token) 的解析器
+    爬取节点树时顺带记录每个节点对应的文档，之后解析这些节点无需调用飞书接口；
+    没有记录的节点回退到 get_node，同一节点的并发查询合并为一次请求。
+    节点与其文档的对应关系不会改变，因此条目不设有效期，只按数量淘汰最久未使用的。
+    记录是所有用户共享的，只包含文档类型和 token，不代表当前用户有权限访问该文档。
+    :param max_entries: 最多记录的节点数
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def remember(self, nodes):
+        """记录一批节点（例如爬取到的一页子节点或 get_node 的结果）"""
+        with self._lock:
+            for node in nodes:
+                node_token = node.get('node_token')
+                if not node_token or not node.get('obj_token'):
+                    continue
+                self._entries[node_token] = (node.get('obj_type'), node['obj_token'])
+                self._entries.move_to_end(node_token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, node_token):
+        with self._lock:
+            entry = self._entries.get(node_token)
+            if entry is not None:
+                self._entries.move_to_end(node_token)
+            return entry
+
+    def resolve(self, node_token, fetch_node, flight_key=None):
+        """
+        解析节点对应的文档
+        :param fetch_node: 没有记录时调用的函数 fetch_node(node_token)，返回 get_node 的 node 字段
+        :param flight_key: 合并并发请求使用的键，默认为 node_token
+        :return: 命中记录时为 {"node_token", "obj_type", "obj_token"}，否则为 get_node 返回的完整节点
+        """
+        entry = self.lookup(node_token)
+        if entry is not None:
+            self.hits += 1
+            return {'node_token': node_token, 'obj_type': entry[0], 'obj_token': entry[1]}
+        self.misses += 1
+        node = self._flight.do(flight_key or node_token, lambda: fetch_node(node_token))
+        self.remember([node])
+        return node
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "nodes": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self._flight.shared
+        }
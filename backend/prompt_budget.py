@@ -0,0 +1,194 @@
+import math
+
+from prompt_template import compile_template
+
+# 知识库大纲类占位符：超出预算时按层级和同级节点数折叠
+OUTLINE_PLACEHOLDERS = ('KNOWLEDGE_BASE_STRUCTURE', 'KNOWLEDGE_BASE_NODE')
+# 文档正文类占位符：大纲折叠后仍超出预算时截断
+DOCUMENT_PLACEHOLDERS = ('IMPORTED_DOCUMENT_CONTENT', 'CURRENT_DOCUMENT')
+
+TRUNCATED_MARKER = '\n……（内容过长，已截断）'
+
+
+def estimate_tokens(text):
+    """
+    本地快速估算文本的 token 数，不依赖模型的分词器
+    中文等非 ASCII 字符按每字 1 个 token 计，ASCII 字符按每 4 个字符 1 个 token 计，估算值略偏保守
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+def parse_outline(text):
+    """
+    把 Markdown 大纲（每层缩进两个空格）解析为节点树
+    :return: 顶层节点列表，每个节点为 {'line', 'level', 'children', 'size', 'on_path'}
+    """
+    roots = []
+    stack = []
+    nodes = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        level = (len(line) - len(line.lstrip(' '))) // 2
+        node = {'line': line, 'level': level, 'children': [], 'size': 1, 'on_path': False}
+        while stack and stack[-1]['level'] >= level:
+            stack.pop()
+        (stack[-1]['children'] if stack else roots).append(node)
+        stack.append(node)
+        nodes.append(node)
+    return roots, nodes
+
+
+def collapse_outline(text, max_depth, max_siblings, target_token=None):
+    """
+    折叠 Markdown 大纲：只保留 max_depth 层，每组同级节点只保留前 max_siblings 个，
+    被省略的节点合并为一行计数；target_token 所在节点及其所有祖先总是保留
+    """
+    return render_collapsed(mark_target_path(text, target_token), max_depth, max_siblings)
+
+
+def mark_target_path(text, target_token=None):
+    """解析大纲并统计每个节点的子树大小，标记 target_token 所在节点及其祖先"""
+    roots, nodes = parse_outline(text)
+    target_marker = f"(token: {target_token})" if target_token else None
+    # 先序列表倒序遍历即为后序，子树大小和目标路径标记自底向上汇总
+    for node in reversed(nodes):
+        node['size'] = 1 + sum(child['size'] for child in node['children'])
+        node['on_path'] = bool(target_marker and target_marker in node['line']) or \
+            any(child['on_path'] for child in node['children'])
+    return roots
+
+
+def render_collapsed(roots, max_depth, max_siblings):
+    """按层数和同级节点数输出 mark_target_path 解析后的大纲"""
+    lines = []
+    # 栈中元素为待输出的节点、待处理的同级节点列表或已经生成好的文本行
+    stack = [('children', roots, 0)]
+    while stack:
+        entry = stack.pop()
+        if entry[0] == 'line':
+            lines.append(entry[1])
+            continue
+        if entry[0] == 'node':
+            node, depth = entry[1], entry[2]
+            lines.append(node['line'])
+            if node['children']:
+                stack.append(('children', node['children'], depth + 1))
+            continue
+
+        children, depth = entry[1], entry[2]
+        if depth >= max_depth:
+            visible = [child for child in children if child['on_path']]
+        else:
+            visible = [child for index, child in enumerate(children) if index < max_siblings or child['on_path']]
+        hidden = sum(child['size'] for child in children) - sum(child['size'] for child in visible)
+        if hidden:
+            indent = '  ' * children[0]['level']
+            stack.append(('line', f"{indent}- …（已折叠 {hidden} 个节点）"))
+        for child in reversed(visible):
+            stack.append(('node', child, depth))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def fit_outline(text, budget, max_depth=6, max_siblings=50, target_token=None, min_siblings=5):
+    """
+    折叠大纲直到估算 token 数不超过 budget
+    从 max_depth 层开始逐层减少，每个层数下二分查找能放进预算的最大同级节点数，
+    同级节点数不少于 min_siblings（或已减到 1 层）时采用
+    :return: (折叠后的大纲, 使用的 (层数, 同级节点数))；无需折叠时第二项为 None
+    """
+    if estimate_tokens(text) <= budget:
+        return text, None
+    roots = mark_target_path(text, target_token)
+    for depth in range(max_depth, 0, -1):
+        best = None
+        low, high = 1, max_siblings
+        while low <= high:
+            middle = (low + high) // 2
+            collapsed = render_collapsed(roots, depth, middle)
+            if estimate_tokens(collapsed) <= budget:
+                best = (middle, collapsed)
+                low = middle + 1
+            else:
+                high = middle - 1
+        if best is not None and (best[0] >= min(min_siblings, max_siblings) or depth == 1):
+            return best[1], (depth, best[0])
+    # 每层只保留 1 个节点仍然超出预算，由调用方截断
+    return render_collapsed(roots, 1, 1), (1, 1)
+
+
+def truncate_text(text, budget):
+    """按估算 token 数截断文本，并在末尾注明已截断"""
+    if estimate_tokens(text) <= budget:
+        return text
+    budget = max(0, budget - estimate_tokens(TRUNCATED_MARKER))
+    # 二分查找满足预算的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + TRUNCATED_MARKER
+
+
+def fit_placeholders(prompt_template, placeholders, budget, target_token=None, max_depth=6, max_siblings=50):
+    """
+    在占位符替换之前把提示词控制在 token 预算内
+    先折叠知识库大纲（保留通往 target_token 的路径），仍然超出时再截断文档正文；
+    只统计模板中实际出现的占位符，出现多次的按次数计算
+    :param budget: 提示词的 token 预算，小于等于 0 表示不限制
+    :return: (调整后的占位符字典, 预算报告)
+    """
+    report = {'budget': budget, 'collapsed': {}, 'truncated': []}
+    slot_counts = compile_template(prompt_template).slot_counts
+    counts = {name: slot_counts.get(name, 0) for name in placeholders if isinstance(name, str)}
+    sizes = {name: estimate_tokens('' if value is None else str(value)) for name, value in placeholders.items()}
+    total = estimate_tokens(prompt_template) + sum(sizes[name] * count for name, count in counts.items())
+    report['estimated_tokens'] = total
+    if budget <= 0 or total <= budget:
+        report['final_tokens'] = total
+        return placeholders, report
+
+    outlines = [name for name in OUTLINE_PLACEHOLDERS if counts.get(name) and placeholders.get(name)]
+    documents = [name for name in DOCUMENT_PLACEHOLDERS if counts.get(name) and placeholders.get(name)]
+    compressible = set(outlines) | set(documents)
+    fixed = estimate_tokens(prompt_template) + sum(
+        sizes[name] * count for name, count in counts.items() if name not in compressible
+    )
+    available = max(0, budget - fixed)
+    document_tokens = sum(sizes[name] * counts[name] for name in documents)
+
+    result = dict(placeholders)
+    outline_tokens = 0
+    if outlines:
+        # 文档同样很大时至少给大纲留一半预算，按出现次数平均分配给各个大纲
+        outline_budget = max(available - document_tokens, available // 2) if documents else available
+        outline_weight = sum(counts[name] for name in outlines)
+        for name in outlines:
+            text, params = fit_outline(
+                str(placeholders[name]), outline_budget // outline_weight, max_depth, max_siblings, target_token
+            )
+            if params is not None:
+                # 折叠到每层 1 个节点仍然超出时，直接截断
+                text = truncate_text(text, outline_budget // outline_weight)
+                report['collapsed'][name] = {'max_depth': params[0], 'max_siblings': params[1]}
+            result[name] = text
+            outline_tokens += estimate_tokens(text) * counts[name]
+
+    if documents and document_tokens > available - outline_tokens:
+        # 按原始大小等比例分配剩余预算
+        remaining = max(0, available - outline_tokens)
+        for name in documents:
+            share = remaining * sizes[name] // document_tokens
+            result[name] = truncate_text(str(placeholders[name]), share)
+            report['truncated'].append(name)
+
+    report['final_tokens'] = fixed + sum(
+        estimate_tokens(str(result[name])) * counts[name] for name in compressible
+    )
+    return result, report
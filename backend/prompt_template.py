@@ -0,0 +1,49 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+# {NAME} 形式的占位符，NAME 中不含花括号
+PLACEHOLDER_PATTERN = re.compile(r'\{([^{}]+)\}')
+
+
+class CompiledTemplate:
+    """
+    预先解析好的提示词模板
+    模板被切分为交替出现的字面文本和占位符，渲染时一次性拼接，
+    占位符的值原样写入结果，值中出现的 {NAME} 不会被再次替换
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.literals = []
+        self.slots = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(template):
+            self.literals.append(template[position:match.start()])
+            self.slots.append(match.group(1))
+            position = match.end()
+        self.literals.append(template[position:])
+        self.slot_counts = Counter(self.slots)
+
+    def render(self, values):
+        """
+        用 values 填充占位符，没有提供值的占位符保留原样，值为 None 时替换为空字符串
+        :return: (渲染结果, 未提供值的占位符列表)
+        """
+        parts = [self.literals[0]]
+        missing = []
+        for name, literal in zip(self.slots, self.literals[1:]):
+            if name in values:
+                value = values[name]
+                parts.append('' if value is None else str(value))
+            else:
+                missing.append(name)
+                parts.append(f'{{{name}}}')
+            parts.append(literal)
+        return ''.join(parts), missing
+
+
+@lru_cache(maxsize=128)
+def compile_template(template):
+    """解析模板并按内容缓存，同一个模板重复使用时无需再次解析"""
+    return CompiledTemplate(template)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 飞书开放平台各接口的频率限制：接口 -> (次数, 秒)
+FEISHU_QUOTAS = {
+    'spaces': (100, 60),       # 获取知识空间列表 / 获取知识空间信息
+    'nodes': (100, 60),        # 获取知识空间子节点列表
+    'get_node': (100, 60),     # 获取知识空间节点信息
+    'raw_content': (5, 1),     # 获取文档纯文本内容
+    'document': (5, 1),        # 获取文档基本信息
+    'oauth': (1000, 60),       # 获取 user_access_token
+    'default': (100, 60),
+}
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+    acquire 为 O(1)：在锁内预占令牌（令牌数允许为负，表示已排队的请求），锁外按需等待，
+    多个线程并发调用时按到达顺序依次获得配额。
+    :param rate: 每秒补充的令牌数
+    :param capacity: 令牌桶容量，即允许的突发请求数
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """调整补充速率，已累积的令牌按旧速率结算"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+    def reserve(self, tokens=1):
+        """预占令牌，返回获得配额前需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """获取令牌，必要时阻塞等待，返回实际等待的秒数"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class AIMDController:
+    """
+    加性增、乘性减（AIMD）控制器
+    每次成功把当前值增加 increase，遇到限流时乘以 decrease；
+    cooldown 秒内的多次限流只削减一次，避免同一波并发请求同时被限流时把值压到最低。
+    """
+
+    def __init__(self, initial, minimum, maximum, increase=1.0, decrease=0.5, cooldown=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._value = min(maximum, max(minimum, initial))
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def limit(self):
+        """当前值向下取整，作为并发窗口使用"""
+        return max(int(self.minimum), int(self._value))
+
+    def on_success(self):
+        with self._lock:
+            self._value = min(self.maximum, self._value + self.increase)
+            return self._value
+
+    def on_congestion(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._value = max(self.minimum, self._value * self.decrease)
+                self._last_decrease = now
+            return self._value
+
+
+class FeishuRateLimiter:
+    """
+    按 (租户, 接口) 划分的令牌桶集合，所有飞书调用共享
+    :param quotas: 接口 -> (次数, 秒) 的频率限制表，缺省使用 FEISHU_QUOTAS
+    :param safety_factor: 安全系数，只使用理论限制的一部分，留出余量
+    :param burst_seconds: 令牌桶容量对应的秒数，控制允许的突发请求量
+    :param adaptive: 为 True 时每个令牌桶的速率由 AIMD 控制：从 safety_factor 出发，
+                     请求成功时逐步提高到 max_factor，遇到限流时减半
+    :param max_factor: 自适应模式下速率相对飞书公布限制的上限
+    :param observer: 可选，令牌桶创建或速率变化时以 (租户, 接口, 次/秒, 相对公布限制的系数) 调用，用于记录指标
+    """
+
+    def __init__(self, quotas=None, safety_factor=0.8, burst_seconds=1.0, adaptive=False, max_factor=1.0,
+                 observer=None):
+        self.quotas = dict(FEISHU_QUOTAS)
+        self.quotas.update(quotas or {})
+        self.safety_factor = safety_factor
+        self.burst_seconds = burst_seconds
+        self.adaptive = adaptive
+        self.max_factor = max_factor
+        self.observer = observer
+        self._buckets = {}
+        self._factors = {}
+        self._lock = threading.Lock()
+
+    def rate_for(self, endpoint):
+        """接口的初始有效速率（次/秒）"""
+        return self.quota_rate(endpoint) * self.safety_factor
+
+    def quota_rate(self, endpoint):
+        """飞书公布的接口速率（次/秒）"""
+        max_calls, per_seconds = self.quotas.get(endpoint, self.quotas['default'])
+        return max_calls / per_seconds
+
+    def current_rates(self):
+        """各令牌桶当前的速率，(租户, 接口) -> 次/秒"""
+        return {key: bucket.rate for key, bucket in list(self._buckets.items())}
+
+    def on_success(self, endpoint, tenant='default'):
+        if self.adaptive:
+            self._adjust(endpoint, tenant, AIMDController.on_success)
+
+    def on_rate_limited(self, endpoint, tenant='default'):
+        if self.adaptive:
+            factor = self._adjust(endpoint, tenant, AIMDController.on_congestion)
+            logger.warning(f"Rate limited on {endpoint} (tenant: {tenant}), rate factor cut to {factor:.2f}")
+
+    def _adjust(self, endpoint, tenant, step):
+        key = (tenant, endpoint)
+        controller = self._factors.get(key)
+        if controller is None:
+            with self._lock:
+                controller = self._factors.setdefault(key, AIMDController(
+                    self.safety_factor, minimum=0.05, maximum=self.max_factor, increase=0.01, decrease=0.5
+                ))
+        factor = step(controller)
+        rate = self.quota_rate(endpoint) * factor
+        self.bucket(endpoint, tenant).set_rate(rate)
+        if self.observer:
+            self.observer(tenant, endpoint, rate, factor)
+        return factor
+
+    def bucket(self, endpoint, tenant='default'):
+        key = (tenant, endpoint)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate = self.rate_for(endpoint)
+                    bucket = TokenBucket(rate, rate * self.burst_seconds)
+                    self._buckets[key] = bucket
+                    if self.observer:
+                        self.observer(tenant, endpoint, rate, self.safety_factor)
+        return bucket
+
+    def acquire(self, endpoint, tenant='default'):
+        """获取一次调用配额，返回等待的秒数"""
+        wait = self.bucket(endpoint, tenant).acquire()
+        self._log_wait(endpoint, tenant, wait)
+        return wait
+
+    async def acquire_async(self, endpoint, tenant='default'):
+        """acquire 的异步版本，与同步调用共用同一个令牌桶，等待配额时不阻塞事件循环"""
+        wait = self.bucket(endpoint, tenant).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._log_wait(endpoint, tenant, wait)
+        return wait
+
+    def _log_wait(self, endpoint, tenant, wait):
+        if wait > 1:
+            logger.warning(f"Rate limit reached for {endpoint} (tenant: {tenant}). Waited {wait:.2f} seconds.")
+        elif wait > 0:
+            logger.debug(f"Waited {wait:.3f}s for {endpoint} rate limit")
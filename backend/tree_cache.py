@@ -0,0 +1,301 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from wiki_tree import WikiTreeBuilder
+
+# roots: 顶层节点列表；tree: 带索引的 WikiTreeBuilder；crawled_at: 爬取完成的时间戳
+CachedTree = namedtuple('CachedTree', ['space_id', 'roots', 'tree', 'crawled_at', 'node_count'])
+
+# 判断节点是否变化时比较的字段，任何一个不同都需要重新遍历该节点的子树
+NODE_SIGNATURE_FIELDS = ('obj_edit_time', 'node_create_time', 'has_child')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spaces (
+    space_id TEXT PRIMARY KEY,
+    crawled_at REAL NOT NULL,
+    node_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    space_id TEXT NOT NULL,
+    node_token TEXT NOT NULL,
+    parent_node_token TEXT,
+    seq INTEGER NOT NULL,
+    obj_edit_time TEXT,
+    node_create_time TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (space_id, node_token)
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_space_seq ON nodes (space_id, seq);
+"""
+
+_INSERT_NODE = "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+
+def scoped_key(space_id, scope=None):
+    """
+    节点树在缓存中的键：飞书按节点控制权限，同一知识空间不同用户可见的节点不同，
+    因此每个权限范围（scope，例如用户令牌的哈希）单独缓存一棵树
+    """
+    return space_id if scope is None else f"{space_id}#scope-{scope}"
+
+
+def node_signature(node):
+    return tuple(node.get(field) for field in NODE_SIGNATURE_FIELDS)
+
+
+def build_tree(rows):
+    """由按写入顺序排列的 (parent_node_token, data) 行重建节点树"""
+    # 写入顺序（先序或广度优先）保证父节点总是先于子节点出现
+    tree = WikiTreeBuilder()
+    for parent_node_token, data in rows:
+        tree.add_children(parent_node_token, [json.loads(data)])
+    return tree
+
+
+class WikiTreeCache:
+    """
+    知识空间节点树的本地持久化缓存
+    每个 space_id 的完整节点树按先序存入 SQLite（每个节点一行，记录 obj_edit_time/node_create_time），
+    最近读取的若干棵树同时保留在内存中，重复读取无需再解析。
+    :param path: SQLite 文件路径
+    :param memory_spaces: 内存中最多保留的节点树数量
+    """
+
+    def __init__(self, path, memory_spaces=8):
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.path = path
+        self.memory_spaces = memory_spaces
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def load(self, space_id):
+        """读取缓存的节点树，没有缓存时返回 None"""
+        with self._lock:
+            cached = self._memory.get(space_id)
+            if cached is not None:
+                self._memory.move_to_end(space_id)
+                return cached
+
+            row = self._conn.execute(
+                "SELECT crawled_at FROM spaces WHERE space_id = ?", (space_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT parent_node_token, data FROM nodes WHERE space_id = ? ORDER BY seq", (space_id,)
+            ).fetchall()
+
+        tree = build_tree(rows)
+        cached = CachedTree(space_id, tree.roots, tree, row[0], len(tree))
+        self._remember(cached)
+        return cached
+
+    def save(self, space_id, tree, crawled_at=None):
+        """
+        用一次完整爬取的结果替换 space_id 的缓存
+        :param tree: 爬取得到的 WikiTreeBuilder
+        """
+        crawled_at = crawled_at or time.time()
+        rows = []
+        stack = [(None, node) for node in reversed(tree.roots)]
+        while stack:
+            parent_node_token, node = stack.pop()
+            data = {key: value for key, value in node.items() if key != 'children'}
+            rows.append((
+                space_id, node['node_token'], parent_node_token, len(rows),
+                node.get('obj_edit_time'), node.get('node_create_time'),
+                json.dumps(data, ensure_ascii=False)
+            ))
+            stack.extend((node['node_token'], child) for child in reversed(node.get('children') or []))
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM nodes WHERE space_id = ?", (space_id,))
+                self._conn.executemany(_INSERT_NODE, rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO spaces (space_id, crawled_at, node_count) VALUES (?, ?, ?)",
+                    (space_id, crawled_at, len(rows))
+                )
+        cached = CachedTree(space_id, tree.roots, tree, crawled_at, len(rows))
+        self._remember(cached)
+        return cached
+
+    def writer(self, space_id, staging_id=None):
+        """创建按页写入的 TreeCacheWriter，传入已有的 staging_id 时接着写入之前的部分结果"""
+        return TreeCacheWriter(self, space_id, staging_id)
+
+    def invalidate(self, space_id):
+        with self._lock:
+            self._memory.pop(space_id, None)
+            with self._conn:
+                self._conn.execute("DELETE FROM nodes WHERE space_id = ?", (space_id,))
+                self._conn.execute("DELETE FROM spaces WHERE space_id = ?", (space_id,))
+
+    def purge(self, before, transaction=None):
+        """删除爬取时间早于 before 的节点树（不再被读取的权限范围留下的缓存），返回删除的数量"""
+        def purge_rows(conn):
+            expired = [row[0] for row in conn.execute(
+                "SELECT space_id FROM spaces WHERE crawled_at < ?", (before,)
+            ).fetchall()]
+            for space_id in expired:
+                conn.execute("DELETE FROM nodes WHERE space_id = ?", (space_id,))
+                conn.execute("DELETE FROM spaces WHERE space_id = ?", (space_id,))
+                self._memory.pop(space_id, None)
+            return len(expired)
+
+        if transaction is not None:
+            return purge_rows(transaction)
+        with self.transaction() as conn:
+            return purge_rows(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        持有缓存的锁，在一个 SQLite 事务中执行多条语句（供共用同一文件的 CrawlJobStore 使用），
+        正常结束时提交，出错时回滚。事务内调用本类方法时需要传入 transaction 参数，避免重复加锁
+        """
+        with self._lock:
+            with self._conn:
+                yield self._conn
+
+    def query(self, sql, params=(), one=False):
+        """执行只读查询，one 为 True 时返回第一行（没有时为 None），否则返回所有行"""
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+
+    def insert_nodes(self, rows, transaction=None):
+        """写入 TreeCacheWriter.stage 生成的节点行"""
+        if transaction is not None:
+            transaction.executemany(_INSERT_NODE, rows)
+            return
+        with self.transaction() as conn:
+            conn.executemany(_INSERT_NODE, rows)
+
+    def delete_nodes(self, key, transaction=None):
+        """删除 key（space_id 或 staging 键）下的所有节点行"""
+        if transaction is not None:
+            transaction.execute("DELETE FROM nodes WHERE space_id = ?", (key,))
+            return
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM nodes WHERE space_id = ?", (key,))
+
+    def count_nodes(self, key):
+        return self.query("SELECT COUNT(*) FROM nodes WHERE space_id = ?", (key,), one=True)[0]
+
+    def node_rows(self, key, start=0, limit=-1):
+        """
+        key 下按写入顺序排列的 (parent_node_token, data) 行，可用 build_tree 重建节点树
+        :param start: 从第几个节点（seq）开始
+        :param limit: 最多返回的行数，-1 表示不限
+        """
+        return self.query(
+            "SELECT parent_node_token, data FROM nodes WHERE space_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+            (key, start, limit)
+        )
+
+    def replace_with_staged(self, space_id, staging_id, crawled_at, node_count, tree=None):
+        """
+        在一个事务内用 staging 键下的节点替换 space_id 的缓存，并更新内存中的节点树
+        :param tree: 可选，与 staging 内容一致的 WikiTreeBuilder，提供时直接放入内存，否则下次读取时从磁盘重建
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM nodes WHERE space_id = ?", (space_id,))
+                self._conn.execute("UPDATE nodes SET space_id = ? WHERE space_id = ?", (space_id, staging_id))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO spaces (space_id, crawled_at, node_count) VALUES (?, ?, ?)",
+                    (space_id, crawled_at, node_count)
+                )
+            # 内存中的旧树已经过期
+            self._memory.pop(space_id, None)
+        if tree is not None:
+            self._remember(CachedTree(space_id, tree.roots, tree, crawled_at, node_count))
+
+    def _remember(self, cached):
+        with self._lock:
+            self._memory[cached.space_id] = cached
+            self._memory.move_to_end(cached.space_id)
+            while len(self._memory) > self.memory_spaces:
+                self._memory.popitem(last=False)
+
+
+class TreeCacheWriter:
+    """
+    边爬取边写入缓存
+    节点先写到临时的 staging 键下，commit 时在一个事务内替换 space_id 原有的缓存，
+    爬取中途失败时 abort 丢弃已写入的部分，不影响正在被读取的旧缓存。
+    要求父节点先于子节点写入（广度优先爬取天然满足），load 时才能按写入顺序重建节点树。
+    :param staging_id: 可选，沿用已有的 staging 键（例如从检查点恢复的爬取），默认新建一个
+    """
+
+    def __init__(self, cache, space_id, staging_id=None):
+        self.cache = cache
+        self.space_id = space_id
+        self.staging_id = staging_id or f"{space_id}#staging-{uuid.uuid4().hex}"
+        self.node_count = cache.count_nodes(staging_id) if staging_id else 0
+
+    def add(self, parent_node_token, items):
+        self.cache.insert_nodes(self.stage(parent_node_token, items))
+
+    def stage(self, parent_node_token, items):
+        """生成一页节点待写入的行，由调用方在自己的事务中写入"""
+        rows = []
+        for node in items:
+            data = {key: value for key, value in node.items() if key != 'children'}
+            rows.append((
+                self.staging_id, node['node_token'], parent_node_token, self.node_count + len(rows),
+                node.get('obj_edit_time'), node.get('node_create_time'),
+                json.dumps(data, ensure_ascii=False)
+            ))
+        self.node_count += len(rows)
+        return rows
+
+    def load_tree(self):
+        """读取已写入的部分结果，重建为 WikiTreeBuilder"""
+        return build_tree(self.cache.node_rows(self.staging_id))
+
+    def iter_batches(self, count, batch_size):
+        """
+        按写入顺序分批读取前 count 个已写入的节点，依次产出 (parent_node_token, 子节点批次)，
+        每次只从 SQLite 读取一个批次；读取期间已经 commit 时改从 space_id 读取（commit 不改变节点的顺序）
+        """
+        start = 0
+        while start < count:
+            limit = min(batch_size, count - start)
+            rows = self.cache.node_rows(self.staging_id, start, limit) or self.cache.node_rows(self.space_id, start, limit)
+            if not rows:
+                return
+            start += len(rows)
+            parent_node_token, items = rows[0][0], []
+            for parent, data in rows:
+                if parent != parent_node_token:
+                    yield parent_node_token, items
+                    parent_node_token, items = parent, []
+                items.append(json.loads(data))
+            yield parent_node_token, items
+
+    def commit(self, crawled_at=None, tree=None):
+        """
+        用已写入的结果替换缓存
+        :param tree: 可选，与写入内容一致的 WikiTreeBuilder，提供时直接放入内存缓存，省去下次读取时的重建
+        """
+        crawled_at = crawled_at or time.time()
+        self.cache.replace_with_staged(self.space_id, self.staging_id, crawled_at, self.node_count, tree)
+        return crawled_at
+
+    def abort(self):
+        self.cache.delete_nodes(self.staging_id)
@@ -0,0 +1,319 @@
+import asyncio
+import inspect
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from wiki_tree import WikiTreeBuilder, count_nodes
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlCancelled(Exception):
+    """爬取被取消（例如所有订阅的客户端都已断开）"""
+
+
+class WikiCrawler:
+    """
+    广度优先的知识空间爬取引擎
+    整个爬取只使用一个有界线程池，工作线程从 frontier 队列中领取 (parent_node_token, page_token) 任务，
+    并发度由调用方根据速率预算决定，与树的深度无关。
+    :param fetch_page: 拉取一页子节点的函数，签名为 fetch_page(parent_node_token, page_token)，返回飞书接口的 data 字段
+    :param max_workers: 线程池大小，即同时在途的分页请求数上限
+    :param progress_callback: 进度回调，参数为已获取的节点总数
+    :param concurrency: 可选的并发窗口（如 AIMDController），其 limit 属性在运行中动态限制在途请求数，上限为 max_workers
+    :param reuse_subtree: 可选，reuse_subtree(item) 返回可直接复用的子节点列表（如缓存中未变化的子树），返回 None 则继续向下爬取；
+                          复用的子树不经过 page_callback，需要时由 reuse_subtree 自行交出
+    :param page_callback: 可选，每拉取到一页子节点时调用 page_callback(parent_node_token, items)
+    :param retain_tree: 为 False 时不在内存中保留节点树，crawl 返回空列表，节点只通过 page_callback 交给调用方
+    :param checkpoint_callback: 可选，每隔 checkpoint_interval 秒调用 checkpoint_callback(pending)，
+                                pending 为尚未完成的 (parent_node_token, page_token) 列表（含失败的页面），
+                                与此前通过 page_callback 交出的节点一起构成可以恢复爬取的检查点
+    :param checkpoint_interval: 检查点间隔（秒）
+    :param cancel_event: 可选的 threading.Event，置位后爬取在当前在途请求中的任意一个返回时停止：
+                         尚未开始的请求被取消，不再等待其余在途请求，写入检查点后抛出 CrawlCancelled
+    """
+
+    def __init__(self, fetch_page, max_workers=2, progress_callback=None, reuse_subtree=None, concurrency=None,
+                 page_callback=None, retain_tree=True, checkpoint_callback=None, checkpoint_interval=5.0,
+                 cancel_event=None):
+        self.fetch_page = fetch_page
+        self.max_workers = max(1, int(max_workers))
+        self.concurrency = concurrency
+        self.progress_callback = progress_callback
+        self.reuse_subtree = reuse_subtree
+        self.page_callback = page_callback
+        self.retain_tree = retain_tree
+        self.checkpoint_callback = checkpoint_callback
+        self.checkpoint_interval = checkpoint_interval
+        self.cancel_event = cancel_event
+        self.total_count = 0
+        self.nodes_fetched = 0
+        self.pages_fetched = 0
+        self.failed_pages = 0
+        self.failed_jobs = []
+        self.subtrees_reused = 0
+        self.tree = None
+
+    def crawl(self, parent_node_token=None, page_token=None, resume_from=None):
+        """
+        爬取 parent_node_token 下的完整子树
+        :param resume_from: 可选，从检查点恢复时传入 (已拉取节点构成的 WikiTreeBuilder, 未完成的页面列表)，
+                            retain_tree 为 False 时第一项为已拉取的节点数
+        :return: 顶层节点列表，有子节点的节点带有 children 字段
+        """
+        if resume_from is not None:
+            fetched, remaining = resume_from
+            self.tree = fetched if self.retain_tree else None
+            self.total_count = len(fetched) if self.retain_tree else fetched
+            frontier = deque(remaining)
+        else:
+            self.tree = WikiTreeBuilder(parent_node_token) if self.retain_tree else None
+            frontier = deque([(parent_node_token, page_token)])
+        in_flight = {}
+        last_checkpoint = time.monotonic()
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='wiki-crawl')
+        try:
+            while frontier or in_flight:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    # 在途请求的结果不再处理，它们和 frontier 一起留在检查点中
+                    if self.checkpoint_callback:
+                        self.checkpoint_callback(list(in_flight.values()) + list(frontier) + self.failed_jobs)
+                    raise CrawlCancelled(f"Crawl cancelled after {self.pages_fetched} pages")
+
+                # 填满当前并发窗口，在途请求数始终不超过 max_workers
+                window = self.window()
+                while frontier and len(in_flight) < window:
+                    job = frontier.popleft()
+                    in_flight[executor.submit(self.fetch_page, *job)] = job
+
+                # 可以取消时每秒醒来检查一次，不必等到在途请求（可能正在等待限流配额）返回
+                done, _ = wait(in_flight, timeout=1 if self.cancel_event is not None else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    job_parent_token = job[0]
+                    try:
+                        data = future.result()
+                    except Exception as exc:
+                        if job_parent_token == parent_node_token:
+                            # 顶层页面失败意味着整棵树都拿不到，交给上层处理
+                            for pending in in_flight:
+                                pending.cancel()
+                            raise
+                        logger.error(f'{job_parent_token} generated an exception: {exc}')
+                        self.failed_pages += 1
+                        self.failed_jobs.append(job)
+                        # 继续处理其他节点，不中断整个过程
+                        continue
+
+                    self.pages_fetched += 1
+                    items = data.get("items", []) or []
+                    self.total_count += len(items)
+                    self.nodes_fetched += len(items)
+                    if self.tree is not None:
+                        added = self.tree.add_children(job_parent_token, items)
+                    else:
+                        # 过滤掉缺少node_token的节点
+                        added = [item for item in items if item.get('node_token')]
+                    if self.page_callback:
+                        self.page_callback(job_parent_token, added)
+
+                    for item in added:
+                        if not item.get('has_child'):
+                            continue
+                        reused = self.reuse_subtree(item) if self.reuse_subtree else None
+                        if reused is None:
+                            frontier.append((item['node_token'], None))
+                        else:
+                            self.total_count += self.tree.graft(item, reused) if self.tree is not None else count_nodes(reused)
+                            self.subtrees_reused += 1
+
+                    # 同一父节点的下一页排在队尾，保证兄弟节点的顺序不变
+                    if data.get('has_more') and data.get('page_token'):
+                        frontier.append((job_parent_token, data.get('page_token')))
+
+                    self._report_progress()
+
+                if self.checkpoint_callback and time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    self.checkpoint_callback(list(in_flight.values()) + list(frontier) + self.failed_jobs)
+                    last_checkpoint = time.monotonic()
+        finally:
+            # 正常结束时已没有在途请求；取消或失败时不等待仍在进行的请求，排队中的请求直接取消
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return self.tree.roots if self.tree is not None else []
+
+    def window(self):
+        """当前允许的在途请求数"""
+        if self.concurrency is None:
+            return self.max_workers
+        return max(1, min(self.max_workers, self.concurrency.limit))
+
+    def _report_progress(self):
+        if not self.progress_callback:
+            return
+        try:
+            self.progress_callback(self.total_count)
+        except Exception as e:
+            # 记录错误但不中断主流程
+            logger.error(f"Progress callback error: {str(e)}")
+
+
+class AsyncWikiCrawler:
+    """
+    WikiCrawler 的 asyncio 版本，参数和行为与 WikiCrawler 相同，crawl 为协程
+    每个待拉取的页面是一个 asyncio 任务，在途请求数由 asyncio.Semaphore 限制为 max_concurrency，
+    频率由 fetch_page 内部使用的共享限流器控制；等待响应或限流配额时不占用线程，
+    爬取数千个页面也只需要运行事件循环的一个线程。
+    :param fetch_page: 拉取一页子节点的协程函数，签名为 fetch_page(parent_node_token, page_token)
+    :param max_concurrency: 同时在途的分页请求数上限
+    :param progress_callback: 进度回调，可以是普通函数或协程函数（在事件循环中 await），参数为已获取的节点总数
+    :param page_callback: 可选，每拉取到一页子节点时调用 page_callback(parent_node_token, items)，同样可以是协程函数
+    其余参数见 WikiCrawler；cancel_event 之外，直接取消运行 crawl 的任务同样会停止爬取（不写入检查点）
+    """
+
+    def __init__(self, fetch_page, max_concurrency=8, progress_callback=None, reuse_subtree=None,
+                 page_callback=None, retain_tree=True, checkpoint_callback=None, checkpoint_interval=5.0,
+                 cancel_event=None):
+        self.fetch_page = fetch_page
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.progress_callback = progress_callback
+        self.reuse_subtree = reuse_subtree
+        self.page_callback = page_callback
+        self.retain_tree = retain_tree
+        self.checkpoint_callback = checkpoint_callback
+        self.checkpoint_interval = checkpoint_interval
+        self.cancel_event = cancel_event
+        self.total_count = 0
+        self.nodes_fetched = 0
+        self.pages_fetched = 0
+        self.failed_pages = 0
+        self.failed_jobs = []
+        self.subtrees_reused = 0
+        self.tree = None
+
+    async def crawl(self, parent_node_token=None, page_token=None, resume_from=None):
+        """
+        爬取 parent_node_token 下的完整子树
+        :param resume_from: 可选，从检查点恢复时传入 (已拉取节点构成的 WikiTreeBuilder, 未完成的页面列表)，
+                            retain_tree 为 False 时第一项为已拉取的节点数
+        :return: 顶层节点列表，有子节点的节点带有 children 字段
+        """
+        if resume_from is not None:
+            fetched, remaining = resume_from
+            self.tree = fetched if self.retain_tree else None
+            self.total_count = len(fetched) if self.retain_tree else fetched
+        else:
+            self.tree = WikiTreeBuilder(parent_node_token) if self.retain_tree else None
+            remaining = [(parent_node_token, page_token)]
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        completed = asyncio.Queue()
+        # 尚未处理完的页面（排队等待信号量的和在途的），检查点时写入 frontier
+        pending = {}
+        last_checkpoint = time.monotonic()
+
+        async def fetch(job):
+            try:
+                async with semaphore:
+                    data = await self.fetch_page(*job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                completed.put_nowait((job, None, exc))
+            else:
+                completed.put_nowait((job, data, None))
+
+        def schedule(job):
+            # 分页重叠时同一页面可能被发现两次
+            if job not in pending:
+                pending[job] = asyncio.ensure_future(fetch(job))
+
+        for job in remaining:
+            schedule(tuple(job))
+        try:
+            while pending:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    if self.checkpoint_callback:
+                        self.checkpoint_callback(list(pending) + self.failed_jobs)
+                    raise CrawlCancelled(f"Crawl cancelled after {self.pages_fetched} pages")
+
+                try:
+                    # 可以取消时每秒醒来检查一次
+                    job, data, exc = await asyncio.wait_for(
+                        completed.get(), timeout=1 if self.cancel_event is not None else None
+                    )
+                except asyncio.TimeoutError:
+                    continue
+                del pending[job]
+                job_parent_token = job[0]
+                if exc is not None:
+                    if job_parent_token == parent_node_token:
+                        # 顶层页面失败意味着整棵树都拿不到，交给上层处理
+                        raise exc
+                    logger.error(f'{job_parent_token} generated an exception: {exc}')
+                    self.failed_pages += 1
+                    self.failed_jobs.append(job)
+                    continue
+
+                self.pages_fetched += 1
+                items = data.get("items", []) or []
+                self.total_count += len(items)
+                self.nodes_fetched += len(items)
+                if self.tree is not None:
+                    added = self.tree.add_children(job_parent_token, items)
+                else:
+                    # 过滤掉缺少node_token的节点
+                    added = [item for item in items if item.get('node_token')]
+                if self.page_callback:
+                    await _call(self.page_callback, job_parent_token, added)
+
+                for item in added:
+                    if not item.get('has_child'):
+                        continue
+                    reused = self.reuse_subtree(item) if self.reuse_subtree else None
+                    if reused is None:
+                        schedule((item['node_token'], None))
+                    else:
+                        self.total_count += self.tree.graft(item, reused) if self.tree is not None else count_nodes(reused)
+                        self.subtrees_reused += 1
+
+                # 同一父节点的下一页在上一页处理完之后才开始拉取，保证兄弟节点的顺序不变
+                if data.get('has_more') and data.get('page_token'):
+                    schedule((job_parent_token, data.get('page_token')))
+
+                await self._report_progress()
+
+                if self.checkpoint_callback and time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                    self.checkpoint_callback(list(pending) + self.failed_jobs)
+                    last_checkpoint = time.monotonic()
+        finally:
+            # 取消或失败时不再等待其余请求
+            for task in pending.values():
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending.values(), return_exceptions=True)
+
+        return self.tree.roots if self.tree is not None else []
+
+    def window(self):
+        """当前允许的在途请求数"""
+        return self.max_concurrency
+
+    async def _report_progress(self):
+        if not self.progress_callback:
+            return
+        try:
+            await _call(self.progress_callback, self.total_count)
+        except Exception as e:
+            # 记录错误但不中断主流程
+            logger.error(f"Progress callback error: {str(e)}")
+
+
+async def _call(callback, *args):
+    """调用普通函数或协程函数形式的回调"""
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
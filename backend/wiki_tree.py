@@ -0,0 +1,130 @@
+from collections import deque
+
+
+class WikiTreeBuilder:
+    """
+    知识库节点树构建器
+    通过 token -> 节点 的索引挂载子节点，每次挂载都是 O(1)，整棵树的构建与节点数成线性关系
+    :param root_token: 树根的 parent_node_token，None 表示知识空间顶层
+    """
+
+    def __init__(self, root_token=None):
+        self.root_token = root_token
+        self.roots = []
+        self.index = {}
+
+    def add_children(self, parent_token, items):
+        """
+        把一页子节点挂到 parent_token 下
+        缺少 node_token 的节点以及已经出现过的节点（例如分页重叠）会被忽略
+        :return: 实际挂载的节点列表
+        """
+        if parent_token == self.root_token:
+            siblings = self.roots
+        else:
+            siblings = self.index[parent_token].setdefault('children', [])
+
+        added = []
+        for item in items:
+            token = item.get('node_token')
+            if not token or token in self.index:
+                continue
+            self.index[token] = item
+            if item.get('has_child'):
+                item['children'] = []
+            added.append(item)
+        siblings.extend(added)
+        return added
+
+    def graft(self, item, children):
+        """
+        把一棵已有的子树（例如缓存中的子树）整体挂到 item 下，并为其中所有节点建立索引
+        :return: 挂载的节点数
+        """
+        item['children'] = children
+        count = 0
+        stack = list(children)
+        while stack:
+            node = stack.pop()
+            self.index[node['node_token']] = node
+            count += 1
+            stack.extend(node.get('children') or [])
+        return count
+
+    def get(self, node_token):
+        return self.index.get(node_token)
+
+    def __contains__(self, node_token):
+        return node_token in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+
+def iter_tree_batches(roots, batch_size, root_token=None):
+    """
+    按广度优先遍历节点树，依次产出 (parent_node_token, 子节点批次)
+    每个父节点的子节点按 batch_size 切分，父节点总是先于其子节点产出
+    """
+    pending = deque([(root_token, roots)])
+    while pending:
+        parent_token, children = pending.popleft()
+        for start in range(0, len(children), batch_size):
+            yield parent_token, children[start:start + batch_size]
+        for child in children:
+            if child.get('children'):
+                pending.append((child['node_token'], child['children']))
+
+
+def count_nodes(roots):
+    """节点树（含所有子孙节点）的节点数"""
+    count = 0
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.get('children') or [])
+    return count
+
+
+def find_node(roots, node_token):
+    """在节点树中查找 node_token 对应的节点，找不到时返回 None"""
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        if node.get('node_token') == node_token:
+            return node
+        stack.extend(node.get('children') or [])
+    return None
+
+
+def iter_markdown_outline(roots, max_depth=None, show_token=True, expanded=None, target_token=None):
+    """
+    把节点树渲染为 Markdown 大纲，逐行产出，格式与前端 formatNodesToMarkdown 一致
+    :param max_depth: 最多渲染的层数，None 表示不限
+    :param show_token: 是否在标题后附带 (token: xxx)
+    :param expanded: 可选的已展开节点 token 集合；提供时只渲染已展开的节点以及目标节点下的整棵子树，
+                     与前端 formatExpandedNodesToMarkdown 一致
+    :param target_token: 配合 expanded 使用的目标节点
+    """
+    # (节点, 层级, 是否在目标路径上)，顶层节点的目标路径状态在出栈时计算
+    stack = [(node, 0, None) for node in reversed(roots)]
+    while stack:
+        node, level, in_target_path = stack.pop()
+        token = node.get('node_token') or '[NODE TOKEN MISSING]'
+        if expanded is not None:
+            if in_target_path is None:
+                in_target_path = token == target_token
+            if token not in expanded and not in_target_path:
+                continue
+
+        title = node.get('title') or ''
+        if show_token:
+            yield f"{'  ' * level}- {title} (token: {token})\n"
+        else:
+            yield f"{'  ' * level}- {title}\n"
+
+        if max_depth is not None and level + 1 >= max_depth:
+            continue
+        for child in reversed(node.get('children') or []):
+            stack.append((child, level + 1, bool(in_target_path) and child.get('node_token') != target_token))
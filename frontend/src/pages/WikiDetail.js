@@ -191,8 +191,11 @@ const WikiDetail = () => {
       const allNodes = await new Promise((resolve, reject) => {
         let isConnectionClosed = false;
         let receivedData = null;
+        // 增量模式下按批次收到的节点，通过 node_token 索引挂到父节点上
+        const rootNodes = [];
+        const nodeIndex = new Map();
         
-        const eventSource = new EventSource(`${apiClient.defaults.baseURL}/api/wiki/${spaceId}/nodes/all/stream?token=${encodeURIComponent(userAccessToken)}`);
+        const eventSource = new EventSource(`${apiClient.defaults.baseURL}/api/wiki/${spaceId}/nodes/all/stream?mode=incremental&token=${encodeURIComponent(userAccessToken)}`);
         
         const handleMessage = async (event) => {
           try {
@@ -203,7 +206,8 @@ const WikiDetail = () => {
             const data = JSON.parse(event.data);
             
             if (data.type === 'progress') {
-              cumulativeCount += data.count;
+              // 后端返回的是已获取的节点总数
+              cumulativeCount = data.count;
               
               // 更新缓存的节点计数
               setFullNavigationCache(prev => ({
@@ -230,8 +234,16 @@ const WikiDetail = () => {
               if (onProgress) {
                 onProgress(cumulativeCount);
               }
-            } else if (data.type === 'result') {
-              receivedData = data.data;
+            } else if (data.type === 'nodes') {
+              const items = data.items.map(item => (item.has_child ? { ...item, children: [] } : item));
+              items.forEach(item => nodeIndex.set(item.node_token, item));
+              if (!data.parent) {
+                rootNodes.push(...items);
+              } else if (nodeIndex.has(data.parent)) {
+                nodeIndex.get(data.parent).children.push(...items);
+              }
+            } else if (data.type === 'result' || data.type === 'done') {
+              receivedData = data.type === 'result' ? data.data : rootNodes;
               isConnectionClosed = true;
               eventSource.removeEventListener('message', handleMessage);
               eventSource.removeEventListener('error', handleError);
@@ -567,8 +579,8 @@ const WikiDetail = () => {
         hasAnalysis: false
       }));
 
-      // 使用统一的全量导航数据获取函数（支持缓存机制）
-      const allNodes = await getFullNavigationData({
+      // 使用统一的全量导航数据获取函数（支持缓存机制），同时让后端缓存好节点树
+      await getFullNavigationData({
         onProgress: (count) => {
           // 更新模态窗中的节点计数
           setDocImportAnalysisState(prev => ({
@@ -579,13 +591,12 @@ const WikiDetail = () => {
         source: '文档导入AI评估'
       });
       
-      const wiki_node_md = formatNodesToMarkdown(allNodes);
       // 获取知识库标题
       const wikiTitle = await getSpaceName(spaceId);
       
-      // 定义占位符字典 - 后端会负责替换IMPORTED_DOCUMENT_CONTENT占位符
+      // 定义占位符字典 - 后端会负责替换IMPORTED_DOCUMENT_CONTENT占位符，
+      // KNOWLEDGE_BASE_STRUCTURE 由后端根据 space_id 渲染
       const placeholders = {
-        'KNOWLEDGE_BASE_STRUCTURE': wiki_node_md,
         'WIKI_TITLE': wikiTitle
       };
 
@@ -600,7 +611,7 @@ const WikiDetail = () => {
         data: {
           doc_token: docToken,
           doc_type: docType,
-          wiki_node_md: wiki_node_md,
+          space_id: spaceId,
           api_key: storedApiKey,
           model: storedModel,
           prompt_template: storedPrompt,
@@ -611,7 +622,6 @@ const WikiDetail = () => {
 
       console.log('Sending request to /api/llm/doc_import_analysis with data:', {
         ...config.data,
-        wiki_node_md: `${config.data.wiki_node_md?.substring(0, 100)}...`, // 只记录前100个字符
         prompt_template: `${config.data.prompt_template?.substring(0, 100)}...` // 只记录前100个字符
       });
 
@@ -771,6 +781,7 @@ const WikiDetail = () => {
   
   // 开始知识库AI分析任务
   const startWikiAnalysis = async () => {
+    const userAccessToken = localStorage.getItem('user_access_token');
     const storedApiKey = localStorage.getItem('llm_api_key');
     const storedModel = localStorage.getItem('llm_model') || 'doubao-seed-1-6-thinking-250615';
     const storedPrompt = localStorage.getItem('prompt_wiki_analysis') || `你是一位知识管理专家，擅长检查知识库的结构是否合理。用户希望优化现有的知识库结构，以更好地服务于大模型知识问答。请使用Markdown格式输出评估结果，确保结构清晰、重要信息高亮。
@@ -820,8 +831,8 @@ const WikiDetail = () => {
     }));
 
     try {
-      // 使用统一的全量导航数据获取函数（支持缓存机制）
-      const allNodes = await getFullNavigationData({
+      // 使用统一的全量导航数据获取函数（支持缓存机制），同时让后端缓存好节点树
+      await getFullNavigationData({
         onProgress: (count) => {
           // 更新模态窗中的节点计数
           setWikiAnalysisState(prev => ({
@@ -832,13 +843,11 @@ const WikiDetail = () => {
         source: '知识库AI诊断'
       });
       
-      const wiki_node_md = formatNodesToMarkdown(allNodes);
       // 获取知识库标题
       const wikiTitle = await getSpaceName(spaceId);
       
-      // 定义占位符字典
+      // 定义占位符字典，KNOWLEDGE_BASE_STRUCTURE 由后端根据 space_id 渲染
       const placeholders = {
-        'KNOWLEDGE_BASE_STRUCTURE': wiki_node_md,
         'WIKI_TITLE': wikiTitle
       };
 
@@ -847,9 +856,11 @@ const WikiDetail = () => {
         url: '/api/llm/stream_analysis',
         method: 'POST',
         headers: {
+          'Authorization': `Bearer ${userAccessToken}`,
           'Content-Type': 'application/json'
         },
         data: {
+          space_id: spaceId,
           api_key: storedApiKey,
           model: storedModel,
           prompt_template: storedPrompt,
@@ -22,7 +22,8 @@ kill -9 $(lsof -t -i:$BACKEND_PORT) 2>/dev/null || echo "端口$BACKEND_PORT上
 # 启动后端服务
 echo "正在启动后端服务..."
 cd backend
-python3 app.py &
+# 使用 uvicorn 运行 ASGI 入口，SSE 流由事件循环驱动，不再每个流占用一个线程
+python3 -m uvicorn asgi:application --host ${BACKEND_HOST:-127.0.0.1} --port $BACKEND_PORT --timeout-graceful-shutdown ${SERVER_GRACEFUL_SHUTDOWN:-5} &
 BACKEND_PID=$!
 cd ..
 